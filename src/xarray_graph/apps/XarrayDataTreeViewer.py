@@ -14,9 +14,11 @@ from importlib.metadata import version
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from os import PathLike
+    from pathlib import Path
     from xarray import DataTree
-    from qtpy.QtCore import QSize
+    from qtpy.QtCore import QSize, QModelIndex
     from qtpy.QtWidgets import QWidget
+    from xarray_graph.utils.ChangeTracker import ChangeTracker
     from xarray_graph.utils.WindowManager import WindowManager
     from xarray_graph.widgets.IPythonConsole import IPythonConsole
     from xarray_graph.tree.XarrayDataTreeItem import XarrayDataTreeItem
@@ -38,6 +40,12 @@ class XarrayDataTreeViewer(QMainWindow):
     # global console (will be initialized when needed)
     console: IPythonConsole = None
 
+    # persistent cache mode for opening proprietary file formats (None, 'structure' or 'samples', see xarray_graph.io.cache)
+    file_cache: str | None = None
+
+    # numeric array attrs with at least this many elements are saved in hidden variables (None to save all attrs as they are, see io.save_datatree)
+    array_attrs_min_size: int | None = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -56,6 +64,13 @@ class XarrayDataTreeViewer(QMainWindow):
         self._datatree_view.selectionWasChanged.connect(self.onDataTreeSelectionChanged)
         self._datatree_view.wasRefreshed.connect(self.refresh)
 
+        # changes since the datatree was loaded or last saved (for saving only changed data to Zarr)
+        # new and removed items and attrs changes are detected when saving, but inserted items may replace existing ones
+        from xarray_graph.utils.ChangeTracker import ChangeTracker
+        self._changes = ChangeTracker()
+        model.rowsInserted.connect(lambda parent_index, first, last: self._markInsertedItemsChanged(parent_index, first, last))
+        model.rowsMoved.connect(lambda src_parent_index, start, end, dst_parent_index, dst_row: self._markInsertedItemsChanged(dst_parent_index, dst_row, dst_row + end - start))
+
         # setup
         self._initActions()
         self._initMenubar()
@@ -70,7 +85,18 @@ class XarrayDataTreeViewer(QMainWindow):
     
     def setDatatree(self, datatree: DataTree) -> None:
         self._datatree_view.setTreeData(datatree)
+        self._changes.markAllChanged()
         self.refresh()
+    
+    def _markInsertedItemsChanged(self, parent_index: QModelIndex, first: int, last: int) -> None:
+        model: XarrayDataTreeModel = self._datatree_view.model()
+        parent_item: XarrayDataTreeItem = model.itemFromIndex(parent_index)
+        item: XarrayDataTreeItem
+        for item in parent_item.children[first:last + 1]:
+            if item.isNode():
+                self._changes.markNodeChanged(item.node().path)
+            else:
+                self._changes.markVariableChanged(item.node().path, item.name())
 
     def onDataTreeSelectionChanged(self) -> None:
         self._updateInfoView()
@@ -89,6 +115,17 @@ class XarrayDataTreeViewer(QMainWindow):
             if isinstance(window, XarrayDataTreeViewer):
                 window.refresh()
     
+    @staticmethod
+    def markAllWindowsChanged():
+        """ Mark the datatrees of all windows as entirely changed, so that they are rewritten when next saved.
+
+        e.g., after running code in the console, whose in-place edits are not recorded.
+        """
+        window: XarrayDataTreeViewer
+        for window in XarrayDataTreeViewer.window_mgr.windows():
+            if isinstance(window, XarrayDataTreeViewer):
+                window._changes.markAllChanged()
+    
     @classmethod
     def about(cls) -> None:
         """ Popup about message dialog.
@@ -142,6 +179,8 @@ class XarrayDataTreeViewer(QMainWindow):
             console.execute('import numpy as np', hidden=True)
             console.execute('import xarray as xr', hidden=True)
             console.addVariables({'wm': self.window_mgr})
+            # code run in the console may edit any datatree in place without recording changes
+            console.executed.connect(lambda *args: XarrayDataTreeViewer.markAllWindowsChanged())
             msg = """
             ----------------------------------------------------
             Variables:
@@ -173,8 +212,10 @@ class XarrayDataTreeViewer(QMainWindow):
         return window
     
     @classmethod
-    def open(cls, filepath: str | PathLike | list[str | PathLike] = None, filetype: str = None, is_dir: bool = False) -> XarrayDataTreeViewer:
+    def open(cls, filepath: str | PathLike | list[str | PathLike] = None, filetype: str = None, is_dir: bool = False, chunks = None) -> XarrayDataTreeViewer:
         """ Load datatree from file.
+
+        chunks is passed on to open_datatree (e.g., chunks={} reads WinWCP sweeps or HEKA traces on demand).
         """
         from qtpy.QtWidgets import QApplication
         focus_widget: QWidget = QApplication.instance().focusWidget()
@@ -195,15 +236,14 @@ class XarrayDataTreeViewer(QMainWindow):
             from xarray_graph.io.io import open_datatree
             if isinstance(filepath, (list, tuple)):
                 # combine multiple files as first-level groups in single datatree
-                import xarray as xr
-                datatree = DataTree()
-                for path in filepath:
-                    path = Path(path)
-                    datatree[path.stem] = open_datatree(path, filetype=filetype)
+                datatree = cls._openDatatrees([Path(path) for path in filepath], filetype=filetype, chunks=chunks, cache=cls.file_cache)
+                if datatree is None:
+                    # canceled
+                    return
                 title = 'Combined'
             else:
                 filepath = Path(filepath)
-                datatree = open_datatree(filepath, filetype=filetype)
+                datatree = open_datatree(filepath, filetype=filetype, chunks=chunks, cache=cls.file_cache)
                 title = filepath.stem
         except Exception as err:
             from qtpy.QtWidgets import QMessageBox
@@ -217,14 +257,85 @@ class XarrayDataTreeViewer(QMainWindow):
         window.show()
         if isinstance(filepath, Path):
             window._filepath = filepath
+            window._changes.clear()
         return window
     
+    @staticmethod
+    def _openDatatrees(filepaths: list[Path], filetype: str = None, chunks = None, cache: str = None) -> DataTree | None:
+        """ Open multiple files as first-level groups in a single datatree.
+
+        Files are opened concurrently in a thread pool while a progress dialog keeps the UI responsive.
+        Each datatree is collected as soon as its file has been read, and they are combined in the order of filepaths.
+        Files that fail to open are reported and skipped (raises only if all files fail).
+        Returns None if canceled.
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        import xarray as xr
+        from qtpy.QtCore import Qt
+        from qtpy.QtWidgets import QApplication, QProgressDialog, QMessageBox
+        from xarray_graph.io.io import open_datatree
+        focus_widget: QWidget = QApplication.instance().focusWidget()
+
+        progress = QProgressDialog('Opening files...', 'Cancel', 0, len(filepaths), focus_widget)
+        progress.setWindowTitle('Open File(s)')
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setValue(0)
+
+        datatrees: dict[Path, DataTree] = {}
+        errors: dict[Path, Exception] = {}
+        executor = ThreadPoolExecutor()
+        futures = {executor.submit(open_datatree, path, filetype=filetype, chunks=chunks, cache=cache): path for path in filepaths}
+        pending = set(futures)
+        try:
+            while pending:
+                # wait briefly for files to finish so that the UI can process events in between
+                done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = futures[future]
+                    try:
+                        datatrees[path] = future.result()
+                    except Exception as err:
+                        errors[path] = err
+                    progress.setLabelText(f'Opened {path.name}')
+                    progress.setValue(len(datatrees) + len(errors))
+                QApplication.instance().processEvents()
+                if progress.wasCanceled():
+                    return
+        finally:
+            # running reads are left to finish in the background, but their results are discarded
+            executor.shutdown(wait=False, cancel_futures=True)
+            progress.close()
+        
+        if errors:
+            msg = '\n'.join(f'{path.name}: {err}' for path, err in errors.items())
+            if not datatrees:
+                raise RuntimeError(msg)
+            QMessageBox.warning(focus_widget, 'Failed to open some files', msg)
+
+        datatree = xr.DataTree()
+        for path in filepaths:
+            if path in datatrees:
+                datatree[path.stem] = datatrees[path]
+        return datatree
+    
     def save(self) -> None:
         """ Save data tree to current file.
+
+        Saving to the Zarr directory the datatree was loaded from or last saved to only rewrites the recorded changes (see ChangeTracker).
+        In-place edits of data are only recorded by the UI (e.g., XarrayGraph's mask, zero or interpolate),
+        so running code in the console marks the datatrees of all windows as entirely changed.
+        Use saveFullRewrite after any other unrecorded in-place edits.
         """
         filepath = getattr(self, '_filepath', None)
         self.saveAs(filepath)
     
+    def saveFullRewrite(self) -> None:
+        """ Save all data of the data tree to current file (e.g., after in-place edits that were not recorded).
+        """
+        self._changes.markAllChanged()
+        self.save()
+    
     def saveAs(self, filepath: str | PathLike = None, filetype: str = None) -> None:
         """ Save data tree to file.
         """
@@ -238,14 +349,118 @@ class XarrayDataTreeViewer(QMainWindow):
         filepath = Path(filepath)
         datatree: DataTree = self.datatree()
         datatree.attrs[VERSION_KEY] = XARRAY_GRAPH_VERSION
+        # only changes are written when saving to the Zarr directory the datatree was loaded from or last saved to
+        changes = self._changes if filepath == getattr(self, '_filepath', None) else None
+        # changes made while saving are recorded for the next save
+        from xarray_graph.utils.ChangeTracker import ChangeTracker
+        self._changes = ChangeTracker()
+        self._changes.clear()
         try:
-            from xarray_graph.io.io import save_datatree
-            save_datatree(datatree, filepath, filetype=filetype)
-            self._filepath = filepath
-            self.setWindowTitle(filepath.stem)
+            saved = self._saveDatatree(datatree, filepath, filetype=filetype, changes=changes)
         except Exception as err:
+            saved = False
             from qtpy.QtWidgets import QMessageBox
             QMessageBox.critical(self, 'Failed to save file', str(err))
+        if not saved:
+            self._changes.markAllChanged()
+            return
+        self._filepath = filepath
+        self.setWindowTitle(filepath.stem)
+    
+    def _saveDatatree(self, datatree: DataTree, filepath: Path, filetype: str = None, changes: ChangeTracker = None) -> bool:
+        """ Save datatree to filepath in a worker thread while a progress dialog keeps the UI responsive.
+
+        The worker saves a copy-on-write snapshot of the datatree, so edits made while saving are not written.
+        Returns False if canceled, in which case any existing file at filepath is left as it was.
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait
+        from qtpy.QtCore import Qt
+        from qtpy.QtWidgets import QApplication, QProgressDialog
+        from xarray_graph.io.io import save_datatree, SaveCanceled
+        from xarray_graph.utils.xarray_utils import copy_on_write_snapshot
+
+        progress = QProgressDialog(f'Saving {filepath.name}...', 'Cancel', 0, 0, self)
+        progress.setWindowTitle('Save File')
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setValue(0)
+
+        # written by the worker thread, read by the UI thread
+        state = {'count': 0, 'total': 0, 'name': '', 'canceled': False}
+
+        def on_progress(count: int, total: int, name: str) -> bool:
+            state.update(count=count, total=total, name=name)
+            return not state['canceled']
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            with copy_on_write_snapshot(datatree) as snapshot:
+                future = executor.submit(save_datatree, snapshot, filepath, filetype=filetype, array_attrs_min_size=self.array_attrs_min_size, changes=changes, progress=on_progress)
+                try:
+                    while not future.done():
+                        # wait briefly so that the UI can process events in between
+                        wait([future], timeout=0.05)
+                        if state['total']:
+                            progress.setMaximum(state['total'])
+                            progress.setValue(state['count'])
+                            if state['name']:
+                                progress.setLabelText(f'Saving {filepath.name}: {state["name"]}')
+                        QApplication.instance().processEvents()
+                        if progress.wasCanceled():
+                            state['canceled'] = True
+                finally:
+                    # the snapshot must not be released while the worker may still read it
+                    executor.shutdown(wait=True)
+            future.result()
+        except SaveCanceled:
+            return False
+        finally:
+            progress.close()
+        return True
+    
+    def consolidateZarrMetadata(self, filepath: str | PathLike = None) -> None:
+        """ Consolidate (or repair out of date consolidated) metadata of a Zarr directory so that it opens faster.
+        """
+        if filepath is None:
+            from qtpy.QtWidgets import QFileDialog
+            filepath = QFileDialog.getExistingDirectory(self, 'Consolidate Zarr Metadata')
+            if not filepath:
+                return
+        try:
+            from xarray_graph.io.io import consolidate_zarr_metadata
+            consolidate_zarr_metadata(filepath)
+        except Exception as err:
+            from qtpy.QtWidgets import QMessageBox
+            QMessageBox.critical(self, 'Failed to consolidate Zarr metadata', str(err))
+    
+    @classmethod
+    def setFileCache(cls, mode: str | None) -> None:
+        """ Set the persistent cache mode for opening proprietary file formats in all windows.
+        """
+        cls.file_cache = mode
+    
+    def clearFileCache(self) -> None:
+        """ Remove all entries from the persistent file cache.
+        """
+        from qtpy.QtWidgets import QMessageBox
+        from xarray_graph.io.cache import clear_cache, cache_dir
+        try:
+            removed = clear_cache()
+        except Exception as err:
+            QMessageBox.critical(self, 'Failed to clear file cache', str(err))
+            return
+        QMessageBox.information(self, 'File Cache', f'Removed {removed / 1e6:.1f} MB from {cache_dir()}')
+    
+    @classmethod
+    def setStoreArrayAttrsAsVariables(cls, enabled: bool) -> None:
+        """ Set whether large numeric array attrs are saved in hidden variables in all windows.
+        """
+        cls.array_attrs_min_size = 1000 if enabled else None
+    
+    def _updateFileCacheMenu(self) -> None:
+        for action in self._file_cache_menu.actions():
+            if action.isCheckable():
+                action.setChecked(action.data() == self.file_cache)
     
     @classmethod
     def combineWindows(cls, windows: list[XarrayDataTreeViewer] = None) -> XarrayDataTreeViewer:
@@ -390,6 +605,14 @@ class XarrayDataTreeViewer(QMainWindow):
             checkable=False,
             shortcut=QKeySequence.StandardKey.SaveAs,
             triggered=lambda: self.saveAs())
+
+        self._save_full_action = QAction(
+            icon=icon('fa5.save'),
+            iconVisibleInMenu=False,
+            text='Save (Full Rewrite)',
+            toolTip='Save all data, not only recorded changes',
+            checkable=False,
+            triggered=lambda: self.saveFullRewrite())
         
         self._theme_action_group = QActionGroup(self)
         self._theme_action_group.setExclusionPolicy(QActionGroup.ExclusionPolicy.Exclusive)
@@ -422,8 +645,17 @@ class XarrayDataTreeViewer(QMainWindow):
         self._file_menu.addSeparator()
         self._file_menu.addAction(self._save_action)
         self._file_menu.addAction(self._save_as_action)
+        self._file_menu.addAction(self._save_full_action)
         self._export_menu = self._file_menu.addMenu('Export')
         self._file_menu.addSeparator()
+        self._file_menu.addAction('Consolidate Zarr Metadata', self.consolidateZarrMetadata)
+        self._file_cache_menu = self._file_menu.addMenu('File Cache')
+        self._store_array_attrs_action = self._file_menu.addAction('Save Large Array Attrs as Variables')
+        self._store_array_attrs_action.setCheckable(True)
+        self._store_array_attrs_action.triggered.connect(self.setStoreArrayAttrsAsVariables)
+        # setting is shared by all windows, so checked state is updated whenever the menu is shown
+        self._file_menu.aboutToShow.connect(lambda: self._store_array_attrs_action.setChecked(self.array_attrs_min_size is not None))
+        self._file_menu.addSeparator()
         self._file_menu.addAction('Close Window', QKeySequence.StandardKey.Close, self.close)
         self._file_menu.addSeparator()
         self._file_menu.addAction('Quit', QKeySequence.StandardKey.Quit, QApplication.instance().quit)
@@ -432,8 +664,19 @@ class XarrayDataTreeViewer(QMainWindow):
             self._import_menu.addAction(filetype, lambda filetype=filetype: self.open(filetype=filetype))
             self._export_menu.addAction(filetype, lambda filetype=filetype: self.saveAs(filetype=filetype))
         self._import_menu.addSeparator()
-        for filetype in ['WinWCP', 'HEKA', 'LabChart MATLAB (GOlab TEVC)']:
-            self._import_menu.addAction(filetype, lambda filetype=filetype: self.open(filetype=filetype))
+        for filetype in ['WinWCP', 'HEKA', 'Axon ABF', 'LabChart MATLAB (GOlab TEVC)']:
+            # HEKA trees are built from metadata only and traces are read on demand
+            chunks = {} if filetype == 'HEKA' else None
+            self._import_menu.addAction(filetype, lambda filetype=filetype, chunks=chunks: self.open(filetype=filetype, chunks=chunks))
+
+        # cache mode is shared by all windows, so checked state is updated whenever the menu is shown
+        for text, mode in [('Off', None), ('Cache Structure', 'structure'), ('Cache Structure and Samples', 'samples')]:
+            action = self._file_cache_menu.addAction(text, lambda mode=mode: self.setFileCache(mode))
+            action.setCheckable(True)
+            action.setData(mode)
+        self._file_cache_menu.addSeparator()
+        self._file_cache_menu.addAction('Clear File Cache', self.clearFileCache)
+        self._file_cache_menu.aboutToShow.connect(self._updateFileCacheMenu)
         
         self._view_menu = menubar.addMenu('View')
         self._view_menu.addAction(self._console_action)
@@ -5,6 +5,7 @@ TODO:
 from __future__ import annotations
 
 import weakref
+from collections import OrderedDict
 from copy import deepcopy
 import numpy as np
 import xarray as xr
@@ -13,16 +14,17 @@ from cmap import Colormap
 from qtpy.QtCore import Qt, QObject, Signal
 from qtpy.QtWidgets import QWidget
 from xarray_graph.apps.XarrayDataTreeViewer import XarrayDataTreeViewer
+from xarray_graph.utils.xarray_utils import label_region, trace_block, lazily_scaled, inherited_root, ROI_KEY, MASK_KEY, NOTES_KEY
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from qtpy.QtWidgets import QGraphicsObject
     from xarray_graph.graph.Plot import Plot
+    from xarray_graph.utils.decimation import PyramidCache
+    from xarray_graph.graph.PlotCurve import PlotCurve
+    from xarray_graph.graph.BulkPlotCurve import BulkPlotCurveTrace
 
 
-ROI_KEY = '_XG_ROI'
-MASK_KEY = '_XG_MASK'
-NOTES_KEY = '_XG_NOTES'
 MASK_COLOR = (200, 200, 200)
 PREVIEW_COLOR = (255, 0, 0)
 
@@ -40,6 +42,21 @@ class XarrayGraph(XarrayDataTreeViewer):
     }
     _settings = deepcopy(_default_settings)
 
+    # memory bound for min/max pyramids of long plotted traces (see PlotCurve)
+    plot_pyramid_cache_max_bytes: int = 512 * 2**20
+
+    # also store plot pyramids for Zarr directories in a hidden Zarr store next to them (see decimation.pyramid_store_path)
+    persist_plot_pyramids: bool = False
+
+    # draw more traces than this per data_var in a plot as a single BulkPlotCurve (None to always draw a PlotCurve per trace)
+    bulk_trace_threshold: int | None = 100
+
+    # memory bound for coords converted to display units (reused across selection changes)
+    display_coords_cache_max_bytes: int = 256 * 2**20
+
+    # units -> (display units, conversion factor) or None if not convertible
+    _display_units: dict[str, tuple[str, float] | None] = {}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._roi_item_added_connected_views = weakref.WeakSet()
@@ -47,6 +64,9 @@ class XarrayGraph(XarrayDataTreeViewer):
 
     def setDatatree(self, datatree: xr.DataTree) -> None:
         super().setDatatree(datatree)
+        if getattr(self, '_plot_pyramid_cache', None) is not None:
+            self._plot_pyramid_cache.clear()
+        self._display_coords_cache = OrderedDict()
         try:
             self._notes_view.setPlainText(datatree.attrs.get(NOTES_KEY, ''))
         except AttributeError:
@@ -242,6 +262,8 @@ class XarrayGraph(XarrayDataTreeViewer):
                     xmask[(xdata >= lb) & (xdata <= ub)] = True
                 coords[xdim] = node[xdim].data[xmask]
             node.data_vars[MASK_KEY].loc[coords] = True
+            self._changes.markVariableChanged(node.path, MASK_KEY, label_region(node.data_vars[MASK_KEY], coords))
+            self.invalidatePlotPyramids(node.path)
         
         if was_mask_item_added:
             self.refresh()
@@ -272,6 +294,8 @@ class XarrayGraph(XarrayDataTreeViewer):
                     xmask[(xdata >= lb) & (xdata <= ub)] = True
                 coords[xdim] = node[xdim].data[xmask]
             node.data_vars[MASK_KEY].loc[coords] = False
+            self._changes.markVariableChanged(node.path, MASK_KEY, label_region(node.data_vars[MASK_KEY], coords))
+            self.invalidatePlotPyramids(node.path)
             if not np.any(node.data_vars[MASK_KEY].values):
                 node.dataset = node.to_dataset().drop_vars(MASK_KEY)
                 was_mask_item_removed = True
@@ -307,6 +331,9 @@ class XarrayGraph(XarrayDataTreeViewer):
                     xmask[(xdata >= lb) & (xdata <= ub)] = True
                 coords[xdim] = node[xdim].data[xmask]
             data_var.loc[coords] = 0
+            self._changes.markVariableChanged(node.path, data_var.name, label_region(data_var, coords))
+            # an inherited data_var is also changed in the ancestor it is inherited from
+            self.invalidatePlotPyramids(inherited_root(node, data_var.name).path)
             if plot_data_var is not data_var:
                 if xranges:
                     coords[xdim] = xdata[xmask]
@@ -349,6 +376,9 @@ class XarrayGraph(XarrayDataTreeViewer):
                 data_var.loc[coords] = qconstant.to(units).magnitude
             else:
                 data_var.loc[coords] = qconstant.magnitude
+            self._changes.markVariableChanged(node.path, data_var.name, label_region(data_var, coords))
+            # an inherited data_var is also changed in the ancestor it is inherited from
+            self.invalidatePlotPyramids(inherited_root(node, data_var.name).path)
             
             if plot_data_var is not data_var:
                 if xranges:
@@ -366,12 +396,10 @@ class XarrayGraph(XarrayDataTreeViewer):
         if not xranges:
             return
         
-        from xarray_graph.graph.PlotCurve import PlotCurve
         from xarray_graph.tree.XarrayDataTreeItem import XarrayDataTreeItem
         xdim = self.xdim()
         for plot in self._plots.flatten().tolist():
-            graphs = [item for item in plot.listDataItems() if isinstance(item, PlotCurve)]
-            data_graphs = [graph for graph in graphs if hasattr(graph, '_metadata') and graph._metadata.get('type', None) == 'data']
+            data_graphs = self._plotGraphs(plot, 'data')
             for graph in data_graphs:
                 item: XarrayDataTreeItem = graph._metadata.get('data_var_item', None)
                 if item is None:
@@ -380,7 +408,7 @@ class XarrayGraph(XarrayDataTreeViewer):
                 coords = graph._metadata['coords']
                 coords[xdim] = data_var[xdim]
                 ydata = data_var.sel(coords).squeeze(drop=True).data
-                xdata = graph.xData
+                xdata, _ = graph.getOriginalDataset()
                 for xrange in xranges:
                     lb, ub = xrange
                     li = np.searchsorted(xdata, lb, side='left')
@@ -394,6 +422,8 @@ class XarrayGraph(XarrayDataTreeViewer):
                     uy = ydata[ui]
                     ydata[li:ui+1] = np.interp(xdata[li:ui+1], [lx, ux], [ly, uy])
                 data_var.loc[coords] = ydata
+                self._changes.markVariableChanged(item.node().path, data_var.name, label_region(data_var, coords))
+                self.invalidatePlotPyramids(inherited_root(item.node(), data_var.name).path)
         
         self.refresh() # overkill?
 
@@ -530,6 +560,84 @@ class XarrayGraph(XarrayDataTreeViewer):
         """
         self.updatePlotData()
     
+    def plotPyramidCache(self) -> PyramidCache:
+        """ Cache of min/max pyramids of long plotted traces for fast zooming and panning.
+        """
+        from xarray_graph.utils.decimation import PyramidCache, pyramid_store_path
+        cache: PyramidCache = getattr(self, '_plot_pyramid_cache', None)
+        if cache is None:
+            cache = PyramidCache(max_bytes=self.plot_pyramid_cache_max_bytes)
+            self._plot_pyramid_cache = cache
+        filepath = getattr(self, '_filepath', None)
+        if self.persist_plot_pyramids and (filepath is not None) and (filepath.suffix == '.zarr') and filepath.is_dir():
+            cache.store_path = pyramid_store_path(filepath)
+        else:
+            cache.store_path = None
+        return cache
+    
+    def invalidatePlotPyramids(self, path: str = '/') -> None:
+        """ Discard cached plot pyramids for the node at path and its descendants (i.e., after editing their data).
+        """
+        self.plotPyramidCache().invalidate(path)
+    
+    def _displayCoord(self, coord: xr.DataArray) -> xr.DataArray | None:
+        """ Return coord converted for plotting (datetimes as datetime64[s] integers, otherwise non-prefixed units), or None if no conversion is needed.
+
+        Converted values are cached by coord variable, so unchanged coords are not converted again on every selection change.
+        Pass the coord of the node's data_var (not of a copy), as copies have new coord variables.
+        Coords that need no conversion are not cached. The cached variables count towards display_coords_cache_max_bytes
+        as they are kept alive by the cache.
+        """
+        cache: OrderedDict[int, tuple[xr.Variable, np.ndarray, str | None]] = getattr(self, '_display_coords_cache', None)
+        if cache is None:
+            cache = self._display_coords_cache = OrderedDict()
+        key = id(coord.variable)
+        cached = cache.get(key, None)
+        # the cached variable is kept alive so its id cannot be reused by another variable
+        if (cached is not None) and (cached[0] is coord.variable):
+            cache.move_to_end(key)
+            _, data, units = cached
+        else:
+            import cftime
+            data = None
+            units = coord.attrs.get('units', None)
+            if np.issubdtype(coord.dtype, np.datetime64) or ((coord.dtype == object) and (coord.size > 0) and isinstance(coord.values.flat[0], cftime.datetime)):
+                # convert datetime objects to datetime64[s] integers as required by pyqtgraph DateAxisItem
+                data = coord.values.astype('datetime64[s]').astype(int)
+                units = 'datetime64[s]'
+            elif (units is not None) and np.issubdtype(coord.dtype, np.number):
+                display_units = self.displayUnits(units)
+                if display_units is not None:
+                    # print(f'  {coord.name}: {units} -> {display_units[0]}')
+                    units, conversion_factor = display_units
+                    data = coord.values * conversion_factor if conversion_factor != 1 else coord.values
+            if data is not None:
+                cache[key] = (coord.variable, data, units)
+                nbytes = sum(variable.nbytes + cached_data.nbytes for variable, cached_data, _ in cache.values())
+                while (nbytes > self.display_coords_cache_max_bytes) and (len(cache) > 1):
+                    _, (variable, evicted, _) = cache.popitem(last=False)
+                    nbytes -= variable.nbytes + evicted.nbytes
+        if data is None:
+            return None
+        converted = coord.copy(deep=False, data=data)
+        converted.attrs['units'] = units
+        return converted
+    
+    def _plotGraphs(self, plot: Plot, graph_type: str) -> list[PlotCurve | BulkPlotCurveTrace]:
+        """ Graphs of graph_type ('data', 'masked' or 'preview') in plot, including the individual traces of bulk curves.
+        """
+        from xarray_graph.graph.PlotCurve import PlotCurve
+        from xarray_graph.graph.BulkPlotCurve import BulkPlotCurve
+        graphs = []
+        for item in plot.items:
+            if getattr(item, '_metadata', {}).get('type', None) != graph_type:
+                continue
+            if isinstance(item, PlotCurve):
+                graphs.append(item)
+            elif isinstance(item, BulkPlotCurve):
+                graphs.extend(item.traces())
+        return graphs
+    
     def tileDimension(self, dim: str, orientation: Qt.Orientation | None) -> None:
         """ Tile plots along coordinate dimension.
         """
@@ -680,28 +788,26 @@ class XarrayGraph(XarrayDataTreeViewer):
         # print(f'  xdim: {xdim}')
 
         # convert selection to non-prefixed units for plotting in pyqtgraph
+        # (data is scaled lazily, so only plotted slices are converted)
         self._selection_units: dict[str, str] = {}
-        import cftime
         for i, data_var in enumerate(self._selected_data_vars):
             name = data_var.name
+            # coords of the node's data_var (copies below have new coord variables which would never hit the display coords cache)
+            node_coords = data_var.coords
             data_var_changed = False
             units = data_var.attrs.get('units', None)
             # print(f'  {name}: {units}')
-            if units is not None:
-                try:
-                    qdata = self.ureg.Quantity(data_var.data, units)
-                    # qbase = qdata.to_base_units()
-                    qbase = XarrayGraph.drop_prefixes(qdata)
-                    base_units = str(qbase.units)
-                    # print(f'  {name}: {units} -> {base_units}')
-                    data_var = data_var.copy(deep=False, data=qbase.magnitude)
-                    data_var.attrs['units'] = base_units
-                    # conversion_factor = self.ureg.Quantity(1, units).to(base_units).magnitude
-                    # data_var.attrs[TO_DISPLAY_UNITS_KEY] = conversion_factor
-                    data_var_changed = True
-                    units = base_units
-                except:
-                    pass
+            display_units = self.displayUnits(units) if units is not None else None
+            if (display_units is not None) and np.issubdtype(data_var.dtype, np.number):
+                base_units, conversion_factor = display_units
+                # print(f'  {name}: {units} -> {base_units}')
+                if conversion_factor != 1:
+                    data_var = lazily_scaled(data_var, conversion_factor)
+                else:
+                    data_var = data_var.copy(deep=False)
+                data_var.attrs['units'] = base_units
+                data_var_changed = True
+                units = base_units
             
             if units is not None:
                 if name not in self._selection_units:
@@ -718,32 +824,13 @@ class XarrayGraph(XarrayDataTreeViewer):
                     )
                     return
             
-            for name, coord in tuple(data_var.coords.items()):
-                units = coord.attrs.get('units', None)
-                if np.issubdtype(coord.dtype, np.datetime64) or isinstance(coord.data[0], cftime.datetime):
-                    # convert datetime objects to datetime64[s] integers as required by pyqtgraph DateAxisItem
-                    datetime_values_for_pyqtgraph = coord.values.astype('datetime64[s]').astype(int)
-                    coord = coord.copy(data=datetime_values_for_pyqtgraph)
-                    coord.attrs['units'] = 'datetime64[s]'
+            for name, coord in tuple(node_coords.items()):
+                display_coord = self._displayCoord(coord)
+                if display_coord is not None:
+                    coord = display_coord
                     data_var = data_var.assign_coords({name: coord})
                     data_var_changed = True
-                    units = 'datetime64[s]'
-                elif units is not None:
-                    try:
-                        qdata = self.ureg.Quantity(coord.data, units)
-                        # qbase = qdata.to_base_units()
-                        qbase = XarrayGraph.drop_prefixes(qdata)
-                        base_units = str(qbase.units)
-                        # print(f'  {name}: {units} -> {base_units}')
-                        coord = coord.copy(deep=False, data=qbase.magnitude)
-                        coord.attrs['units'] = base_units
-                        # conversion_factor = self.ureg.Quantity(1, units).to(base_units).magnitude
-                        # coord.attrs[TO_DISPLAY_UNITS_KEY] = conversion_factor
-                        data_var = data_var.assign_coords({name: coord})
-                        data_var_changed = True
-                        units = base_units
-                    except:
-                        pass
+                units = coord.attrs.get('units', None)
                 
                 if units is not None:    
                     if name not in self._selection_units:
@@ -1190,9 +1277,11 @@ class XarrayGraph(XarrayDataTreeViewer):
         from qtpy.QtGui import QPen, QBrush
         from xarray_graph.graph.View import View
         from xarray_graph.graph.PlotCurve import PlotCurve
+        from xarray_graph.graph.BulkPlotCurve import BulkPlotCurve
         from xarray_graph.graph.PlotCurveStyle import PlotCurveStyle
         from xarray_graph.tree.XarrayDataTreeItem import XarrayDataTreeItem
         from pyqtgraph import AxisItem, DateAxisItem, mkPen
+        pyramid_cache = self.plotPyramidCache()
         bottomAxisChanged = False
         for plot in plots:
             view: View = plot.getViewBox()
@@ -1215,9 +1304,14 @@ class XarrayGraph(XarrayDataTreeViewer):
             graphs = [item for item in plot.listDataItems() if isinstance(item, PlotCurve)]
             data_graphs = [graph for graph in graphs if hasattr(graph, '_metadata') and graph._metadata.get('type', None) == 'data']
             masked_graphs = [graph for graph in graphs if hasattr(graph, '_metadata') and graph._metadata.get('type', None) == 'masked']
+            bulk_curves = [item for item in plot.items if isinstance(item, BulkPlotCurve)]
+            data_bulk_curves = [curve for curve in bulk_curves if getattr(curve, '_metadata', {}).get('type', None) == 'data']
+            masked_bulk_curves = [curve for curve in bulk_curves if getattr(curve, '_metadata', {}).get('type', None) == 'masked']
 
             data_count = 0
             masked_count = 0
+            data_bulk_count = 0
+            masked_bulk_count = 0
             color_index = 0
             color = cmap[color_index]
             item: XarrayDataTreeItem
@@ -1261,72 +1355,114 @@ class XarrayGraph(XarrayDataTreeViewer):
                 non_xdim_coord_permutations = plot._metadata['non_xdim_coord_permutations']
                 if len(non_xdim_coord_permutations) == 0:
                     non_xdim_coord_permutations = [{}]
-                for coords in non_xdim_coord_permutations:
-                    # print(f'  coords: {coords}...')
+                # all traces in a single indexing operation
+                ytraces, trace_indices = trace_block(data_var, xdim, non_xdim_coord_permutations)
+                if xdim in data_var.coords:
+                    xdata: np.ndarray = data_var.coords[xdim].values
+                else:
+                    xdata: np.ndarray = np.arange(data_var.sizes[xdim])
+                
+                # categorical xdim values?
+                if is_xdim_categorical:
+                    intersect, xdata_indices, all_xtick_labels_indices = np.intersect1d(xdata, all_xtick_labels, assume_unique=True, return_indices=True)
+                    xdata = np.sort(all_xtick_labels_indices)
+                
+                # skip all NaN traces
+                is_all_nan = np.all(np.isnan(ytraces), axis=1)
+                
+                # mask data?
+                masked_ytraces = None
+                if (mask is not None) and (var_name != MASK_KEY):
+                    mask_coords = [{dim: value for dim, value in coords.items() if dim in data_var.dims} for coords in non_xdim_coord_permutations]
+                    mask_traces, mask_trace_indices = trace_block(mask, xdim, mask_coords)
+                    mask_rows = np.full(len(non_xdim_coord_permutations), -1)
+                    mask_rows[mask_trace_indices] = np.arange(len(mask_trace_indices))
+                    mask_rows = mask_rows[trace_indices]
+                    trace_masks = np.zeros(ytraces.shape, dtype=bool)
+                    trace_masks[mask_rows >= 0] = mask_traces[mask_rows[mask_rows >= 0]]
+                    # don't overwrite original data
+                    masked_ytraces = np.where(trace_masks, np.nan, ytraces)
+                
+                # graph names are path plus non-xdim coords
+                rows = np.flatnonzero(~is_all_nan)
+                trace_coords = [non_xdim_coord_permutations[i] for i in trace_indices[rows]]
+                trace_names = []
+                for coords in trace_coords:
                     index_coords = {dim: values for dim, values in coords.items() if dim in data_var.dims}
-                    nonindex_coords = {dim: values for dim, values in coords.items() if dim in data_var.coords and dim not in data_var.dims}
+                    name = item.abspath()
                     if index_coords:
-                        data_var_slice = data_var.sel(index_coords)
-                    else:
-                        data_var_slice = data_var
-                    for name, coord in nonindex_coords.items():
-                        try:
-                            data_var_slice = data_var_slice.where(data_var_slice.coords[name] == coord, drop=True)
-                        except:
-                            pass
-                    data_var_slice = data_var_slice.reset_coords(drop=True).squeeze(drop=True)
-                    if xdim in data_var_slice.coords:
-                        xdim_coord_slice = data_var_slice.coords[xdim]
-                        xdata: np.ndarray = xdim_coord_slice.values
+                        name += '[' + ','.join([f'{dim}={index_coords[dim]}' for dim in index_coords]) + ']'
+                    trace_names.append(name)
+                
+                # pile many traces in a single graphics item
+                is_bulk = (self.bulk_trace_threshold is not None) and (len(rows) > self.bulk_trace_threshold) \
+                    and (marker is None) and np.issubdtype(xdata.dtype, np.number)
+                if is_bulk:
+                    bulk_ytraces = ytraces if len(rows) == len(ytraces) else ytraces[rows]
+                    if masked_ytraces is not None:
+                        if self.isMaskedVisible():
+                            if len(masked_bulk_curves) > masked_bulk_count:
+                                masked_bulk_curve = masked_bulk_curves[masked_bulk_count]
+                            else:
+                                masked_bulk_curve = BulkPlotCurve()
+                                plot.addItem(masked_bulk_curve)
+                                masked_bulk_curves.append(masked_bulk_curve)
+                            masked_bulk_count += 1
+                            masked_bulk_curve.setData(xdata, bulk_ytraces, pen=mkPen(color=MASK_COLOR, width=1), names=[name + ' masked' for name in trace_names])
+                            masked_bulk_curve._metadata = {'type': 'masked', 'data_var_item': item}
+                            for trace, coords in zip(masked_bulk_curve.traces(), trace_coords):
+                                trace._metadata = {
+                                    'type': 'masked',
+                                    'data_var_item': item,
+                                    'plot_data_var': data_var,
+                                    'coords': coords,
+                                    'units': data_var.attrs.get('units', None)
+                                }
+                            masked_bulk_curve.setZValue(0)
+                        bulk_ytraces = masked_ytraces if len(rows) == len(ytraces) else masked_ytraces[rows]
+                    if len(data_bulk_curves) > data_bulk_count:
+                        data_bulk_curve = data_bulk_curves[data_bulk_count]
                     else:
-                        xdata: np.ndarray = np.arange(data_var_slice.sizes[xdim])
-                    ydata: np.ndarray = data_var_slice.values
-                    if np.all(np.isnan(ydata)):
-                        continue
-                    # print(f'    xdata: {xdata}')
-                    # print(f'    ydata: {ydata}')
+                        data_bulk_curve = BulkPlotCurve()
+                        plot.addItem(data_bulk_curve)
+                        data_bulk_curves.append(data_bulk_curve)
+                    data_bulk_count += 1
+                    data_bulk_curve.setData(xdata, bulk_ytraces, pen=linePen, names=trace_names)
+                    data_bulk_curve._metadata = {'type': 'data', 'data_var_item': item}
+                    for trace, coords in zip(data_bulk_curve.traces(), trace_coords):
+                        trace._metadata = {
+                            'type': 'data',
+                            'data_var_item': item,
+                            'plot_data_var': data_var,
+                            'coords': coords,
+                            'units': data_var.attrs.get('units', None)
+                        }
+                    data_bulk_curve.setZValue(1)
+                    # no individual curves
+                    rows = []
+                
+                for row, coords, name in zip(rows, trace_coords, trace_names):
+                    ydata: np.ndarray = ytraces[row]
 
-                    # categorical xdim values?
-                    if is_xdim_categorical:
-                        intersect, xdata_indices, all_xtick_labels_indices = np.intersect1d(xdata, all_xtick_labels, assume_unique=True, return_indices=True)
-                        xdata = np.sort(all_xtick_labels_indices)
-                        # xdim_coord_slice = data_var_slice.coords[xdim].copy(data=xdata)
+                    # for cached min/max pyramids of long traces
+                    pyramid_key = (node.path, var_name, xdim, str(data_var.attrs.get('units', None)), tuple((dim, str(value)) for dim, value in coords.items()))
 
-                    # graph name is path plus non-xdim coords
-                    name = item.abspath()
-                    if index_coords:
-                        name += '[' + ','.join([f'{dim}={index_coords[dim]}' for dim in index_coords]) + ']'
-                    
                     # mask data?
-                    mask_slice = None
-                    if (mask is not None) and (var_name != MASK_KEY):
-                        if index_coords:
-                            mask_slice = mask.sel(index_coords)
-                        else:
-                            mask_slice = mask
-                        for name, coord in nonindex_coords.items():
-                            try:
-                                mask_slice = mask_slice.where(mask_slice.coords[name] == coord, drop=True)
-                            except:
-                                pass
-                        mask_slice = mask_slice.reset_coords(drop=True).squeeze(drop=True)
+                    if masked_ytraces is not None:
                         raw_ydata = ydata
-                        ydata = ydata.copy() # don't overwrite original data
-                        # if ydata.shape != mask_slice.values.shape:
-                        #     mask_slice = mask_slice.any(dim=[dim for dim in mask_slice.dims if dim not in data_var_slice.dims])
-                        # print(ydata.shape, mask_slice.values.shape, data_var_slice.sizes, mask_slice.sizes)
-                        ydata[mask_slice.values] = np.nan
+                        ydata = masked_ytraces[row]
 
                         # graph masked data
                         if self.isMaskedVisible():
                             if len(masked_graphs) > masked_count:
                                 # update existing data in plot
                                 masked_graph = masked_graphs[masked_count]
-                                masked_graph.setData(x=xdata, y=raw_ydata)
+                                masked_graph.setData(x=xdata, y=raw_ydata, pyramidCache=pyramid_cache, pyramidKey=pyramid_key + ('masked',))
                             else:
                                 # add new data to plot
-                                masked_graph = PlotCurve(x=xdata, y=raw_ydata)
+                                masked_graph = PlotCurve(x=xdata, y=raw_ydata, pyramidCache=pyramid_cache, pyramidKey=pyramid_key + ('masked',))
                                 plot.addItem(masked_graph)
+                                masked_graph.updateDecimation()
                                 masked_graphs.append(masked_graph)
                             masked_count += 1
                             masked_graph._metadata = {
@@ -1345,11 +1481,12 @@ class XarrayGraph(XarrayDataTreeViewer):
                     if len(data_graphs) > data_count:
                         # update existing data in plot
                         data_graph = data_graphs[data_count]
-                        data_graph.setData(x=xdata, y=ydata)
+                        data_graph.setData(x=xdata, y=ydata, pyramidCache=pyramid_cache, pyramidKey=pyramid_key + ('data',))
                     else:
                         # add new data to plot
-                        data_graph = PlotCurve(x=xdata, y=ydata)
+                        data_graph = PlotCurve(x=xdata, y=ydata, pyramidCache=pyramid_cache, pyramidKey=pyramid_key + ('data',))
                         plot.addItem(data_graph)
+                        data_graph.updateDecimation()
                         data_graphs.append(data_graph)
                     data_count += 1
                     data_graph._metadata = {
@@ -1372,7 +1509,7 @@ class XarrayGraph(XarrayDataTreeViewer):
                 color = cmap[color_index]
             
             # remove extra graph items from plot
-            cleanup_graphs = [(data_graphs, data_count), (masked_graphs, masked_count)]
+            cleanup_graphs = [(data_graphs, data_count), (masked_graphs, masked_count), (data_bulk_curves, data_bulk_count), (masked_bulk_curves, masked_bulk_count)]
             for graphs, count in cleanup_graphs:
                 while len(graphs) > count:
                     graph = graphs.pop()
@@ -1421,9 +1558,8 @@ class XarrayGraph(XarrayDataTreeViewer):
                     xunits = linked_xaxis.labelUnits
             
             # existing graphs in plot
-            graphs = [item for item in plot.listDataItems() if isinstance(item, PlotCurve)]
-            data_graphs = [graph for graph in graphs if hasattr(graph, '_metadata') and graph._metadata.get('type', None) == 'data']
-            preview_graphs = [graph for graph in graphs if hasattr(graph, '_metadata') and graph._metadata.get('type', None) == 'preview']
+            data_graphs = self._plotGraphs(plot, 'data')
+            preview_graphs: list[PlotCurve] = self._plotGraphs(plot, 'preview')
 
             for graph in data_graphs:
                 graph._metadata['preview'] = None
@@ -1481,6 +1617,7 @@ class XarrayGraph(XarrayDataTreeViewer):
                         # add new data to plot
                         preview_graph = PlotCurve(x=xpreview, y=ypreview)
                         plot.addItem(preview_graph)
+                        preview_graph.updateDecimation()
                         preview_graphs.append(preview_graph)
                     preview_count += 1
                     preview_graph._metadata = {
@@ -1565,8 +1702,7 @@ class XarrayGraph(XarrayDataTreeViewer):
             yunits = yaxis.labelUnits
             
             # existing graphs in plot
-            graphs = [item for item in plot.listDataItems() if isinstance(item, PlotCurve)]
-            data_graphs: list[PlotCurve] = [graph for graph in graphs if hasattr(graph, '_metadata') and graph._metadata.get('type', None) == 'data']
+            data_graphs: list[PlotCurve | BulkPlotCurveTrace] = self._plotGraphs(plot, 'data')
             for graph in data_graphs:
                 preview_graph: PlotCurve = graph._metadata.get('preview', None)
                 if preview_graph is None:
@@ -1588,18 +1724,20 @@ class XarrayGraph(XarrayDataTreeViewer):
                         blank = np.full(data_var.shape, np.nan)
                         result_var = data_var.copy(data=blank)
                         dt[result_path] = result_var
+                    _, preview_ydata = preview_graph.getOriginalDataset()
                     if data_var_units and (plot_data_var_units != data_var_units):
                         conversion_factor = (1.0 * self.ureg(plot_data_var_units)).to(data_var_units).magnitude
-                        result_var.loc[coords] = preview_graph.yData * conversion_factor
+                        result_var.loc[coords] = preview_ydata * conversion_factor
                     else:
-                        result_var.loc[coords] = preview_graph.yData
+                        result_var.loc[coords] = preview_ydata
                 elif dst == 'new window':
                     result_path = result_name.rstrip('/') + f'/{data_var.name}'
+                    _, preview_ydata = preview_graph.getOriginalDataset()
                     if data_var_units and (plot_data_var_units != data_var_units):
                         conversion_factor = (1.0 * self.ureg(plot_data_var_units)).to(data_var_units).magnitude
-                        result_ydata = preview_graph.yData * conversion_factor
+                        result_ydata = preview_ydata * conversion_factor
                     else:
-                        result_ydata = preview_graph.yData
+                        result_ydata = preview_ydata
                     result_attrs = {'style': {'marker': 'o'}}
                     if data_var_units:
                         result_attrs['units'] = data_var_units
@@ -1607,6 +1745,10 @@ class XarrayGraph(XarrayDataTreeViewer):
                     dt[result_path] = result_var
                 if 'fit' in preview_graph._metadata:
                     dt[result_path].attrs['fit'] = preview_graph._metadata['fit']
+                if dst == 'child node':
+                    result_node_path, _, result_var_name = result_path.rpartition('/')
+                    self._changes.markVariableChanged(result_node_path, result_var_name)
+                    self.invalidatePlotPyramids(result_node_path)
         
         self.refresh() # overkill?
         if dst == 'child node':
@@ -2142,6 +2284,22 @@ class XarrayGraph(XarrayDataTreeViewer):
 
         return qty.m * conversion_factor * newunit
     
+    @classmethod
+    def displayUnits(cls, units: str) -> tuple[str, float] | None:
+        """ Return the non-prefixed units for plotting values in units and the factor to convert them, or None if units are not convertible.
+
+        Computed once per units (i.e., not for every array to convert).
+        """
+        if units in cls._display_units:
+            return cls._display_units[units]
+        try:
+            qbase = XarrayGraph.drop_prefixes(cls.ureg.Quantity(1.0, units))
+            display_units = (str(qbase.units), float(qbase.magnitude))
+        except Exception:
+            display_units = None
+        cls._display_units[units] = display_units
+        return display_units
+    
 
 class DimIterWidget(QWidget):
 
@@ -0,0 +1,263 @@
+""" Many curves with the same x data drawn as a single graphics item.
+"""
+from __future__ import annotations
+
+import numpy as np
+from qtpy.QtCore import Qt, QPoint, QPointF, QRectF
+from qtpy.QtGui import QColor, QPen, QPainter, QPainterPath, QMouseEvent
+from qtpy.QtWidgets import QMenu
+from pyqtgraph import GraphicsObject, mkPen, arrayToQPath
+
+
+class BulkPlotCurve(GraphicsObject):
+    """ Many curves (traces) with the same x data drawn as a single graphics item.
+
+    The (n_traces, n_x) y data is drawn as one path per distinct pen (traces are separated by the path's connect array).
+    This avoids the per item scene management and bounds computations of one PlotCurve per trace when piling many traces.
+    Within the visible x range, long traces are drawn as a min/max envelope at one bin per pixel.
+
+    Each trace is also represented by a BulkPlotCurveTrace with the same interface as PlotCurve for accessing its data
+    (getOriginalDataset, name, _metadata), so that code operating on individual curves can operate on traces.
+    Right clicking a trace raises its context menu.
+    """
+
+    # max distance in pixels for a click to hit a trace
+    hitTolerance: float = 5
+
+    def __init__(self, x: np.ndarray = None, y: np.ndarray = None, pen: QPen | list[QPen] = None, names: list[str | None] = None, parent=None):
+        GraphicsObject.__init__(self, parent)
+        self._xdata = np.zeros(0)
+        self._ydata = np.zeros((0, 0))
+        self._pens: list[QPen] = []
+        self._traces: list[BulkPlotCurveTrace] = []
+        self._bounds = None
+        self._paths: list[tuple[QPen, QPainterPath]] | None = None
+        self.contextMenu = QMenu()
+        if y is not None:
+            self.setData(x, y, pen, names)
+
+    def setData(self, x: np.ndarray | None, y: np.ndarray, pen: QPen | list[QPen] = None, names: list[str | None] = None) -> None:
+        """ Set (n_x,) x data (None for sample indices) and (n_traces, n_x) y data, with a pen for all traces or one per trace.
+        """
+        y = np.atleast_2d(np.asarray(y))
+        x = np.arange(y.shape[1]) if x is None else np.asarray(x)
+        if x.shape != y.shape[1:]:
+            raise ValueError(f'Shape of x {x.shape} does not match the shape of y {y.shape}.')
+        self._xdata = x
+        self._ydata = y
+        if names is None:
+            names = [None] * len(y)
+        self._traces = [BulkPlotCurveTrace(self, row, name) for row, name in enumerate(names)]
+        if pen is not None:
+            self.setPen(pen)
+        elif len(self._pens) != len(y):
+            # default style is first MATLAB line color
+            self.setPen(mkPen(QColor(0, 114, 189), width=1))
+
+        self._bounds = None
+        if y.size:
+            with np.errstate(invalid='ignore'):
+                xmin, xmax = np.fmin.reduce(x), np.fmax.reduce(x)
+                ymin, ymax = np.fmin.reduce(y, axis=None), np.fmax.reduce(y, axis=None)
+            if np.all(np.isfinite([xmin, xmax, ymin, ymax])):
+                self._bounds = (float(xmin), float(xmax), float(ymin), float(ymax))
+        self.prepareGeometryChange()
+        self.informViewBoundsChanged()
+        self._paths = None
+        self.update()
+
+    def xData(self) -> np.ndarray:
+        return self._xdata
+
+    def yData(self) -> np.ndarray:
+        return self._ydata
+
+    def traces(self) -> list[BulkPlotCurveTrace]:
+        return self._traces
+
+    def pens(self) -> list[QPen]:
+        return self._pens
+
+    def setPen(self, pen: QPen | list[QPen]) -> None:
+        """ Set a pen for all traces or one per trace (traces with equal pens are drawn together).
+        """
+        if isinstance(pen, (list, tuple)):
+            if len(pen) != len(self._ydata):
+                raise ValueError(f'Expected {len(self._ydata)} pens, got {len(pen)}.')
+            self._pens = [mkPen(pen_) for pen_ in pen]
+        else:
+            pen = mkPen(pen)
+            self._pens = [pen] * len(self._ydata)
+        self._paths = None
+        self.update()
+
+    def dataBounds(self, ax: int, frac: float = 1.0, orthoRange=None) -> tuple[float, float] | None:
+        if self._bounds is None:
+            return None
+        return self._bounds[2 * ax: 2 * ax + 2]
+
+    def boundingRect(self) -> QRectF:
+        if self._bounds is None:
+            return QRectF()
+        xmin, xmax, ymin, ymax = self._bounds
+        return QRectF(xmin, ymin, xmax - xmin, ymax - ymin)
+
+    def viewRangeChanged(self, *args) -> None:
+        self._paths = None
+        self.update()
+
+    def viewTransformChanged(self) -> None:
+        self._paths = None
+        self.update()
+
+    def paint(self, painter: QPainter, *args) -> None:
+        if self._paths is None:
+            self._paths = self._buildPaths()
+        for pen, path in self._paths:
+            painter.setPen(pen)
+            painter.drawPath(path)
+
+    def _buildPaths(self) -> list[tuple[QPen, QPainterPath]]:
+        """ Return a path of the visible x range for the traces of each distinct pen.
+        """
+        from xarray_graph.utils.decimation import minmax_envelope_block
+        x = self._xdata
+        y = self._ydata
+        if y.size == 0:
+            return []
+        start, stop = 0, len(x)
+        n_pixels = 1000
+        view = self.getViewBox()
+        if view is not None:
+            xmin, xmax = view.viewRange()[0]
+            # include one sample on either side of the view so the traces extend to its edges
+            start = max(0, int(np.searchsorted(x, xmin, side='left')) - 1)
+            stop = min(len(x), int(np.searchsorted(x, xmax, side='right')) + 1)
+            if view.width() > 0:
+                n_pixels = int(view.width())
+        if stop - start < 1:
+            return []
+        x, y = minmax_envelope_block(x, y, n_pixels, start, stop)
+
+        groups: dict[tuple, list[int]] = {}
+        for row, pen in enumerate(self._pens):
+            key = (pen.color().rgba(), pen.widthF(), pen.style())
+            groups.setdefault(key, []).append(row)
+        paths = []
+        for rows in groups.values():
+            pen = self._pens[rows[0]]
+            paths.append((pen, _tracesPath(x, y[rows] if len(rows) < len(y) else y)))
+        return paths
+
+    def traceAt(self, pos: QPointF) -> int | None:
+        """ Return the index of the trace within hitTolerance pixels of pos (in item coordinates), or None.
+        """
+        x = self._xdata
+        y = self._ydata
+        if y.size == 0:
+            return None
+        dx = self.hitTolerance * (self.pixelWidth() or 0)
+        dy = self.hitTolerance * (self.pixelHeight() or 0)
+        # samples within the tolerance along x, plus the neighboring samples for the segments to them
+        start = max(0, int(np.searchsorted(x, pos.x() - dx, side='left')) - 1)
+        stop = min(len(x), int(np.searchsorted(x, pos.x() + dx, side='right')) + 1)
+        if stop <= start:
+            return None
+        with np.errstate(invalid='ignore'):
+            ymin = np.fmin.reduce(y[:, start:stop], axis=1)
+            ymax = np.fmax.reduce(y[:, start:stop], axis=1)
+        distance = np.maximum(ymin - pos.y(), pos.y() - ymax).clip(min=0)
+        distance[np.isnan(distance)] = np.inf
+        # topmost (last drawn) of the nearest traces
+        row = len(distance) - 1 - int(np.argmin(distance[::-1]))
+        if distance[row] > dy:
+            return None
+        return row
+
+    def mouseClickEvent(self, event: QMouseEvent):
+        if event.button() == Qt.MouseButton.RightButton:
+            row = self.traceAt(event.pos())
+            if row is not None:
+                if self.raiseContextMenu(event, row):
+                    event.accept()
+                    return
+        event.ignore()
+
+    def raiseContextMenu(self, event: QMouseEvent, row: int):
+        menu: QMenu = self.getContextMenus(event, row)
+        pos = event.screenPos()
+        menu.popup(QPoint(int(pos.x()), int(pos.y())))
+        return True
+
+    def getContextMenus(self, event=None, row: int = None) -> QMenu:
+        name = None if row is None else self._traces[row].name()
+        if name is None:
+            name = self.__class__.__name__
+        self.contextMenu.setTitle(name)
+
+        self.menu = QMenu()
+        self.menu.addMenu(self.contextMenu)
+
+        # Let the scene add on to the end of our context menu (this is optional)
+        self.menu.addSection('View')
+        from pyqtgraph import GraphicsScene
+        scene: GraphicsScene = self.scene()
+        self.menu = scene.addParentContextMenus(self, self.menu, event)
+        return self.menu
+
+
+class BulkPlotCurveTrace:
+    """ A single trace of a BulkPlotCurve (with the data access interface of PlotCurve).
+    """
+
+    def __init__(self, bulkCurve: BulkPlotCurve, row: int, name: str = None):
+        self._bulkCurve = bulkCurve
+        self._row = row
+        self._name = name
+        self._metadata = {}
+
+    def bulkCurve(self) -> BulkPlotCurve:
+        return self._bulkCurve
+
+    def row(self) -> int:
+        return self._row
+
+    def getOriginalDataset(self) -> tuple[np.ndarray, np.ndarray]:
+        return self._bulkCurve.xData(), self._bulkCurve.yData()[self._row]
+
+    def name(self) -> str | None:
+        return self._name
+
+    def setName(self, name: str | None) -> None:
+        self._name = name
+
+
+def _tracesPath(x: np.ndarray, y: np.ndarray) -> QPainterPath:
+    """ Return a single path for all rows of y (with shared x), without connections between rows or across non-finite values.
+    """
+    n_traces, n_x = y.shape
+    finite = np.isfinite(y)
+    connect = finite.copy()
+    connect[:, :-1] &= finite[:, 1:]
+    connect[:, -1] = False
+    xpath = np.broadcast_to(x, y.shape).ravel()
+    ypath = np.where(finite, y, 0).ravel()
+    return arrayToQPath(xpath, ypath, connect=connect.ravel(), finiteCheck=False)
+
+
+def test():
+    import pyqtgraph as pg
+    app = pg.mkQApp()
+    plot = pg.PlotWidget()
+    n_traces, n_x = 1000, 10000
+    x = np.arange(n_x) * 1e-4
+    y = np.random.default_rng(0).standard_normal((n_traces, n_x)).cumsum(axis=1) * 0.01 + np.arange(n_traces)[:, np.newaxis] * 0.1
+    pens = [mkPen(pg.intColor(i, hues=10), width=1) for i in range(n_traces)]
+    curve = BulkPlotCurve(x, y, pen=pens, names=[f'trace {i}' for i in range(n_traces)])
+    plot.addItem(curve)
+    plot.show()
+    app.exec()
+
+
+if __name__ == '__main__':
+    test()
@@ -2,6 +2,7 @@
 """
 from __future__ import annotations
 
+import numpy as np
 from qtpy.QtCore import Qt, Signal, QPoint
 from qtpy.QtGui import QColor, QPainterPath, QMouseEvent
 from qtpy.QtWidgets import QMenu
@@ -10,13 +11,25 @@ from pyqtgraph import PlotDataItem, mkPen, mkBrush
 # from xarray_graph.utils.color import toQColor
 # from xarray_graph.widgets import TableWidgetWithCopyPaste
 
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from xarray_graph.utils.decimation import MinMaxPyramid
+
 
 class PlotCurve(PlotDataItem):
     """ Plot curve with context menu and style dialog.
+
+    Long curves without symbols are drawn as a min/max envelope of the data at one bin per pixel of the visible x range (recomputed when the x range changes).
+    Once the x range changes, a min/max pyramid of the data is computed so that further zooming and panning only reads the pyramid.
+    Pyramids can be shared via a PyramidCache, e.g., setData(x=x, y=y, pyramidCache=cache, pyramidKey=key).
+    getOriginalDataset() always returns the full resolution data.
     """
 
     sigNameChanged = Signal(str)
 
+    # curves with more points are decimated for display (None to disable)
+    decimationThreshold: int | None = 10_000
+
     def __init__(self, *args, **kwargs):
         # default style is first MATLAB line color
         if 'pen' not in kwargs:
@@ -42,6 +55,93 @@ class PlotCurve(PlotDataItem):
         # # self.contextMenu.addSeparator()
         # # self.contextMenu.addAction('Delete', lambda: self.getViewBox().deleteItem(self))
     
+    def setData(self, *args, **kwargs):
+        self._decimationKey = None
+        self._originalData = None
+        self._pyramid = None
+        self._pyramidCache = kwargs.pop('pyramidCache', None)
+        self._pyramidKey = kwargs.pop('pyramidKey', None)
+        if not args and (kwargs.get('y', None) is not None) and (self.decimationThreshold is not None):
+            y = np.asarray(kwargs['y'])
+            x = kwargs.get('x', None)
+            x = np.arange(len(y)) if x is None else np.asarray(x)
+            if (y.ndim == 1) and (len(y) > self.decimationThreshold) and (x.shape == y.shape) \
+                and np.issubdtype(x.dtype, np.number) and np.issubdtype(y.dtype, np.number) \
+                and np.all(x[1:] >= x[:-1]):
+                self._originalData = (x, y)
+                if (self._pyramidCache is not None) and (self._pyramidKey is not None):
+                    self._pyramid = self._pyramidCache.get(self._pyramidKey, y)
+                kwargs['x'], kwargs['y'] = self._decimatedData()
+        PlotDataItem.setData(self, *args, **kwargs)
+    
+    def getOriginalDataset(self) -> tuple[np.ndarray | None, np.ndarray | None]:
+        """ Full resolution data (even if decimated for display).
+        """
+        original = getattr(self, '_originalData', None)
+        if original is not None:
+            return original
+        return PlotDataItem.getOriginalDataset(self)
+    
+    def isDecimated(self) -> bool:
+        return getattr(self, '_originalData', None) is not None
+    
+    def pyramid(self) -> MinMaxPyramid | None:
+        return getattr(self, '_pyramid', None)
+    
+    def updateDecimation(self, buildPyramid: bool = False) -> None:
+        """ Redraw the decimated data for the current x range and pixel width of the view.
+
+        If buildPyramid is True, a min/max pyramid is computed (if there isn't one already) for faster redraws.
+        """
+        if not self.isDecimated():
+            return
+        if buildPyramid and (self._pyramid is None) and not self.hasSymbol():
+            from xarray_graph.utils.decimation import MinMaxPyramid
+            x, y = self._originalData
+            self._pyramid = MinMaxPyramid(y)
+            if (self._pyramidCache is not None) and (self._pyramidKey is not None):
+                self._pyramidCache.put(self._pyramidKey, self._pyramid)
+        xdata, ydata = self._decimatedData()
+        if xdata is None:
+            # unchanged
+            return
+        PlotDataItem.setData(self, x=xdata, y=ydata)
+    
+    def _decimatedData(self) -> tuple[np.ndarray | None, np.ndarray | None]:
+        """ Return the min/max envelope of the original data for the view, or (None, None) if it is unchanged.
+        """
+        from xarray_graph.utils.decimation import decimate_for_view
+        x, y = self._originalData
+        if self.hasSymbol():
+            # symbols for min/max points that are not data points would be misleading
+            key = 'all'
+            if getattr(self, '_decimationKey', None) == key:
+                return None, None
+            self._decimationKey = key
+            return x, y
+        xrange = (x[0], x[-1])
+        n_pixels = 1000
+        view = self.getViewBox()
+        if view is not None:
+            xrange = tuple(view.viewRange()[0])
+            if view.width() > 0:
+                n_pixels = int(view.width())
+        # samples spanned by the view
+        key = (int(np.searchsorted(x, xrange[0])), int(np.searchsorted(x, xrange[1], side='right')), n_pixels)
+        if getattr(self, '_decimationKey', None) == key:
+            return None, None
+        self._decimationKey = key
+        return decimate_for_view(x, y, xrange, n_pixels, self._pyramid)
+    
+    def setSymbol(self, symbol) -> None:
+        PlotDataItem.setSymbol(self, symbol)
+        self.updateDecimation()
+    
+    def viewRangeChanged(self, vb=None, ranges=None, changed=None) -> None:
+        PlotDataItem.viewRangeChanged(self, vb, ranges, changed)
+        if (changed is None) or changed[0]:
+            self.updateDecimation(buildPyramid=True)
+    
     def hasCurve(self):
         pen = mkPen(self.opts['pen'])
         return pen.style() != Qt.PenStyle.NoPen
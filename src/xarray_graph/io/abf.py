@@ -0,0 +1,317 @@
+import os
+from datetime import timedelta
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xarray as xr
+from xarray.core import indexing
+
+
+# ABF2 files are organized in blocks of 512 bytes
+ABF_BLOCK_SIZE = 512
+
+# fixed file header at the start of the file
+ABF2_HEADER_DTYPE = np.dtype({
+    'names': ['fFileSignature', 'fFileVersionNumber', 'uFileInfoSize', 'lActualEpisodes', 'uFileStartDate', 'uFileStartTimeMS', 'uStopwatchTime', 'nFileType', 'nDataFormat', 'nSimultaneousScan', 'nCRCEnable', 'uFileCRC'],
+    'formats': ['S4', ('u1', (4,)), '<u4', '<u4', '<u4', '<u4', '<u4', '<i2', '<i2', '<i2', '<i2', '<u4'],
+    'offsets': [0, 4, 8, 12, 16, 20, 24, 28, 30, 32, 34, 36],
+    'itemsize': 76,
+})
+
+# the section map follows the file header, each section is (block index, bytes per entry, number of entries)
+ABF2_SECTION_NAMES = ['ProtocolSection', 'ADCSection', 'DACSection', 'EpochSection', 'ADCPerDACSection', 'EpochPerDACSection', 'UserListSection', 'StatsRegionSection', 'MathSection', 'StringsSection', 'DataSection', 'TagSection', 'ScopeSection', 'DeltaSection', 'VoiceTagSection', 'SynchArraySection', 'AnnotationSection', 'StatsSection']
+ABF2_SECTION_DTYPE = np.dtype([('uBlockIndex', '<u4'), ('uBytes', '<u4'), ('llNumEntries', '<i8')])
+
+# leading fields of the protocol section (only those needed to read the data)
+ABF2_PROTOCOL_DTYPE = np.dtype({
+    'names': ['nOperationMode', 'fADCSequenceInterval', 'fSecondsPerRun', 'lNumSamplesPerEpisode', 'lPreTriggerSamples', 'lEpisodesPerRun', 'lRunsPerTrial', 'lNumberOfTrials', 'fEpisodeStartToStart', 'fADCRange', 'fDACRange', 'lADCResolution', 'lDACResolution'],
+    'formats': ['<i2', '<f4', '<f4', '<i4', '<i4', '<i4', '<i4', '<i4', '<f4', '<f4', '<f4', '<i4', '<i4'],
+    'offsets': [0, 2, 18, 22, 26, 30, 34, 38, 62, 110, 114, 118, 122],
+})
+
+# leading fields of each ADC section entry (one per recorded channel)
+ABF2_ADC_DTYPE = np.dtype({
+    'names': ['nADCNum', 'nTelegraphEnable', 'fTelegraphAdditGain', 'fADCProgrammableGain', 'fInstrumentScaleFactor', 'fInstrumentOffset', 'fSignalGain', 'fSignalOffset', 'lADCChannelNameIndex', 'lADCUnitsIndex'],
+    'formats': ['<i2', '<i2', '<f4', '<f4', '<f4', '<f4', '<f4', '<f4', '<i4', '<i4'],
+    'offsets': [0, 2, 6, 28, 40, 44, 48, 52, 74, 78],
+})
+
+# nOperationMode values for which the data consists of fixed length episodes (i.e., sweeps)
+ABF_EPISODIC_MODES = [2, 4, 5]
+
+
+def read_abf_header(filepath: str | os.PathLike) -> dict:
+    """Read the header of an ABF2 file into a dict.
+
+    Includes the fixed file header fields, the section map, the protocol fields needed to read the data,
+    a list of ADC fields per channel, and the indexed strings (index 0 is the empty string).
+    """
+
+    if isinstance(filepath, str):
+        filepath = Path(filepath)
+
+    with filepath.open(mode='rb') as file:
+        file_bytes = file.read(ABF_BLOCK_SIZE)
+        if file_bytes[:4] != b'ABF2':
+            raise ValueError(f'{filepath} is not an ABF2 file (only ABF2 files are supported).')
+        header = _struct_to_dict(np.frombuffer(file_bytes, dtype=ABF2_HEADER_DTYPE, count=1)[0])
+
+        sections = np.frombuffer(file_bytes, dtype=ABF2_SECTION_DTYPE, count=len(ABF2_SECTION_NAMES), offset=ABF2_HEADER_DTYPE.itemsize)
+        header['sections'] = {name: tuple(int(value) for value in section) for name, section in zip(ABF2_SECTION_NAMES, sections)}
+
+        block_index, n_bytes, n_entries = header['sections']['ProtocolSection']
+        file.seek(block_index * ABF_BLOCK_SIZE)
+        header.update(_struct_to_dict(np.frombuffer(file.read(ABF2_PROTOCOL_DTYPE.itemsize), dtype=ABF2_PROTOCOL_DTYPE, count=1)[0]))
+
+        block_index, n_bytes, n_entries = header['sections']['ADCSection']
+        file.seek(block_index * ABF_BLOCK_SIZE)
+        adc_dtype = np.dtype({'names': ABF2_ADC_DTYPE.names, 'formats': [ABF2_ADC_DTYPE[name] for name in ABF2_ADC_DTYPE.names], 'offsets': [ABF2_ADC_DTYPE.fields[name][1] for name in ABF2_ADC_DTYPE.names], 'itemsize': n_bytes})
+        adc_entries = np.frombuffer(file.read(n_bytes * n_entries), dtype=adc_dtype, count=n_entries)
+        header['adc'] = [_struct_to_dict(entry) for entry in adc_entries]
+
+        block_index, n_bytes, n_entries = header['sections']['StringsSection']
+        file.seek(block_index * ABF_BLOCK_SIZE)
+        header['strings'] = _parse_abf_strings(file.read(n_bytes * n_entries))
+
+    return header
+
+
+def _struct_to_dict(record: np.void) -> dict:
+    """Convert a structured numpy record into a dict of python values.
+    """
+    values = {}
+    for name in record.dtype.names:
+        value = record[name]
+        if isinstance(value, bytes):
+            value = value.decode('latin-1').rstrip('\0')
+        elif isinstance(value, np.ndarray):
+            value = value.tolist()
+        else:
+            value = value.item()
+        values[name] = value
+    return values
+
+
+def _parse_abf_strings(section_bytes: bytes) -> list[str]:
+    """Return the list of indexed strings in the strings section (index 0 is the empty string).
+
+    The strings section starts with a 44 byte header ('SSCH' signature, version, number of strings, ...)
+    followed by the null terminated strings.
+    """
+    if section_bytes[:4] == b'SSCH':
+        n_strings = int(np.frombuffer(section_bytes, dtype='<u4', count=1, offset=8)[0])
+        strings = section_bytes[44:].split(b'\0')[:n_strings]
+    else:
+        # no header, assume the strings follow the last run of null bytes preceding them
+        strings = section_bytes[section_bytes.rfind(b'\0\0') + 2:].split(b'\0')
+    return [''] + [string.decode('latin-1').strip() for string in strings]
+
+
+def read_abf(filepath: str | os.PathLike, packed: bool = False) -> xr.DataTree:
+    """Read data from an Axon ABF2 file into an xarray.DataTree.
+
+    Returns a xarray.DataTree with a single (sweep, time) dataset with the same layout as read_winwcp.
+    Episodic recordings have one sweep per episode, whereas gap-free (and variable length event-driven)
+    recordings are a single sweep.
+
+    The data section is memory mapped and each channel is a strided view into the mapped samples,
+    so opening a file does not read any data. 16-bit samples are scaled to physical units lazily
+    on access via a CF scale_factor/add_offset encoding (see decode_packed_data_vars).
+    If packed is True, this encoding is kept so the data is written back out as packed 16-bit integers,
+    otherwise the data is written out in physical units.
+    """
+    from xarray_graph.utils.xarray_utils import decode_packed_data_vars
+
+    if isinstance(filepath, str):
+        filepath = Path(filepath)
+
+    header = read_abf_header(filepath)
+    n_channels = len(header['adc'])
+    block_index, n_bytes_per_sample, n_data_samples = header['sections']['DataSection']
+    sample_dtype = np.dtype('<i2') if header['nDataFormat'] == 0 else np.dtype('<f4')
+
+    if header['nOperationMode'] in ABF_EPISODIC_MODES:
+        n_samples = header['lNumSamplesPerEpisode'] // n_channels
+        n_sweeps = n_data_samples // (n_samples * n_channels)
+    else:
+        n_samples = n_data_samples // n_channels
+        n_sweeps = 1
+
+    # datetime
+    start_date = header['uFileStartDate']
+    start_time = timedelta(milliseconds=header['uFileStartTimeMS'])
+    date = f'{start_date // 10000:04d}-{start_date // 100 % 100:02d}-{start_date % 100:02d}'
+    timestamp = str(start_time - timedelta(microseconds=start_time.microseconds)).zfill(8)
+    datetime = f'{date} {timestamp}'
+
+    # memory map the data section (sweep, sample, channel) with samples interleaved by channel
+    samples = np.memmap(filepath, dtype=sample_dtype, mode='r', offset=block_index * ABF_BLOCK_SIZE, shape=(n_sweeps, n_samples, n_channels))
+
+    # store everything in a xarray.Dataset
+    channel_names = [header['strings'][adc['lADCChannelNameIndex']] for adc in header['adc']]
+    channel_units = [header['strings'][adc['lADCUnitsIndex']] for adc in header['adc']]
+    channel_attrs = [{'units': channel_units[i]} for i in range(n_channels)]
+    if sample_dtype == np.int16:
+        # for converting digitized signal to signal in physical units
+        for i, adc in enumerate(header['adc']):
+            scale_factor = header['fADCRange'] / header['lADCResolution']
+            scale_factor /= adc['fInstrumentScaleFactor'] * adc['fSignalGain'] * adc['fADCProgrammableGain']
+            if adc['nTelegraphEnable']:
+                scale_factor /= adc['fTelegraphAdditGain']
+            channel_attrs[i]['scale_factor'] = scale_factor
+            channel_attrs[i]['add_offset'] = adc['fInstrumentOffset'] - adc['fSignalOffset']
+    if sample_dtype == np.int16:
+        # wrapped for lazy scaling and copy-on-write by decode_packed_data_vars below
+        channel_data = [samples[:, :, i] for i in range(n_channels)]
+    else:
+        # in-place edits copy the data out of the read-only memory map first
+        channel_data = [indexing.MemoryCachedArray(indexing.CopyOnWriteArray(samples[:, :, i])) for i in range(n_channels)]
+    # a single allocation, as this is the only array that is not mapped (e.g., 8 bytes per sample for gap-free recordings)
+    time = np.arange(n_samples, dtype=np.float64)
+    time *= header['fADCSequenceInterval'] * 1e-6
+    sweep_interval = header['fEpisodeStartToStart'] if n_sweeps > 1 else 0
+    data = xr.Dataset(
+        data_vars={
+            channel_names[i]: xr.Variable(
+                dims=['sweep', 'time'],
+                data=channel_data[i],
+                attrs=channel_attrs[i])
+            for i in range(n_channels)
+        },
+        coords={
+            'sweep': np.arange(1, n_sweeps + 1), # 1-based sweep index
+            # passed as an index to avoid copying it
+            'time': xr.Variable(
+                dims=['time'],
+                data=pd.Index(time, copy=False),
+                attrs={'units': 's'}),
+            'sweep_start_time': xr.DataArray(
+                data=np.arange(n_sweeps) * sweep_interval,
+                dims=['sweep'],
+                attrs={'units': 's'}),
+        },
+        attrs={
+            'date': date,
+            'datetime': datetime,
+            'abf_header': {key: value for key, value in header.items() if key not in ['sections', 'adc', 'strings']},
+        }
+    )
+
+    if sample_dtype == np.int16:
+        data = decode_packed_data_vars(data)
+        if not packed:
+            for var in data.data_vars.values():
+                for key in ['scale_factor', 'add_offset', 'dtype']:
+                    var.encoding.pop(key, None)
+
+    return xr.DataTree(dataset=data)
+
+
+def _write_synthetic_abf(filepath: str | os.PathLike, n_channels: int = 2, n_sweeps: int = 1, n_samples: int = 1000, sample_interval: float = 1e-4) -> None:
+    """Write a synthetic ABF2 file of int16 ramps (for testing and benchmarks only).
+
+    Written as episodic if n_sweeps > 1, otherwise as gap-free.
+    """
+
+    def pack(record_dtype: np.dtype, values: dict, itemsize: int = None) -> bytes:
+        record = np.zeros(1, dtype=record_dtype)
+        for name, value in values.items():
+            record[name] = value
+        record_bytes = record.tobytes()
+        if itemsize is not None:
+            record_bytes = record_bytes.ljust(itemsize, b'\0')
+        return record_bytes
+
+    def pad(section_bytes: bytes) -> bytes:
+        return section_bytes.ljust(-(-len(section_bytes) // ABF_BLOCK_SIZE) * ABF_BLOCK_SIZE, b'\0')
+
+    channel_names = [f'IN {i}' for i in range(n_channels)]
+    channel_units = ['pA' if i % 2 == 0 else 'mV' for i in range(n_channels)]
+    strings = ['Clampex', ''] + [string for name, units in zip(channel_names, channel_units) for string in (name, units)]
+    strings_bytes = b'SSCH' + np.array([1, len(strings)], dtype='<u4').tobytes()
+    strings_bytes = strings_bytes.ljust(44, b'\0') + b'\0'.join(string.encode('latin-1') for string in strings) + b'\0'
+
+    adc_entry_size = 128
+    protocol = pad(pack(ABF2_PROTOCOL_DTYPE, {
+        'nOperationMode': 5 if n_sweeps > 1 else 3,
+        'fADCSequenceInterval': sample_interval * 1e6,
+        'lNumSamplesPerEpisode': n_samples * n_channels,
+        'fEpisodeStartToStart': 1.0,
+        'fADCRange': 10.0,
+        'lADCResolution': 32768,
+    }))
+    adc = pad(b''.join(pack(ABF2_ADC_DTYPE, {
+        'nADCNum': i,
+        'fADCProgrammableGain': 1.0,
+        'fInstrumentScaleFactor': 0.5 if i % 2 == 0 else 0.01,
+        'fSignalGain': 1.0,
+        'lADCChannelNameIndex': 3 + 2 * i,
+        'lADCUnitsIndex': 4 + 2 * i,
+    }, adc_entry_size) for i in range(n_channels)))
+    strings_section = pad(strings_bytes)
+
+    protocol_block = 1
+    adc_block = protocol_block + len(protocol) // ABF_BLOCK_SIZE
+    strings_block = adc_block + len(adc) // ABF_BLOCK_SIZE
+    data_block = strings_block + len(strings_section) // ABF_BLOCK_SIZE
+    sections = np.zeros(len(ABF2_SECTION_NAMES), dtype=ABF2_SECTION_DTYPE)
+    sections[ABF2_SECTION_NAMES.index('ProtocolSection')] = (protocol_block, len(protocol), 1)
+    sections[ABF2_SECTION_NAMES.index('ADCSection')] = (adc_block, adc_entry_size, n_channels)
+    sections[ABF2_SECTION_NAMES.index('StringsSection')] = (strings_block, len(strings_bytes), 1)
+    sections[ABF2_SECTION_NAMES.index('DataSection')] = (data_block, 2, n_sweeps * n_samples * n_channels)
+    header = pad(pack(ABF2_HEADER_DTYPE, {
+        'fFileSignature': b'ABF2',
+        'fFileVersionNumber': [0, 0, 6, 2],
+        'lActualEpisodes': n_sweeps,
+        'uFileStartDate': 20240131,
+        'uFileStartTimeMS': 45296789,
+    }) + sections.tobytes())
+
+    with open(filepath, 'wb') as file:
+        file.write(header + protocol + adc + strings_section)
+        # write in chunks to keep memory bounded for large files
+        chunk_size = 2**20
+        for _ in range(n_sweeps):
+            for start in range(0, n_samples, chunk_size):
+                ramp = np.arange(start, min(start + chunk_size, n_samples)) % 32768
+                np.repeat(ramp.astype('<i2')[:, np.newaxis], n_channels, axis=1).tofile(file)
+
+
+def benchmark(size_gb: float = 2, n_channels: int = 4, repeats: int = 3) -> None:
+    """Time opening a synthetic gap-free ABF2 file and reading one second of data from it.
+    """
+    import tempfile
+    import time
+
+    n_samples = int(size_gb * 1e9 / 2 / n_channels)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = Path(tmpdir) / 'gap_free.abf'
+        _write_synthetic_abf(filepath, n_channels=n_channels, n_samples=n_samples)
+
+        t_open = []
+        for _ in range(repeats):
+            datatree = None
+            t0 = time.perf_counter()
+            datatree = read_abf(filepath)
+            t_open.append(time.perf_counter() - t0)
+        t_open = min(t_open)
+
+        name = list(datatree.data_vars)[0]
+        t0 = time.perf_counter()
+        values = datatree[name].isel(time=slice(n_samples // 2, n_samples // 2 + 10000)).values
+        t_read = time.perf_counter() - t0
+        assert np.allclose(values[0], (np.arange(n_samples // 2, n_samples // 2 + 10000) % 32768) * 10 / 32768 / 0.5)
+
+        print(f'{filepath.stat().st_size / 1e9:.2f} GB gap-free, {n_channels} channels')
+        print(f'open:           {t_open:.3f} sec')
+        print(f'read 1 sec:     {t_read:.4f} sec')
+        del datatree, values
+
+
+if __name__ == '__main__':
+    # for testing only
+    import sys
+    if len(sys.argv) > 1:
+        print(read_abf(sys.argv[1]))
+    else:
+        benchmark()
@@ -0,0 +1,231 @@
+""" Persistent on-disk cache of datatrees read from proprietary file formats (e.g., WinWCP, HEKA) so that unchanged files reopen instantly.
+
+Each cache entry is a directory named by a hash of the file path, cache mode and read options, holding:
+- entry.json: The size and modification time of the file when it was cached (the entry is discarded if either has changed) and the size of the entry.
+- datatree.zarr: For mode 'samples', the entire datatree including its samples.
+- datatree.pickle: For mode 'structure', only the tree structure, coords and attrs, with samples still read on demand from the file.
+
+The least recently used entries are evicted once the cache exceeds max_cache_bytes.
+Entries are written to a temporary directory first, so concurrent readers and writers (e.g., worker processes) never see partial entries.
+
+Command line: python -m xarray_graph.io.cache [info|clear]
+"""
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+import shutil
+from pathlib import Path
+import xarray as xr
+
+
+CACHE_VERSION = 1
+
+cache_modes = ['samples', 'structure']
+
+# evict least recently used entries above this size
+max_cache_bytes = 8 * 2**30
+
+
+def cache_dir() -> Path:
+    """ Cache directory (XARRAY_GRAPH_CACHE_DIR environment variable or ~/.cache/xarray-graph/datatrees).
+    """
+    path = os.environ.get('XARRAY_GRAPH_CACHE_DIR', None)
+    if path is None:
+        return Path.home() / '.cache' / 'xarray-graph' / 'datatrees'
+    return Path(path)
+
+
+def read_cached_datatree(filepath: str | os.PathLike, mode: str, options: dict = None) -> xr.DataTree | None:
+    """ Return the cached datatree for filepath read with options, or None if it is not cached or the file has changed since it was cached.
+
+    Datatrees cached with mode 'samples' are read on demand from the cache, and those cached with mode 'structure' from filepath.
+    """
+    entry_dir = _entry_dir(filepath, mode, options)
+    entry = _read_entry(entry_dir)
+    if entry is None:
+        return None
+    stat = Path(filepath).stat()
+    if (entry.get('version', None) != CACHE_VERSION) or (entry['size'] != stat.st_size) or (entry['mtime_ns'] != stat.st_mtime_ns):
+        _remove_path(entry_dir)
+        return None
+    try:
+        if mode == 'samples':
+            from xarray_graph.io.io import open_datatree
+            datatree = open_datatree(entry_dir / 'datatree.zarr', filetype='Zarr Directory')
+        else:
+            import pickle
+            with open(entry_dir / 'datatree.pickle', 'rb') as f:
+                datatree = pickle.load(f)
+    except Exception:
+        # e.g., evicted by another process
+        return None
+    # last access for LRU eviction
+    try:
+        os.utime(entry_dir / 'entry.json')
+    except OSError:
+        pass
+    return datatree
+
+
+def write_cached_datatree(datatree: xr.DataTree, filepath: str | os.PathLike, mode: str, options: dict = None, max_bytes: int = None) -> bool:
+    """ Cache datatree as read from filepath with options, then evict least recently used entries above max_bytes (default max_cache_bytes).
+
+    For mode 'structure', all data_vars must be read on demand from filepath (i.e., by a BackendArray), otherwise nothing is cached.
+    Returns whether datatree was cached.
+    """
+    if mode not in cache_modes:
+        raise ValueError(f'Unknown cache mode {mode}, must be one of {cache_modes}')
+    if (mode == 'structure') and not all(_is_read_on_demand(var) for node in datatree.subtree for var in node.to_dataset(inherit=False).data_vars.values()):
+        return False
+    filepath = Path(filepath)
+    stat = filepath.stat()
+    entry_dir = _entry_dir(filepath, mode, options)
+    tmp_dir = entry_dir.with_name(f'~{entry_dir.name}.{os.getpid()}.{id(datatree)}')
+    _remove_path(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    try:
+        if mode == 'samples':
+            from xarray_graph.io.io import save_datatree
+            save_datatree(datatree, tmp_dir / 'datatree.zarr', filetype='Zarr Directory', encoding='fast-read per sweep')
+        else:
+            import pickle
+            with open(tmp_dir / 'datatree.pickle', 'wb') as f:
+                pickle.dump(datatree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        entry = {
+            'version': CACHE_VERSION,
+            'filepath': str(filepath.resolve()),
+            'mode': mode,
+            'options': options or {},
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'nbytes': _path_nbytes(tmp_dir),
+        }
+        with open(tmp_dir / 'entry.json', 'w') as f:
+            json.dump(entry, f)
+        _remove_path(entry_dir)
+        os.replace(tmp_dir, entry_dir)
+    except BaseException:
+        _remove_path(tmp_dir)
+        raise
+    evict(max_bytes, keep=[entry_dir])
+    return True
+
+
+def cache_entries() -> list[tuple[Path, dict]]:
+    """ Return (entry directory, entry) for all cache entries from least to most recently used.
+    """
+    entries = []
+    if not cache_dir().is_dir():
+        return entries
+    for entry_dir in cache_dir().iterdir():
+        if entry_dir.name.startswith('~'):
+            continue
+        entry = _read_entry(entry_dir)
+        if entry is not None:
+            try:
+                last_access = (entry_dir / 'entry.json').stat().st_mtime
+            except OSError:
+                continue
+            entries.append((last_access, entry_dir, entry))
+    entries.sort(key=lambda item: item[0])
+    return [(entry_dir, entry) for _, entry_dir, entry in entries]
+
+
+def cache_nbytes() -> int:
+    """ Total size of all cache entries.
+    """
+    return sum(entry['nbytes'] for _, entry in cache_entries())
+
+
+def evict(max_bytes: int = None, keep: list[Path] = None) -> int:
+    """ Remove least recently used entries (except those in keep) until the cache holds at most max_bytes (default max_cache_bytes).
+
+    Returns the number of bytes removed.
+    """
+    if max_bytes is None:
+        max_bytes = max_cache_bytes
+    entries = cache_entries()
+    nbytes = sum(entry['nbytes'] for _, entry in entries)
+    removed = 0
+    for entry_dir, entry in entries:
+        if nbytes - removed <= max_bytes:
+            break
+        if keep and (entry_dir in keep):
+            continue
+        _remove_path(entry_dir)
+        removed += entry['nbytes']
+    return removed
+
+
+def clear_cache() -> int:
+    """ Remove all cache entries (including those left over by interrupted writes).
+
+    Datatrees that are still read on demand from the cache (mode 'samples') cannot be read after their entry is removed.
+    Returns the number of bytes removed.
+    """
+    if not cache_dir().is_dir():
+        return 0
+    removed = 0
+    for entry_dir in cache_dir().iterdir():
+        removed += _path_nbytes(entry_dir)
+        _remove_path(entry_dir)
+    return removed
+
+
+def _entry_dir(filepath: str | os.PathLike, mode: str, options: dict = None) -> Path:
+    key = json.dumps([str(Path(filepath).resolve()), mode, options or {}], sort_keys=True, default=str)
+    return cache_dir() / hashlib.sha1(key.encode()).hexdigest()
+
+
+def _read_entry(entry_dir: Path) -> dict | None:
+    try:
+        with open(entry_dir / 'entry.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_read_on_demand(var: xr.DataArray) -> bool:
+    """ Whether the data of var is backed by a BackendArray (i.e., only a reference to the data is pickled).
+    """
+    from xarray.backends import BackendArray
+    from xarray.core import indexing
+    data = var.variable._data
+    while isinstance(data, indexing.ExplicitlyIndexed) and hasattr(data, 'array'):
+        data = data.array
+    return isinstance(data, BackendArray)
+
+
+def _path_nbytes(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+
+
+def _remove_path(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        path.unlink()
+
+
+def main(args: list[str] = None) -> None:
+    """ Command line: show or clear the cache.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m xarray_graph.io.cache', description='Cache of datatrees read from proprietary file formats.')
+    parser.add_argument('command', choices=['info', 'clear'], nargs='?', default='info')
+    args = parser.parse_args(args)
+    if args.command == 'clear':
+        print(f'Removed {clear_cache() / 1e6:.1f} MB from {cache_dir()}')
+    else:
+        entries = cache_entries()
+        print(f'{cache_dir()}: {len(entries)} entries, {sum(entry["nbytes"] for _, entry in entries) / 1e6:.1f} MB (max {max_cache_bytes / 1e6:.0f} MB)')
+        for entry_dir, entry in reversed(entries):
+            print(f'  {entry["nbytes"] / 1e6:>10.1f} MB  {entry["mode"]:<9}  {entry["filepath"]}')
+
+
+if __name__ == '__main__':
+    main()
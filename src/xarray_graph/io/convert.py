@@ -0,0 +1,144 @@
+""" Headless batch conversion of data files to Zarr or NetCDF/HDF5 (console entry point xarray-convert).
+
+e.g., xarray-convert "data/**/*.wcp" "data/**/*.dat" -o converted -f zarr -j 4
+
+Files are converted in parallel worker processes via open_datatree and save_datatree.
+Samples are read on demand while saving, so each worker holds at most about one data_var in memory at a time.
+Outputs that are newer than their input file are skipped unless --force is given.
+"""
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+
+
+# filetypes that cannot be inferred by open_datatree from the file suffix
+suffix_filetypes = {
+    '.dat': 'HEKA',
+    '.DAT': 'HEKA',
+    '.mat': 'LabChart MATLAB (GOlab TEVC)',
+    '.MAT': 'LabChart MATLAB (GOlab TEVC)',
+}
+
+output_suffixes = {
+    'zarr': '.zarr',
+    'netcdf': '.nc',
+}
+
+
+def convert_file(input_path: str | os.PathLike, output_path: str | os.PathLike, filetype: str = None, packed: bool = False, encoding: str = None, array_attrs_min_size: int | None = None) -> int:
+    """ Convert a single file, returning the size of the input file in bytes.
+    """
+    from xarray_graph.io.io import open_datatree, save_datatree, detach_datatree_backend
+    input_path = Path(input_path)
+    output_path = Path(output_path)
+    if filetype is None:
+        filetype = suffix_filetypes.get(input_path.suffix, None)
+    # read on demand while saving
+    datatree = open_datatree(input_path, filetype=filetype, chunks={}, packed=packed)
+    try:
+        output_filetype = 'Zarr Directory' if output_path.suffix == '.zarr' else 'NetCDF/HDF5'
+        save_datatree(datatree, output_path, filetype=output_filetype, encoding=encoding, array_attrs_min_size=array_attrs_min_size)
+    finally:
+        detach_datatree_backend(datatree)
+    return input_path.stat().st_size
+
+
+def conversion_jobs(patterns: list[str], output_dir: str | os.PathLike = None, format: str = 'zarr') -> list[tuple[Path, Path]]:
+    """ Return (input path, output path) for all files matching the glob patterns (in order and without duplicates).
+
+    Outputs are written to output_dir if given, otherwise next to each input file.
+    """
+    import glob
+    input_paths: dict[Path, None] = {}
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.expanduser(pattern), recursive=True))
+        if not matches and Path(pattern).exists():
+            matches = [pattern]
+        for match in matches:
+            path = Path(match)
+            if path.is_file():
+                input_paths[path.resolve()] = None
+    jobs = []
+    for input_path in input_paths:
+        parent = Path(output_dir) if output_dir is not None else input_path.parent
+        jobs.append((input_path, parent / (input_path.stem + output_suffixes[format])))
+    return jobs
+
+
+def is_up_to_date(input_path: Path, output_path: Path) -> bool:
+    """ Whether output_path exists and is newer than input_path.
+    """
+    try:
+        return output_path.stat().st_mtime >= input_path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def main(args: list[str] = None) -> int:
+    """ Command line entry point, returns the exit status (1 if any conversion failed).
+    """
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from xarray_graph.io.io import supported_filetypes, encoding_presets
+
+    parser = argparse.ArgumentParser(prog='xarray-convert', description='Convert data files (e.g., WinWCP, HEKA, Axon ABF, LabChart MATLAB) to Zarr or NetCDF/HDF5.')
+    parser.add_argument('patterns', nargs='+', help='input files or glob patterns (use ** to match subdirectories)')
+    parser.add_argument('-o', '--output-dir', default=None, help='output directory (default: next to each input file)')
+    parser.add_argument('-f', '--format', choices=list(output_suffixes), default='zarr', help='output format (default: zarr)')
+    parser.add_argument('-t', '--filetype', choices=supported_filetypes, default=None, help='input filetype (default: inferred from the file suffix)')
+    parser.add_argument('-e', '--encoding', choices=list(encoding_presets), default=None, help='chunking and compression preset (default: backend defaults)')
+    parser.add_argument('--array-attrs-min-size', type=int, default=None, metavar='N', help='store numeric array attrs with at least N elements in hidden variables (default: keep all attrs as they are)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--packed', action='store_true', help='keep digitized integer samples with their scale factor where possible')
+    parser.add_argument('--force', action='store_true', help='convert even if the output is newer than the input')
+    args = parser.parse_args(args)
+
+    jobs = conversion_jobs(args.patterns, args.output_dir, args.format)
+    outputs: dict[Path, Path] = {}
+    for input_path, output_path in jobs:
+        if output_path in outputs:
+            parser.error(f'{input_path} and {outputs[output_path]} would both be converted to {output_path}')
+        outputs[output_path] = input_path
+    if not jobs:
+        print('No matching files.')
+        return 0
+    if args.output_dir is not None:
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+
+    todo = [(input_path, output_path) for input_path, output_path in jobs if args.force or not is_up_to_date(input_path, output_path)]
+    n_skipped = len(jobs) - len(todo)
+    n_workers = max(1, min(args.jobs or os.cpu_count() or 1, len(todo)))
+    print(f'Converting {len(todo)} of {len(jobs)} files ({n_skipped} up to date) with {n_workers} worker processes...')
+
+    n_bytes = 0
+    failed: dict[Path, Exception] = {}
+    tic = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                executor.submit(convert_file, input_path, output_path, filetype=args.filetype, packed=args.packed, encoding=args.encoding, array_attrs_min_size=args.array_attrs_min_size): (input_path, output_path)
+                for input_path, output_path in todo
+            }
+            for i, future in enumerate(as_completed(futures)):
+                input_path, output_path = futures[future]
+                try:
+                    size = future.result()
+                except Exception as err:
+                    failed[input_path] = err
+                    print(f'[{i + 1}/{len(todo)}] FAILED {input_path}: {err}')
+                    continue
+                n_bytes += size
+                print(f'[{i + 1}/{len(todo)}] {input_path} -> {output_path} ({size / 1e6:.1f} MB)')
+    elapsed = time.perf_counter() - tic
+
+    n_converted = len(todo) - len(failed)
+    throughput = f'{n_bytes / 1e6 / elapsed:.1f} MB/s, {n_converted / elapsed:.2f} files/s' if elapsed > 0 else ''
+    print(f'Converted {n_converted} files ({n_bytes / 1e6:.1f} MB) in {elapsed:.1f} s ({throughput}), skipped {n_skipped}, failed {len(failed)}.')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
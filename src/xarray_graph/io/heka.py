@@ -1,10 +1,13 @@
+import struct
 from pathlib import Path
 import numpy as np
 import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
 from xarray_graph.io import heka_reader
 
 
-def read_heka(filepath: Path | str) -> xr.DataTree:
+def read_heka(filepath: Path | str, packed: bool = False, lazy: bool = False) -> xr.DataTree:
     """ Read data from a HEKA file into an xarray.DataTree.
 
     HEKA format:
@@ -14,105 +17,345 @@ def read_heka(filepath: Path | str) -> xr.DataTree:
             Sweep
                 Trace (Data Series for Channel_A)
                 Trace (Data Series for Channel_B)
+
+    The layout of each group is planned from the Pulsed tree metadata before any trace data is read.
+    If all sweeps in a group share the same channels and sampling, the group is a single dataset with
+    (series, sweep, time) arrays that are preallocated and filled once directly from the memory mapped file.
+    Otherwise, each series with uniform sweeps is its own (sweep, time) dataset, and only series whose
+    sweeps really differ are split into one node per sweep.
+    Series and sweep dims are omitted if there is only one series or sweep, and shorter sweeps or
+    series with fewer sweeps are padded with NaN.
+
+    If packed is True, channels whose traces within a group are all stored as integers with the
+    same scaling keep their integer samples with a CF scale_factor/add_offset encoding and are
+    decoded lazily on access (see decode_packed_data_vars).
+
+    If lazy is True, the tree (names, dims, coords, units and sizes) is built from the Pulsed tree
+    metadata only and channels are backed by HekaBackendArray, so trace data is only read from disk
+    for the sweeps that are indexed.
     """
+    from xarray_graph.utils.xarray_utils import decode_packed_data_vars
 
     if isinstance(filepath, str):
         filepath = Path(filepath)
-    
+
     bundle = heka_reader.Bundle(str(filepath))
 
     n_groups = len(bundle.pul)
     if n_groups == 0:
+        bundle.close()
         return
-    groups = {}
-    group_names = [bundle.pul[i].Label for i in range(n_groups)]
-    for group_index, group_name in enumerate(group_names):
-        series = []
-        n_series = len(bundle.pul[group_index])
-        for series_index in range(n_series):
-            sweeps = []
-            n_sweeps = len(bundle.pul[group_index][series_index])
-            for sweep_index in range(n_sweeps):
-                n_traces = len(bundle.pul[group_index][series_index][sweep_index])
-                sweep_ds = xr.Dataset()
-                for trace_index in range(n_traces):
-                    trace = bundle.pul[group_index][series_index][sweep_index][trace_index]
-                    # print(trace)
-                    y = bundle.data[(group_index, series_index, sweep_index, trace_index)]
-                    # print(group_name, f'Series.{series_index}', f'Sweep.{sweep_index}', trace.Label, y.shape)
-                    sweep_ds[trace.Label] = xr.DataArray(
-                        y,
-                        dims=['time'],
-                        attrs={
-                            'units': trace.YUnit,
-                            # 'conversion_to_units': trace.DataScaler,
-                            # 'offset_in_units': trace.YOffset,
-                        },
-                    )
-                time = np.arange(len(y)) * trace.XInterval + trace.XStart
-                sweep_ds.coords['time'] = xr.DataArray(
-                    time,
-                    dims=['time'],
-                    attrs={
-                        'units': trace.XUnit,
-                    },
-                )
-                sweeps.append(sweep_ds)
-            
-            # merge sweep datasets if they all share the same channels and times
-            if len(sweeps) == 1:
-                sweeps = sweeps[0]
-            else:
-                try:
-                    sweeps = xr.concat(sweeps, 'sweep', join='outer')
-                    sweeps = sweeps.assign_coords(sweep=xr.DataArray(
-                        data=np.arange(1, sweeps.sizes['sweep'] + 1),
-                        dims=['sweep'],
-                    ))
-                except:
-                    pass
-            
-            series.append(sweeps)
-        
-        # merge series datasets if they all share the same sweeps, channels and times
-        if len(series) == 1:
-            series = series[0]
-        else:
-            try:
-                series = xr.concat(series, 'series', join='outer')
-                series = series.assign_coords(series=xr.DataArray(
-                    data=np.arange(1, series.sizes['series'] + 1),
-                    dims=['series'],
-                ))
-            except:
-                pass
-        
-        groups[group_name] = series
-    
-    # put everything into a DataTree
+
     dt = xr.DataTree()
-    for group_name, group in groups.items():
-        if isinstance(group, xr.Dataset):
-            dt[group_name] = group
-        elif isinstance(group, list):
-            group_node = xr.DataTree()
-            dt[group_name] = group_node
-            for series_index, series in enumerate(group):
-                series_name = f'Series.{series_index + 1}'
-                if isinstance(series, xr.Dataset):
-                    group_node[series_name] = series
-                elif isinstance(series, list):
-                    series_node = xr.DataTree()
-                    group_node[series_name] = series_node
-                    for sweep_index, sweep in enumerate(series):
-                        sweep_name = f'Sweep.{sweep_index + 1}'
-                        if isinstance(sweep, xr.Dataset):
-                            series_node[sweep_name] = sweep
-                        elif isinstance(sweep, list):
-                            raise NotImplementedError
+    for group_index, group_record in enumerate(bundle.pul):
+        group_name = group_record.Label
+
+        # trace labels that can be stored as packed integers with a single scaling for the entire group
+        packed_labels = []
+        if packed:
+            scaling_per_label = {}
+            for series_record in group_record:
+                for sweep_record in series_record:
+                    for trace in sweep_record:
+                        fmt = bytearray(trace.DataFormat)[0]
+                        scaling_per_label.setdefault(trace.Label, set()).add((fmt, trace.DataScaler, trace.ZeroData))
+            packed_labels = [label for label, scalings in scaling_per_label.items() if len(scalings) == 1 and list(scalings)[0][0] in [0, 1]]
+
+        # (group, series, sweep) indices for each series in the group
+        series_sweeps = [
+            [(group_index, series_index, sweep_index) for sweep_index in range(len(series_record))]
+            for series_index, series_record in enumerate(group_record)
+        ]
+
+        # all sweeps in the group share the same sampling and channel units
+        group_layout = _sweeps_layout(bundle, [sweep for sweeps in series_sweeps for sweep in sweeps])
+        if group_layout is not None and group_layout[0]:
+            dt[group_name] = decode_packed_data_vars(_read_sweeps(bundle, series_sweeps, group_layout, packed_labels, lazy))
+            continue
+
+        # !! assigning a node to a tree adds a copy, so build each node before adding it to the tree
+        group_node = xr.DataTree()
+        for series_index, sweeps in enumerate(series_sweeps):
+            series_name = f'Series.{series_index + 1}'
+            layout = _sweeps_layout(bundle, sweeps)
+            if layout is not None and layout[0]:
+                # all sweeps in the series share the same sampling and channel units
+                group_node[series_name] = decode_packed_data_vars(_read_sweeps(bundle, [sweeps], layout, packed_labels, lazy))
+                continue
+
+            series_node = xr.DataTree()
+            for sweep_index, sweep in enumerate(sweeps):
+                sweep_name = f'Sweep.{sweep_index + 1}'
+                series_node[sweep_name] = decode_packed_data_vars(_read_sweeps(bundle, [[sweep]], _sweeps_layout(bundle, [sweep]), packed_labels, lazy))
+            group_node[series_name] = series_node
+        dt[group_name] = group_node
+
+    # release the memory map of the trace data (lazy arrays map the file on access)
+    bundle.close()
+
     return dt
 
 
+def _sweeps_layout(bundle: heka_reader.Bundle, sweeps: list[tuple[int, int, int]]) -> tuple | None:
+    """ Return the channels and shared sampling for (group, series, sweep) indices, or None if the sampling or channel units differ between sweeps.
+
+    Channels are the union of trace labels (and their units) across sweeps in order of first appearance.
+    Traces within a sweep are assumed to share the sampling of the sweep's first trace.
+    """
+    channels = {}
+    sampling = None
+    for group_index, series_index, sweep_index in sweeps:
+        traces = bundle.pul[group_index][series_index][sweep_index].children
+        if not traces:
+            continue
+        sweep_sampling = (traces[0].XInterval, traces[0].XStart, traces[0].XUnit)
+        if sampling is None:
+            sampling = sweep_sampling
+        elif sweep_sampling != sampling:
+            return None
+        for trace in traces:
+            if channels.setdefault(trace.Label, trace.YUnit) != trace.YUnit:
+                return None
+    if sampling is None:
+        sampling = (None, None, None)
+    return (tuple(channels.items()), *sampling)
+
+
+def _read_sweeps(bundle: heka_reader.Bundle, series_sweeps: list[list[tuple[int, int, int]]], layout: tuple, packed_labels: list[str], lazy: bool = False) -> xr.Dataset:
+    """ Read (group, series, sweep) indices with a shared layout into a (series, sweep, time) dataset.
+
+    Arrays are preallocated from the trace metadata and filled directly from the memory mapped trace data.
+    If lazy is True, only the location of each trace in the file is collected and the arrays are backed by HekaBackendArray.
+    """
+    channels, x_interval, x_start, x_unit = layout
+    pul = bundle.pul
+
+    # plan output shape from metadata
+    n_series = len(series_sweeps)
+    n_sweeps = max(len(sweeps) for sweeps in series_sweeps)
+    traces = [pul[g][s][w].children for sweeps in series_sweeps for g, s, w in sweeps]
+    n_samples = max((trace.DataPoints for sweep_traces in traces for trace in sweep_traces), default=0)
+    is_padded = any(len(sweeps) < n_sweeps for sweeps in series_sweeps) \
+        or any(len({trace.Label for trace in sweep_traces}) < len(channels) for sweep_traces in traces) \
+        or any(trace.DataPoints < n_samples for sweep_traces in traces for trace in sweep_traces)
+
+    # preallocate arrays (or trace locations if lazy)
+    first_trace = {}
+    for sweep_traces in traces:
+        for trace in sweep_traces:
+            first_trace.setdefault(trace.Label, trace)
+    arrays = {}
+    dtypes = {}
+    is_packed = {}
+    for label, units in channels:
+        raw_dtype = bundle.data.dtype(first_trace[label])
+        is_packed[label] = (label in packed_labels) and not is_padded
+        dtypes[label] = raw_dtype.newbyteorder('=') if is_packed[label] else np.result_type(raw_dtype, 1.0)
+        if lazy:
+            arrays[label] = np.full((n_series, n_sweeps), np.array((-1, 0, b'', 1.0, 0.0), dtype=HekaBackendArray.location_dtype))
+        elif is_padded:
+            arrays[label] = np.full((n_series, n_sweeps, n_samples), np.nan, dtype=dtypes[label])
+        else:
+            arrays[label] = np.empty((n_series, n_sweeps, n_samples), dtype=dtypes[label])
+
+    # fill arrays
+    for i, sweeps in enumerate(series_sweeps):
+        for j, (group_index, series_index, sweep_index) in enumerate(sweeps):
+            for trace_index, trace in enumerate(pul[group_index][series_index][sweep_index]):
+                if lazy:
+                    arrays[trace.Label][i, j] = (trace.Data, trace.DataPoints, bundle.data.dtype(trace).str, trace.DataScaler, trace.ZeroData)
+                    continue
+                raw = bundle.data.raw((group_index, series_index, sweep_index, trace_index))
+                out = arrays[trace.Label][i, j, :trace.DataPoints]
+                if is_packed[trace.Label]:
+                    out[:] = raw
+                else:
+                    np.multiply(raw, trace.DataScaler, out=out)
+                    out += trace.ZeroData
+
+    # drop series and sweep dims if there is only one of either
+    dims = ['series', 'sweep', 'time']
+    shape = [n_series, n_sweeps, n_samples]
+    if n_sweeps == 1:
+        del dims[1], shape[1]
+    if n_series == 1:
+        del dims[0], shape[0]
+
+    data_vars = {}
+    for label, units in channels:
+        attrs = {
+            'units': units,
+        }
+        if is_packed[label]:
+            attrs['scale_factor'] = first_trace[label].DataScaler
+            attrs['add_offset'] = first_trace[label].ZeroData
+        if lazy:
+            data = indexing.MemoryCachedArray(indexing.CopyOnWriteArray(indexing.LazilyIndexedArray(
+                HekaBackendArray(bundle.file_name, arrays[label].reshape(shape[:-1]), n_samples, dtypes[label], scaled=not is_packed[label])
+            )))
+        else:
+            data = arrays[label].reshape(shape)
+        data_vars[label] = xr.Variable(dims, data, attrs=attrs)
+
+    coords = {}
+    if 'series' in dims:
+        coords['series'] = xr.DataArray(np.arange(1, n_series + 1), dims=['series'])
+    if 'sweep' in dims:
+        coords['sweep'] = xr.DataArray(np.arange(1, n_sweeps + 1), dims=['sweep'])
+    if channels:
+        coords['time'] = xr.DataArray(
+            np.arange(n_samples) * x_interval + x_start,
+            dims=['time'],
+            attrs={
+                'units': x_unit,
+            },
+        )
+
+    return xr.Dataset(data_vars=data_vars, coords=coords)
+
+
+class HekaBackendArray(BackendArray):
+    """Lazily read (..., time) array for a single HEKA channel.
+
+    locations holds the position of the trace in the file for each leading (e.g., series, sweep) index,
+    where a negative offset means there is no trace. Only the indexed traces are read from the memory mapped file.
+    The file is mapped on each access, so there are no open file handles to manage.
+    Shorter or missing traces are padded with NaN. If scaled is False, samples are returned as stored.
+    """
+
+    # byte offset in the file, number of samples, stored dtype, DataScaler, ZeroData
+    location_dtype = np.dtype([('offset', np.int64), ('points', np.int64), ('dtype', 'S3'), ('scaler', np.float64), ('zero', np.float64)])
+
+    def __init__(self, filepath: Path | str, locations: np.ndarray, n_samples: int, dtype: np.dtype, scaled: bool = True):
+        self.filepath = filepath
+        self.locations = locations
+        self.scaled = scaled
+        self.shape = locations.shape + (n_samples,)
+        self.dtype = np.dtype(dtype)
+
+    def __getitem__(self, key: indexing.ExplicitIndexer) -> np.ndarray:
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._raw_indexing_method)
+
+    def _raw_indexing_method(self, key: tuple) -> np.ndarray:
+        *location_key, sample_key = key
+        locations = self.locations[tuple(location_key)]
+        is_sample_index = not isinstance(sample_key, slice)
+        if is_sample_index:
+            sample_key = slice(sample_key, sample_key + 1)
+        samples = np.arange(self.shape[-1])[sample_key]
+        if self.dtype.kind == 'f':
+            out = np.full(locations.shape + samples.shape, np.nan, dtype=self.dtype)
+        else:
+            out = np.zeros(locations.shape + samples.shape, dtype=self.dtype)
+        file = np.memmap(self.filepath, dtype=np.uint8, mode='r')
+        for index in np.ndindex(locations.shape):
+            offset, points, dtype, scaler, zero = locations[index].item()
+            if offset < 0:
+                continue
+            dtype = np.dtype(dtype.decode())
+            raw = file[offset:offset + points * dtype.itemsize].view(dtype)
+            if points == self.shape[-1]:
+                values = raw[sample_key]
+                index += (slice(None),)
+            else:
+                is_valid = samples < points
+                values = raw[samples[is_valid]]
+                index += (is_valid,)
+            out[index] = values * scaler + zero if self.scaled else values
+        del file
+        if is_sample_index:
+            out = out[..., 0]
+        return out
+
+
+def _pack_record(record_type: type[heka_reader.Struct], values: dict) -> bytes:
+    """ Pack a little endian record with all fields not in values set to zero (for writing synthetic bundles).
+    """
+    items = []
+    for name, fmt, func in record_type._field_info():
+        value = values.get(name, None)
+        if fmt[-1] == 's':
+            items.append(value if value is not None else b'')
+        elif fmt == 'c':
+            items.append(value if value is not None else b'\0')
+        elif len(fmt) == 1:
+            items.append(value if value is not None else 0)
+        else:
+            items.extend(value if value is not None else [0] * int(fmt[:-1]))
+    return record_type._le_struct.pack(*items)
+
+
+def _write_synthetic_bundle(filepath: Path | str, n_groups: int = 1, n_series: int = 1, n_sweeps: int = 1, n_samples: int = 1000, labels: tuple[str] = ('Imon', 'Vmon')) -> None:
+    """ Write a synthetic HEKA bundle with uniform sweeps of int16 ramps (for testing and benchmarks only).
+    """
+    level_types = [heka_reader.Pulsed, heka_reader.GroupRecord, heka_reader.SeriesRecord, heka_reader.SweepRecord, heka_reader.TraceRecord]
+    level_sizes = [record_type.size() for record_type in level_types]
+    n_traces = n_groups * n_series * n_sweeps * len(labels)
+    pul_size = 8 + 4 * len(level_sizes) + level_sizes[0] + 4 \
+        + n_groups * (level_sizes[1] + 4) \
+        + n_groups * n_series * (level_sizes[2] + 4) \
+        + n_groups * n_series * n_sweeps * (level_sizes[3] + 4) \
+        + n_traces * (level_sizes[4] + 4)
+    pul_start = heka_reader.BundleHeader.size()
+    dat_start = pul_start + pul_size
+    trace_bytes = 2 * n_samples
+
+    pul = [b'eerT', struct.pack('<i', len(level_sizes)), struct.pack(f'<{len(level_sizes)}i', *level_sizes)]
+    pul.append(_pack_record(heka_reader.Pulsed, {}) + struct.pack('<i', n_groups))
+    offset = dat_start
+    for group_index in range(n_groups):
+        pul.append(_pack_record(heka_reader.GroupRecord, {'Label': f'Group{group_index + 1}'.encode()}) + struct.pack('<i', n_series))
+        for series_index in range(n_series):
+            pul.append(_pack_record(heka_reader.SeriesRecord, {}) + struct.pack('<i', n_sweeps))
+            for sweep_index in range(n_sweeps):
+                pul.append(_pack_record(heka_reader.SweepRecord, {}) + struct.pack('<i', len(labels)))
+                for label in labels:
+                    pul.append(_pack_record(heka_reader.TraceRecord, {
+                        'Label': label.encode(),
+                        'Data': offset,
+                        'DataPoints': n_samples,
+                        'DataFormat': b'\0',
+                        'DataScaler': 1e-3,
+                        'XInterval': 1e-4,
+                        'XUnit': b's',
+                        'YUnit': b'A' if label.startswith('I') else b'V',
+                    }) + struct.pack('<i', 0))
+                    offset += trace_bytes
+    pul = b''.join(pul)
+
+    bundle_items = [{'Start': pul_start, 'Length': pul_size, 'Extension': b'.pul'}, {'Start': dat_start, 'Length': n_traces * trace_bytes, 'Extension': b'.dat'}]
+    bundle_items = b''.join(_pack_record(heka_reader.BundleItem, item) for item in bundle_items)
+    bundle_items += bytes((12 - 2) * heka_reader.BundleItem.size())
+    header = _pack_record(heka_reader.BundleHeader, {'Signature': b'DAT2', 'Items': 2, 'IsLittleEndian': b'\1', 'BundleItems': bundle_items})
+
+    trace = np.arange(n_samples, dtype='<i2').tobytes()
+    with open(filepath, 'wb') as file:
+        file.write(header)
+        file.write(pul)
+        for _ in range(n_traces):
+            file.write(trace)
+
+
+def benchmark(n_sweeps_per_series: tuple[int] = (100, 200, 400, 800, 1600)) -> None:
+    """ Time parsing the Pulsed tree of synthetic bundles with increasing numbers of records.
+
+    Time per record should stay constant (i.e., parsing scales linearly with the number of records).
+    """
+    import tempfile
+    import time
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_sweeps in n_sweeps_per_series:
+            filepath = Path(tmpdir) / f'{n_sweeps}.dat'
+            _write_synthetic_bundle(filepath, n_groups=2, n_series=10, n_sweeps=n_sweeps, n_samples=10)
+            t0 = time.perf_counter()
+            bundle = heka_reader.Bundle(str(filepath))
+            # the Pulsed tree is parsed when first accessed
+            bundle.pul
+            t = time.perf_counter() - t0
+            n_records = 1 + 2 + 2 * 10 + 2 * 10 * n_sweeps * 3
+            print(f'{n_records:>8} records: {t:.3f} sec ({1e6 * t / n_records:.1f} usec/record)')
+
+
 if __name__ == '__main__':
     dt = read_heka('examples/HEKA.dat')
     print(dt)
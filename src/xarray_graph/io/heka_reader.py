@@ -22,7 +22,7 @@ Brief example::
 """
 
 import numpy as np
-import re, struct, collections
+import re, struct, gc
 
 
 class Struct(object):
@@ -70,11 +70,11 @@ class Struct(object):
         """Read the structure from *data* and return an ordered dictionary of 
         fields.
         
-        *data* may be a string or file.
+        *data* may be a string, bytes-like object (e.g. memoryview) or file.
         *endian* may be '<' or '>'
         """
-        field_info = self._field_info()
-        if not isinstance(data, (str, bytes)):
+        self._field_info()
+        if hasattr(data, 'read'):
             data = data.read(self._le_struct.size)
         if endian == '<':
             items = self._le_struct.unpack(data)
@@ -83,33 +83,19 @@ class Struct(object):
         else:
             raise ValueError('Invalid endian: %s' % endian)
         
-        fields = collections.OrderedDict()
-        
-        i = 0
-        for name, fmt, func in field_info:
-            # pull item(s) out of the list based on format string
-            if len(fmt) == 1 or fmt[-1] == 's':
-                item = items[i]
-                i += 1
-            else:
-                n = int(fmt[:-1])
-                item = items[i:i+n]
-                i += n
-            
-            # try unpacking sub-structure
-            if isinstance(func, tuple):
-                substr, func = func
+        # fields are unpacked according to the per class plan from _field_info
+        fields = {}
+        for name, start, stop, substr, func in self._field_plan:
+            # pull item(s) out of the list
+            item = items[start] if stop is None else items[start:stop]
+            # unpack sub-structure
+            if substr is not None:
                 item = substr(item, endian)
-            
-            # None here means the field should be omitted
-            if func is None:
-                continue
             # handle custom massaging function
             if func is not True:
                 item = func(item)
             fields[name] = item
-            setattr(self, name, item)
-            
+        self.__dict__.update(fields)
         self.fields = fields
         
     @classmethod
@@ -136,6 +122,26 @@ class Struct(object):
             fmt += ifmt
         cls._le_struct = struct.Struct('<' + fmt)
         cls._be_struct = struct.Struct('>' + fmt)
+        
+        # (name, start, stop, substr, func) for each field that is not omitted,
+        # where stop is None for single items
+        plan = []
+        i = 0
+        for name, ifmt, func in fields:
+            if len(ifmt) == 1 or ifmt[-1] == 's':
+                start, stop = i, None
+                i += 1
+            else:
+                start, stop = i, i + int(ifmt[:-1])
+                i = stop
+            substr = None
+            if isinstance(func, tuple):
+                substr, func = func
+            # None here means the field should be omitted
+            if func is None:
+                continue
+            plan.append((name, start, stop, substr, func))
+        cls._field_plan = plan
         cls._fields_parsed = fields
         if cls.size_check is not None:
             assert cls._le_struct.size == cls.size_check
@@ -185,15 +191,12 @@ class StructArray(Struct):
     array_size = None
     
     def __init__(self, data, endian='<'):
-        if not isinstance(data, (str, bytes)):
+        if hasattr(data, 'read'):
             data = data.read(self.size())
-        items = []
+        # slicing a memoryview does not copy the remaining data
+        data = memoryview(data)
         isize = self.item_struct.size()
-        for i in range(self.array_size):
-            d = data[:isize]
-            data = data[isize:]
-            items.append(self.item_struct(d, endian))
-        self.array = items
+        self.array = [self.item_struct(data[i*isize:(i+1)*isize], endian) for i in range(self.array_size)]
 
     def __getitem__(self, i):
         return self.array[i]
@@ -244,8 +247,11 @@ class BundleHeader(Struct):
 
 class TreeNode(Struct):
     """Struct that also represents a node in a Pulse file tree.
+
+    Records are parsed from *buffer* (a memoryview of the entire tree) starting
+    at *pul._offset*, which is advanced past each record as it is parsed.
     """
-    def __init__(self, fh, pul, level=0):
+    def __init__(self, buffer, pul, level=0):
         self.level = level
         self.children = []
         endian = pul.endian
@@ -256,25 +262,27 @@ class TreeNode(Struct):
         # result in corrupt data in some situations..
         realsize = pul.level_sizes[level]
         structsize = self.size()
-        data = fh.read(realsize)
+        start = pul._offset
+        pul._offset += realsize
         diff = structsize - realsize
         if diff > 0:
-            data = data + b'\0'*diff
+            data = bytes(buffer[start:start+realsize]) + b'\0'*diff
         else:
-            data = data[:structsize]
+            data = buffer[start:start+structsize]
         
         # initialize struct data
         Struct.__init__(self, data, endian)
         
         # Next read the number of children
-        nchild = struct.unpack(endian + 'i', fh.read(4))[0]
+        nchild = struct.unpack_from(endian + 'i', buffer, pul._offset)[0]
+        pul._offset += 4
             
         level += 1
         if level >= len(pul.rectypes):
             return
         child_rectype = pul.rectypes[level]
         for i in range(nchild):
-            self.children.append(child_rectype(fh, pul, level))
+            self.children.append(child_rectype(buffer, pul, level))
 
     def __getitem__(self, i):
         return self.children[i]
@@ -582,11 +590,13 @@ class Pulsed(TreeNode):
     ]
     
     def __init__(self, bundle, offset=0, size=None):
-        fh = open(bundle.file_name, 'rb')
-        fh.seek(offset)
+        # read the entire tree with a single read and parse all records from offsets into it
+        with open(bundle.file_name, 'rb') as fh:
+            fh.seek(offset)
+            buffer = memoryview(fh.read(size if size and size > 0 else -1))
         
         # read .pul header
-        magic = fh.read(4) 
+        magic = bytes(buffer[:4])
         if magic == b'eerT':
             self.endian = '<'
         elif magic == b'Tree':
@@ -594,33 +604,109 @@ class Pulsed(TreeNode):
         else:
             raise RuntimeError('Bad file magic: %s' % magic)
         
-        levels = struct.unpack(self.endian + 'i', fh.read(4))[0]
+        levels = struct.unpack_from(self.endian + 'i', buffer, 4)[0]
 
         # read size of each level (one int per level)
-        self.level_sizes = []
-        for i in range(levels):
-            size = struct.unpack(self.endian + 'i', fh.read(4))[0]
-            self.level_sizes.append(size)
-            
-        TreeNode.__init__(self, fh, self)
+        self.level_sizes = list(struct.unpack_from(self.endian + '%di' % levels, buffer, 8))
+        
+        # The tree only allocates objects without creating reference cycles,
+        # so pause the cyclic garbage collector, whose repeated scans of the
+        # growing tree would otherwise make parsing scale super-linearly.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._offset = 8 + 4 * levels
+            TreeNode.__init__(self, buffer, self)
+            del self._offset
+        finally:
+            if gc_was_enabled:
+                gc.enable()
 
 
 class Data(object):
+    """Trace data from the .dat region of a bundle.
+
+    The .dat region is memory mapped once, so per trace reads are zero-copy
+    views of the file rather than a new file handle and read for every trace.
+    """
     def __init__(self, bundle, offset=0, size=None):
         self.bundle = bundle
         self.offset = offset
+        if not size or size <= 0:
+            # map to the end of the file
+            size = None
+        self.buffer = np.memmap(bundle.file_name, dtype=np.uint8, mode='r', offset=offset, shape=size)
         
     def __getitem__(self, *args):
         index = args[0]
+        trace = self.trace(index)
+        return self.raw(index) * trace.DataScaler + trace.ZeroData
+
+    def trace(self, index):
+        """Return the TraceRecord for *index* (group, series, sweep, trace).
+        """
         assert len(index) == 4
         pul = self.bundle.pul
-        trace = pul[index[0]][index[1]][index[2]][index[3]]
-        fh = open(self.bundle.file_name, 'rb')
-        fh.seek(trace.Data)
+        return pul[index[0]][index[1]][index[2]][index[3]]
+
+    def dtype(self, trace):
+        """Return the numpy dtype of the samples stored for *trace*.
+        """
         fmt = bytearray(trace.DataFormat)[0]
         dtype = [np.int16, np.int32, np.float16, np.float32][fmt]
-        data = np.fromfile(fh, count=trace.DataPoints, dtype=dtype)
-        return data * trace.DataScaler + trace.ZeroData
+        return np.dtype(dtype).newbyteorder(self.bundle.pul.endian)
+
+    def raw(self, index):
+        """Return the samples for a trace as stored in the file (i.e., without 
+        applying trace.DataScaler and trace.ZeroData).
+
+        This is a read-only zero-copy view into the memory mapped file.
+        """
+        trace = self.trace(index)
+        dtype = self.dtype(trace)
+        start = trace.Data - self.offset
+        stop = start + trace.DataPoints * dtype.itemsize
+        return self.buffer[start:stop].view(dtype)
+
+    def read_many(self, indices, scaled=True):
+        """Return a list of arrays for the traces at *indices*.
+
+        Traces that are adjacent in the file are read with a single copy
+        out of the memory map. If *scaled* is False, the samples are returned
+        as stored in the file.
+        """
+        traces = [self.trace(index) for index in indices]
+        dtypes = [self.dtype(trace) for trace in traces]
+        order = sorted(range(len(traces)), key=lambda i: traces[i].Data)
+        results = [None] * len(traces)
+        
+        # group traces into runs of contiguous bytes in the file
+        runs = []
+        stop = None
+        for i in order:
+            start = traces[i].Data - self.offset
+            if runs and start == stop:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+            stop = start + traces[i].DataPoints * dtypes[i].itemsize
+        
+        for run in runs:
+            run_start = traces[run[0]].Data - self.offset
+            run_stop = traces[run[-1]].Data - self.offset + traces[run[-1]].DataPoints * dtypes[run[-1]].itemsize
+            block = np.array(self.buffer[run_start:run_stop])
+            for i in run:
+                start = traces[i].Data - self.offset - run_start
+                data = block[start:start + traces[i].DataPoints * dtypes[i].itemsize].view(dtypes[i])
+                if scaled:
+                    data = data * traces[i].DataScaler + traces[i].ZeroData
+                results[i] = data
+        return results
+
+    def close(self):
+        """Release the memory map (views that were handed out remain valid).
+        """
+        self.buffer = None
 
 
 class Bundle(object):
@@ -677,5 +763,19 @@ class Bundle(object):
             item.instance = cls(self, item.Start, item.Length)
         return item.instance
         
+    def close(self):
+        """Release the memory map of the trace data.
+        """
+        item = self.catalog.get('.dat')
+        if item is not None and item.instance is not None:
+            item.instance.close()
+            item.instance = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        
     def __repr__(self):
         return "Bundle(%r)" % list(self.catalog.keys())
@@ -3,8 +3,15 @@
 from __future__ import annotations
 
 import os
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from pathlib import Path
 import xarray as xr
+from xarray.backends import BackendArray
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from xarray_graph.utils.ChangeTracker import ChangeTracker
 
 
 supported_filetypes = [
@@ -13,10 +20,29 @@ supported_filetypes = [
     'NetCDF/HDF5',
     'WinWCP',
     'HEKA',
-    # 'Axon ABF'
+    'Axon ABF',
     'LabChart MATLAB (GOlab TEVC)'
 ]
 
+# chunking and compression presets for save_datatree
+# chunks hold entire sweeps along xdim, with consecutive sweeps grouped until chunks hold at least min_chunk_bytes
+# (sweeps are only split along xdim if they exceed max_chunk_bytes)
+# no byte shuffle, as it makes recorded data worse to compress (ADC samples times a scale factor have few distinct values which compress well unshuffled)
+encoding_presets = {
+    'fast-read per sweep': {
+        'min_chunk_bytes': 2**16,
+        'max_chunk_bytes': 2**24,
+        'zarr': {'codec': 'BloscCodec', 'cname': 'lz4', 'clevel': 1, 'shuffle': 'noshuffle'},
+        'netcdf': {'zlib': False},
+    },
+    'max compression': {
+        'min_chunk_bytes': 2**22,
+        'max_chunk_bytes': 2**26,
+        'zarr': {'codec': 'ZstdCodec', 'level': 12},
+        'netcdf': {'zlib': True, 'complevel': 9, 'shuffle': False},
+    },
+}
+
 
 def detach_datatree_backend(datatree: xr.DataTree, materialize: bool = False) -> None:
     """Close datatree backend resources, optionally materializing data first.
@@ -41,8 +67,23 @@ def detach_datatree_backend(datatree: xr.DataTree, materialize: bool = False) ->
             pass
 
 
-def open_datatree(filepath: str | os.PathLike, filetype: str = None, engine: str = None, chunks = None, consolidated: bool = False) -> xr.DataTree:
+def open_datatree(filepath: str | os.PathLike, filetype: str = None, engine: str = None, chunks = None, consolidated: bool | None = None, packed: bool = False, cache: str = None) -> xr.DataTree:
+    """ Open datatree from file.
+
+    Zarr directories are opened with their consolidated metadata if present (consolidated=None),
+    which is read at once instead of reading the metadata of every group and array.
+    If opening with consolidated metadata fails, the directory is opened without it (see consolidate_zarr_metadata to repair it).
+
+    If cache is 'samples' or 'structure', proprietary formats (e.g., WinWCP, HEKA) are read from or added to the persistent cache
+    (see xarray_graph.io.cache) so that unchanged files reopen without being parsed again.
+    """
     filepath = Path(filepath)
+    unflatten_attrs = False
+
+    if cache is not None:
+        cache_filetype = _proprietary_filetype(filepath, filetype)
+        if cache_filetype is not None:
+            return _open_cached_datatree(filepath, cache_filetype, chunks=chunks, packed=packed, cache=cache)
 
     if (filetype == 'Zarr Directory') and not filepath.is_dir():
         raise ValueError(f"Filepath {filepath} is not a directory, but filetype is 'Zarr Directory'.")
@@ -51,8 +92,17 @@ def open_datatree(filepath: str | os.PathLike, filetype: str = None, engine: str
     if filepath.is_dir():
         # Zarr Directory
         import zarr
+        if consolidated is None:
+            consolidated = _has_consolidated_metadata(filepath)
         with zarr.storage.LocalStore(filepath) as store:
-            datatree = xr.open_datatree(store, engine='zarr', chunks=chunks, consolidated=consolidated)
+            try:
+                datatree = xr.open_datatree(store, engine='zarr', chunks=chunks, consolidated=consolidated)
+            except Exception as err:
+                if not consolidated:
+                    raise
+                from warnings import warn
+                warn(f'Failed to open {filepath} with consolidated metadata, opening without it instead: {err}')
+                datatree = xr.open_datatree(store, engine='zarr', chunks=chunks, consolidated=False)
     # elif (filetype == 'Zarr Zip') or (filepath.suffix in ['.zip', '.ZIP']):
     #     # Zarr Zip
     #     # !! This should work, but zarr v3 has issues with zip files, so a workaround is to zip/unzip Zarr directories using OS commands)
@@ -68,65 +118,550 @@ def open_datatree(filepath: str | os.PathLike, filetype: str = None, engine: str
     #     shutil.rmtree(tmp_dir)
     elif (filetype == 'WinWCP') or (filepath.suffix in ['.wcp', '.WCP']):
         # WinWCP
+        # chunks=None loads all sweeps into memory, otherwise sweeps are read on demand
+        # (and additionally wrapped in dask arrays for non-empty chunks)
         from xarray_graph.io.winwcp import read_winwcp
-        return read_winwcp(filepath)
+        datatree = read_winwcp(filepath, lazy=chunks is not None, packed=packed)
+        if chunks:
+            datatree = datatree.chunk(chunks)
+        return datatree
     elif (filetype == 'HEKA'):
         # HEKA
+        # chunks=None loads all traces into memory, otherwise only the tree is built up front and traces are read on demand
+        # (and additionally wrapped in dask arrays for non-empty chunks)
         from xarray_graph.io.heka import read_heka
-        return read_heka(filepath)
+        datatree = read_heka(filepath, packed=packed, lazy=chunks is not None)
+        if chunks:
+            datatree = datatree.chunk(chunks)
+        return datatree
     elif (filetype == 'Axon ABF') or (filepath.suffix in ['.abf', '.ABF']):
         # Axon ABF
-        pass # TODO
+        # the data section is always memory mapped and scaled on access
+        # (and additionally wrapped in dask arrays for non-empty chunks)
+        from xarray_graph.io.abf import read_abf
+        datatree = read_abf(filepath, packed=packed)
+        if chunks:
+            datatree = datatree.chunk(chunks)
+        return datatree
     elif (filetype == 'LabChart MATLAB (GOlab TEVC)'):
         # LabChart MATLAB (GOlab TEVC)
+        # MATLAB v7.3 (HDF5) files are always read on demand
+        # (and additionally wrapped in dask arrays for non-empty chunks)
         from xarray_graph.io.labchart import read_adicht_mat
-        return read_adicht_mat(filepath)
+        datatree = read_adicht_mat(filepath)
+        if chunks:
+            datatree = datatree.chunk(chunks)
+        return datatree
     else:
         # netCDF/HDF5 [.nc, .h5, .hdf5]
         datatree: xr.DataTree = xr.open_datatree(filepath, engine=engine, chunks=chunks)
         # nested attrs not allowed in netCDF/HDF5, so we need to recover them after deserialization
-        from xarray_graph.utils.xarray_utils import restore_attrs_objects_from_strings
-        datatree = restore_attrs_objects_from_strings(datatree)
+        unflatten_attrs = True
         
     from xarray_graph.utils.xarray_utils import recover_post_deserialization
-    datatree = recover_post_deserialization(datatree)
+    datatree = recover_post_deserialization(datatree, unflatten_attrs=unflatten_attrs)
     
     return datatree
 
 
-def save_datatree(datatree: xr.DataTree, filepath: str | os.PathLike, filetype: str = None, engine: str = None, consolidated: bool = False) -> None:
+def _proprietary_filetype(filepath: Path, filetype: str = None) -> str | None:
+    """ Filetype of proprietary formats as resolved by open_datatree, otherwise None.
+    """
+    if filepath.is_dir():
+        return None
+    if (filetype == 'WinWCP') or (filepath.suffix in ['.wcp', '.WCP']):
+        return 'WinWCP'
+    if filetype == 'HEKA':
+        return 'HEKA'
+    if (filetype == 'Axon ABF') or (filepath.suffix in ['.abf', '.ABF']):
+        return 'Axon ABF'
+    if filetype == 'LabChart MATLAB (GOlab TEVC)':
+        return filetype
+    return None
+
+
+def _open_cached_datatree(filepath: Path, filetype: str, chunks = None, packed: bool = False, cache: str = 'samples') -> xr.DataTree:
+    """ Open datatree from the persistent cache, or read it on demand from filepath and add it to the cache.
+
+    chunks has the same meaning as for open_datatree (None loads all data into memory).
+    """
+    from xarray_graph.io.cache import read_cached_datatree, write_cached_datatree
+    options = {'filetype': filetype, 'packed': packed}
+    datatree = read_cached_datatree(filepath, cache, options)
+    if datatree is None:
+        datatree = open_datatree(filepath, filetype=filetype, chunks={}, packed=packed)
+        write_cached_datatree(datatree, filepath, cache, options)
+    if chunks is None:
+        detach_datatree_backend(datatree, materialize=True)
+    elif chunks:
+        datatree = datatree.chunk(chunks)
+    return datatree
+
+
+class SaveCanceled(Exception):
+    """ Raised by save_datatree when the save is canceled by its progress callback.
+    """
+    pass
+
+
+def save_datatree(datatree: xr.DataTree, filepath: str | os.PathLike, filetype: str = None, engine: str = None, consolidated: bool = True, array_attrs_min_size: int | None = None, changes: ChangeTracker = None, progress: Callable[[int, int, str], bool] = None, encoding: str | dict = None, xdim: str = 'time') -> None:
+    """ Save datatree to file.
+
+    encoding is either the name of one of the encoding_presets (chunks aligned to sweeps along xdim, see datatree_encoding),
+    or an explicit encoding {node path: {var name: var encoding}} as for DataTree.to_zarr/to_netcdf.
+    If None, the backend's default chunking and compression are used.
+
+    The datatree is written to a temporary path next to filepath which then replaces filepath,
+    so a canceled or failed save never leaves a partially written file at filepath.
+
+    Zarr directories are written with consolidated metadata unless consolidated is False.
+
+    If array_attrs_min_size is not None, numeric array attrs with at least that many elements are stored in hidden variables
+    instead of the attrs (e.g., so that large arrays are chunked and compressed), otherwise all attrs are saved as they are.
+
+    If changes is given and filepath is an existing Zarr directory holding a previous version of datatree,
+    only the changed data is rewritten (see _update_zarr). The update is made in a copy of the store whose files
+    are hard links to the existing ones (so unchanged data is neither read nor copied), which then replaces filepath.
+    If hard links are not supported, the entire datatree is saved instead.
+
+    If progress is given, progress(n_written, n_total, path) is called as each data_var is about to be written
+    (and with the final count when done). The save is canceled (raises SaveCanceled) if it returns False.
+    """
     filepath = Path(filepath)
+    is_zarr = (filetype == 'Zarr Directory') or ((filetype is None) and (filepath.is_dir() or filepath.suffix in ['', '.zarr']))
 
+    if (changes is not None) and not changes.isAllChanged():
+        # before the variables are separated for serialization
+        changes = _with_shared_data_changes(datatree, changes)
+
+    # nested attrs not allowed in netCDF/HDF5, so we need to convert them to strings before serialization
     from xarray_graph.utils.xarray_utils import prepare_for_serialization
-    datatree = prepare_for_serialization(datatree)
+    datatree = prepare_for_serialization(datatree, flatten_attrs=not is_zarr, array_attrs_min_size=array_attrs_min_size)
+
+    if isinstance(encoding, str):
+        encoding = datatree_encoding(datatree, encoding, is_zarr=is_zarr, xdim=xdim)
+
+    if not is_zarr and filepath.suffix not in ['.nc', '.h5', '.hdf5']:
+        filepath = filepath.with_suffix('.h5')
+    tmp_filepath = filepath.with_name(f'~{filepath.name}.saving')
+    _remove_path(tmp_filepath)
+
+    if is_zarr and (changes is not None) and not changes.isAllChanged() and filepath.is_dir():
+        # update a hard linked copy of the existing Zarr directory
+        try:
+            updated = _link_tree(filepath, tmp_filepath) and _update_zarr(datatree, tmp_filepath, changes, consolidated=consolidated, encoding=encoding, progress=progress)
+        except BaseException:
+            _remove_path(tmp_filepath)
+            raise
+        if updated:
+            _replace_path(tmp_filepath, filepath)
+            return
+        _remove_path(tmp_filepath)
+
+    if progress is not None:
+        datatree, n_total = _with_progress(datatree, progress)
 
     # write datatree to filesystem
-    if (filetype == 'Zarr Directory') or ((filetype is None) and (filepath.is_dir() or filepath.suffix in ['', '.zarr'])):
-        # Zarr Directory
-        import zarr
-        with zarr.storage.LocalStore(filepath) as store:
-            datatree.to_zarr(store, mode='w', consolidated=consolidated)
-    # elif (filetype == 'Zarr Zip') or ((filetype is None) and (filepath.suffix in ['.zip', '.ZIP'])):
-    #     # Zarr Zip
-    #     # !! This should work, but zarr v3 has issues with zip files, so a workaround is to zip/unzip Zarr directories using OS commands)
-    #     # with zarr.storage.ZipStore(filepath, mode='w') as store:
-    #     #     datatree.to_zarr(store, mode='w', consolidated=consolidated)
-        
-    #     # !! zarr v3 has issues with zip files, so a workaround is to zip/unzip Zarr directories using OS commands)
-    #     # Write it to a temporary Zarr directory, zip it, then delete the temporary directory.
-    #     tmp_dir = filepath.with_name('~' + filepath.stem + '_unzipped')
-    #     with zarr.storage.LocalStore(tmp_dir) as store:
-    #         datatree.to_zarr(store, mode='w', consolidated=consolidated)
-    #     shutil.make_archive(filepath.with_suffix(''), "zip", tmp_dir)
-    #     shutil.rmtree(tmp_dir)
+    try:
+        if is_zarr:
+            # Zarr Directory
+            import zarr
+            with zarr.storage.LocalStore(tmp_filepath) as store, _ignore_consolidated_metadata_warning():
+                datatree.to_zarr(store, mode='w', consolidated=consolidated, encoding=encoding)
+        # elif (filetype == 'Zarr Zip') or ((filetype is None) and (filepath.suffix in ['.zip', '.ZIP'])):
+        #     # Zarr Zip
+        #     # !! This should work, but zarr v3 has issues with zip files, so a workaround is to zip/unzip Zarr directories using OS commands)
+        #     # with zarr.storage.ZipStore(filepath, mode='w') as store:
+        #     #     datatree.to_zarr(store, mode='w', consolidated=consolidated)
+            
+        #     # !! zarr v3 has issues with zip files, so a workaround is to zip/unzip Zarr directories using OS commands)
+        #     # Write it to a temporary Zarr directory, zip it, then delete the temporary directory.
+        #     tmp_dir = filepath.with_name('~' + filepath.stem + '_unzipped')
+        #     with zarr.storage.LocalStore(tmp_dir) as store:
+        #         datatree.to_zarr(store, mode='w', consolidated=consolidated)
+        #     shutil.make_archive(filepath.with_suffix(''), "zip", tmp_dir)
+        #     shutil.rmtree(tmp_dir)
+        else:
+            # NetCDF/HDF5
+            datatree.to_netcdf(tmp_filepath, mode='w', engine=engine, encoding=encoding)
+    except BaseException:
+        _remove_path(tmp_filepath)
+        raise
+    _replace_path(tmp_filepath, filepath)
+    if progress is not None:
+        progress(n_total, n_total, '')
+
+
+def datatree_encoding(datatree: xr.DataTree, preset: str, is_zarr: bool = True, xdim: str = 'time') -> dict[str, dict[str, dict]]:
+    """ Return encoding {node path: {var name: var encoding}} of datatree's numeric data_vars for one of the encoding_presets.
+
+    Chunks are aligned with per sweep access along xdim (or the last dimension of data_vars without xdim).
+    Chunks of dask arrays are left as they are.
+    """
+    if preset not in encoding_presets:
+        raise ValueError(f'Unknown encoding preset {preset}, must be one of {list(encoding_presets)}')
+    options = encoding_presets[preset]
+    if is_zarr:
+        import zarr.codecs
+        codec_options = dict(options['zarr'])
+        codec = getattr(zarr.codecs, codec_options.pop('codec'))(**codec_options)
+        compression = {'compressors': [codec]}
+        chunks_key = 'chunks'
     else:
-        # NetCDF/HDF5
-        if filepath.suffix not in ['.nc', '.h5', '.hdf5']:
-            filepath = filepath.with_suffix('.h5')
-        # nested attrs not allowed in netCDF/HDF5, so we need to convert them to strings before serialization
-        from xarray_graph.utils.xarray_utils import store_attrs_objects_as_strings
-        datatree = store_attrs_objects_as_strings(datatree)
-        datatree.to_netcdf(filepath, mode='w', engine=engine)
+        compression = options['netcdf']
+        chunks_key = 'chunksizes'
+
+    encoding: dict[str, dict[str, dict]] = {}
+    for node in datatree.subtree:
+        node_encoding = {}
+        for name, var in node.to_dataset(inherit=False).data_vars.items():
+            if (var.ndim == 0) or (var.size == 0) or (var.dtype.kind not in 'biuf'):
+                continue
+            var_encoding = dict(compression)
+            if var.chunks is None:
+                var_encoding[chunks_key] = sweep_chunks(var.shape, var.dtype.itemsize, var.dims.index(xdim) if xdim in var.dims else -1, options['min_chunk_bytes'], options['max_chunk_bytes'])
+            node_encoding[name] = var_encoding
+        if node_encoding:
+            encoding[node.path] = node_encoding
+    return encoding
+
+
+def sweep_chunks(shape: tuple[int], itemsize: int, xaxis: int = -1, min_chunk_bytes: int = 0, max_chunk_bytes: int = None) -> tuple[int]:
+    """ Chunk shape holding entire sweeps along xaxis.
+
+    Consecutive sweeps (innermost dimensions first) are grouped until a chunk holds at least min_chunk_bytes.
+    Sweeps are only split along xaxis if they exceed max_chunk_bytes.
+    """
+    ndim = len(shape)
+    xaxis = xaxis % ndim
+    chunks = [1] * ndim
+    chunks[xaxis] = shape[xaxis]
+    sweep_bytes = shape[xaxis] * itemsize
+    if (max_chunk_bytes is not None) and (sweep_bytes > max_chunk_bytes):
+        n_parts = -(-sweep_bytes // max_chunk_bytes)
+        chunks[xaxis] = -(-shape[xaxis] // n_parts)
+        return tuple(chunks)
+    chunk_bytes = max(sweep_bytes, itemsize)
+    for axis in reversed(range(ndim)):
+        if axis == xaxis:
+            continue
+        if chunk_bytes >= min_chunk_bytes:
+            break
+        n = min(shape[axis], -(-min_chunk_bytes // chunk_bytes))
+        if max_chunk_bytes is not None:
+            n = max(1, min(n, max_chunk_bytes // chunk_bytes))
+        chunks[axis] = n
+        chunk_bytes *= n
+    return tuple(chunks)
+
+
+def _replace_path(src: Path, dst: Path) -> None:
+    """ Replace file or directory dst with src.
+
+    Files are replaced atomically. An existing directory is first renamed out of the way and only deleted after src has been moved into place.
+    """
+    if not src.is_dir() and not dst.is_dir():
+        os.replace(src, dst)
+        return
+    backup = None
+    if dst.exists():
+        backup = dst.with_name(f'~{dst.name}.replaced')
+        _remove_path(backup)
+        os.replace(dst, backup)
+    os.replace(src, dst)
+    if backup is not None:
+        _remove_path(backup)
+
+
+def _remove_path(path: Path) -> None:
+    """ Remove file or directory if it exists.
+    """
+    if path.is_dir():
+        import shutil
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def _link_tree(src: Path, dst: Path) -> bool:
+    """ Copy directory src to dst with hard links to its files instead of copying their contents.
+
+    Returns False (and leaves no dst) if hard links are not supported.
+    Only safe to write to if files are replaced rather than written into (as for Zarr's LocalStore),
+    otherwise writes to dst would also change src.
+    """
+    import shutil
+    try:
+        shutil.copytree(src, dst, copy_function=os.link)
+    except OSError:
+        _remove_path(dst)
+        return False
+    return True
+
+
+def _with_progress(datatree: xr.DataTree, progress: Callable[[int, int, str], bool]) -> tuple[xr.DataTree, int]:
+    """ Return a copy of datatree that reports writing progress when the data of each data_var is first read, and the number of data_vars that report progress.
+
+    Data_vars are wrapped in lazily indexed arrays that call progress (and raise SaveCanceled if it returns False) when first read.
+    Dask arrays are left as is (they are written chunk by chunk and not counted).
+    """
+    import threading
+    from xarray.core import indexing
+    datasets = {node.path: node.to_dataset(inherit=False) for node in datatree.subtree}
+    to_wrap = {path: [name for name, var in ds.data_vars.items() if var.chunks is None] for path, ds in datasets.items()}
+    n_total = sum(len(names) for names in to_wrap.values())
+    state = {'n_written': 0}
+    lock = threading.Lock()
+
+    def report(path: str) -> None:
+        with lock:
+            n_written = state['n_written']
+            state['n_written'] += 1
+        if progress(n_written, n_total, path) is False:
+            raise SaveCanceled(f'Save canceled before writing {path}.')
+
+    wrapped = {}
+    for path, ds in datasets.items():
+        data_vars = {}
+        for name in to_wrap[path]:
+            var = ds.variables[name]
+            array = _ProgressBackendArray(var, f"{path.rstrip('/')}/{name}", report)
+            data_vars[name] = xr.Variable(var.dims, indexing.LazilyIndexedArray(array), var.attrs, var.encoding)
+        wrapped[path] = ds.assign(data_vars) if data_vars else ds
+    return xr.DataTree.from_dict(wrapped, name=datatree.name), n_total
+
+
+class _ProgressBackendArray(BackendArray):
+    """ Variable data that calls report(path) before it is first read.
+    """
+
+    def __init__(self, variable: xr.Variable, path: str, report: Callable[[str], None]):
+        self.shape = variable.shape
+        self.dtype = variable.dtype
+        self._variable = variable
+        self._path = path
+        self._report = report
+        self._is_reported = False
+
+    def __getitem__(self, key):
+        from xarray.core import indexing
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.OUTER, self._raw_indexing_method)
+
+    def _raw_indexing_method(self, key: tuple):
+        if not self._is_reported:
+            self._is_reported = True
+            self._report(self._path)
+        return self._variable[key].values
+
+
+def _with_shared_data_changes(datatree: xr.DataTree, changes: ChangeTracker) -> ChangeTracker:
+    """ Return a copy of changes in which changed data_vars are also marked as changed in all nodes sharing their data.
+
+    e.g., an in-place edit recorded for an inherited data_var also changes the data_var of the node it is inherited from
+    (and of any other node inheriting it), which may be stored separately if its attrs were changed.
+    """
+    import copy
+    from xarray_graph.utils.xarray_utils import shares_data, inherited_root
+    shared_changes = copy.deepcopy(changes)
+    for node in datatree.subtree:
+        for name, region in changes.changedVariables(node.path).items():
+            if name not in node.data_vars:
+                continue
+            var = node.data_vars[name].variable
+            for other in inherited_root(node, name).subtree:
+                if (other is not node) and (name in other.data_vars) and shares_data(other.data_vars[name].variable, var, compare_attrs=False):
+                    shared_changes.markVariableChanged(other.path, name, region)
+    return shared_changes
+
+
+def _update_zarr(datatree: xr.DataTree, filepath: Path, changes: ChangeTracker, consolidated: bool = False, encoding: dict[str, dict[str, dict]] = None, progress: Callable[[int, int, str], bool] = None) -> bool:
+    """ Update an existing Zarr directory in place to match a datatree that is ready for serialization.
+
+    Only variables recorded in changes are rewritten (only the chunks within the changed region if given),
+    and only nodes recorded in changes are rewritten with their entire subtree.
+    Nodes and variables that are new or no longer exist are written or deleted, and node and variable attrs
+    that differ from those in the store are rewritten, so these changes are synced even if they were not recorded.
+    Returns False without changing the store if the entire tree needs to be rewritten (or the store cannot be opened).
+    Newly created arrays are written with encoding {node path: {var name: var encoding}} if given.
+
+    If progress is given, progress(n_written, n_total, path) is called before each variable or rewritten node is written
+    (and with the final count when done). The update is canceled (raises SaveCanceled) if it returns False,
+    which leaves the store partially updated, so the update should be made in a copy of the store (see save_datatree).
+    """
+    import numpy as np
+    import zarr
+    from xarray.backends.zarr import encode_zarr_attr_value
+    from xarray.conventions import encode_cf_variable
+    try:
+        # consolidated metadata may be out of date after the update
+        root: zarr.Group = zarr.open_group(filepath, mode='r+', use_consolidated=False)
+    except Exception:
+        return False
+    datasets: dict[str, xr.Dataset] = {node.path: node.to_dataset(inherit=False) for node in datatree.subtree}
+
+    def get_group(path: str) -> zarr.Group | None:
+        try:
+            group = root[path.strip('/')] if path != '/' else root
+        except KeyError:
+            return None
+        return group if isinstance(group, zarr.Group) else None
+
+    def in_subtree(path: str, subtree_path: str) -> bool:
+        return (path == subtree_path) or path.startswith(subtree_path.rstrip('/') + '/')
+
+    # subtrees to rewrite entirely (parents are visited before their children)
+    rewrite_paths: list[str] = []
+    for path in datasets:
+        if any(in_subtree(path, rewrite_path) for rewrite_path in rewrite_paths):
+            continue
+        if (path in changes.changedNodes()) or (get_group(path) is None):
+            rewrite_paths.append(path)
+    if '/' in rewrite_paths:
+        return False
+    # load rewritten subtrees before anything is deleted from the store in case they are read lazily from it (e.g., renamed nodes)
+    for path, ds in datasets.items():
+        if any(in_subtree(path, rewrite_path) for rewrite_path in rewrite_paths):
+            datasets[path] = ds.load()
+
+    # changed variables are stored in the node they are inherited from
+    changed_variables: dict[str, dict[str, dict[str, slice] | None]] = {}
+    for node in datatree.subtree:
+        for name in changes.changedVariables(node.path):
+            path = node.path
+            while (name not in datasets[path].variables) and (path != '/'):
+                path = path.rpartition('/')[0] or '/'
+            if name in datasets[path].variables:
+                region = changes.changedVariables(node.path)[name]
+                variables = changed_variables.setdefault(path, {})
+                if (name in variables) and (variables[name] != region):
+                    region = None
+                variables[name] = region
+
+    # variable data to write {node path: {var name: (whether to replace the array, region or None for the entire variable)}}
+    to_write: dict[str, dict[str, tuple[bool, dict[str, slice] | None]]] = {}
+    for path, ds in datasets.items():
+        if any(in_subtree(path, rewrite_path) for rewrite_path in rewrite_paths):
+            continue
+        group = get_group(path)
+        variables = changed_variables.get(path, {})
+        node_to_write = to_write.setdefault(path, {})
+        for name, var in ds.variables.items():
+            array = group.get(name, None)
+            if (array is None) or (array.shape != var.shape) or (_zarr_array_dims(array) != var.dims):
+                node_to_write[name] = (True, None)
+            elif name in variables:
+                region = variables[name]
+                if (region is None) or all(region_slice.stop > region_slice.start for region_slice in region.values()):
+                    node_to_write[name] = (False, region)
+    rewrite_subtree_paths = [path for path in datasets if any(in_subtree(path, rewrite_path) for rewrite_path in rewrite_paths)]
+    n_total = sum(len(node_to_write) for node_to_write in to_write.values()) + len(rewrite_subtree_paths)
+    state = {'n_written': 0}
+
+    def report(path: str) -> None:
+        if progress is None:
+            return
+        if progress(state['n_written'], n_total, path) is False:
+            raise SaveCanceled(f'Save canceled before writing {path}.')
+        state['n_written'] += 1
+
+    for path, node_to_write in to_write.items():
+        ds = datasets[path]
+        group = get_group(path)
+        # remove groups and arrays that are no longer in the tree
+        for name in list(group.group_keys()):
+            if f"{path.rstrip('/')}/{name}" not in datasets:
+                del group[name]
+        for name in list(group.array_keys()):
+            if name not in ds.variables:
+                del group[name]
+        # variable data and attrs
+        node_encoding = (encoding or {}).get(path, {})
+        for name, var in ds.variables.items():
+            if name in node_to_write:
+                report(f"{path.rstrip('/')}/{name}")
+                replace, region = node_to_write[name]
+                if replace:
+                    if name in group:
+                        del group[name]
+                    var_encoding = {name: node_encoding[name]} if name in node_encoding else None
+                    xr.Dataset({name: var}).to_zarr(filepath, group=path, mode='a', consolidated=False, encoding=var_encoding)
+                    continue
+                elif region is None:
+                    xr.Dataset({name: var}).to_zarr(filepath, group=path, mode='a', consolidated=False)
+                else:
+                    xr.Dataset({name: var.isel(region)}).to_zarr(filepath, group=path, region=region, consolidated=False)
+            # attrs as written by xarray (encoded without touching the data), which are not updated by writes to an existing array
+            array = group[name]
+            encoded = encode_cf_variable(xr.Variable(var.dims, np.empty((0,) * var.ndim, dtype=var.dtype), var.attrs, var.encoding), name=name)
+            var_attrs = {key: encode_zarr_attr_value(value) for key, value in encoded.attrs.items() if key != '_FillValue'}
+            old_var_attrs = dict(array.attrs)
+            for key in ['_FillValue', '_ARRAY_DIMENSIONS', 'coordinates']:
+                if key in old_var_attrs:
+                    var_attrs[key] = old_var_attrs[key]
+            if var_attrs != old_var_attrs:
+                array.attrs.put(var_attrs)
+        # node attrs (after writing variables with xarray which also writes the node attrs)
+        # reopened as the group's metadata loaded above is out of date after xarray's writes
+        group = get_group(path)
+        attrs = {key: encode_zarr_attr_value(value) for key, value in ds.attrs.items()}
+        if dict(group.attrs) != attrs:
+            group.attrs.put(attrs)
+
+    for rewrite_path in rewrite_paths:
+        parent_group = get_group(rewrite_path.rpartition('/')[0] or '/')
+        name = rewrite_path.rpartition('/')[2]
+        if name in parent_group:
+            del parent_group[name]
+        for path in rewrite_subtree_paths:
+            if in_subtree(path, rewrite_path):
+                report(path)
+                datasets[path].to_zarr(filepath, group=path, mode='w', consolidated=False, encoding=(encoding or {}).get(path, None))
+
+    if consolidated or _has_consolidated_metadata(filepath):
+        consolidate_zarr_metadata(filepath)
+    if progress is not None:
+        progress(n_total, n_total, '')
+    return True
+
+
+def consolidate_zarr_metadata(filepath: str | os.PathLike) -> None:
+    """ Write (or repair out of date) consolidated metadata of a Zarr directory from the metadata of all of its groups and arrays.
+    """
+    import zarr
+    with _ignore_consolidated_metadata_warning():
+        zarr.consolidate_metadata(Path(filepath))
+
+
+def _has_consolidated_metadata(filepath: Path) -> bool:
+    """ Whether a Zarr directory has consolidated metadata (Zarr v2 or v3).
+    """
+    if (filepath / '.zmetadata').exists():
+        return True
+    try:
+        import json
+        with open(filepath / 'zarr.json') as f:
+            return json.load(f).get('consolidated_metadata', None) is not None
+    except Exception:
+        return False
+
+
+@contextmanager
+def _ignore_consolidated_metadata_warning() -> Iterator[None]:
+    """ Ignore zarr's warning that consolidated metadata is not part of the Zarr v3 specification.
+    """
+    import warnings
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='Consolidated metadata is currently not part')
+        yield
+
+
+def _zarr_array_dims(array) -> tuple[str]:
+    """ Dimension names of a Zarr array as written by xarray.
+    """
+    dims = getattr(array.metadata, 'dimension_names', None)
+    if dims is None:
+        dims = array.attrs.get('_ARRAY_DIMENSIONS', ())
+    return tuple(dims)
 
 
 def test():
@@ -147,5 +682,64 @@ def test():
     print(dt2)
 
 
+def benchmark(n_series: int = 4, n_sweeps: int = 50, n_samples: int = 100_000, n_sweep_reads: int = 20, directory: str | os.PathLike = None) -> None:
+    """ File size, save time, and read throughput (entire datatree and single sweeps) for each of the encoding_presets.
+
+    Synthetic recordings of current (quantized noisy traces) and voltage (step protocol) with dims (sweep, time).
+    """
+    import tempfile
+    import time
+    import numpy as np
+    rng = np.random.default_rng(0)
+    t = np.arange(n_samples) * 1e-4
+    datatree = xr.DataTree()
+    for i in range(n_series):
+        steps = np.zeros((n_sweeps, n_samples))
+        steps[:, n_samples // 4:n_samples // 2] = np.arange(n_sweeps)[:, None] * 5e-3
+        # 16-bit ADC samples
+        counts = np.round(steps[:, :] * 2e3 + np.cumsum(rng.normal(0, 1, (n_sweeps, n_samples)), axis=1) * 0.1 + rng.normal(0, 20, (n_sweeps, n_samples)))
+        datatree[f'series{i}'] = xr.Dataset(
+            data_vars={
+                'current': (('sweep', 'time'), counts * 1e-12, {'units': 'A'}),
+                'voltage': (('sweep', 'time'), steps, {'units': 'V'}),
+            },
+            coords={'sweep': np.arange(n_sweeps), 'time': ('time', t, {'units': 's'})},
+        )
+    n_bytes = sum(var.nbytes for node in datatree.subtree for var in node.to_dataset(inherit=False).data_vars.values())
+
+    if directory is None:
+        directory = tempfile.mkdtemp()
+    directory = Path(directory)
+    sweeps = [(f'series{rng.integers(n_series)}', int(rng.integers(n_sweeps))) for _ in range(n_sweep_reads)]
+    print(f'{n_bytes / 1e6:.0f} MB in {n_series} x 2 x {n_sweeps} sweeps of {n_samples} samples')
+    print(f'{"format":<7} {"preset":<20} {"size (MB)":>10} {"save (s)":>9} {"read all (MB/s)":>16} {"read sweep (ms)":>16}')
+    for suffix in ['.zarr', '.h5']:
+        for preset in [None, *encoding_presets]:
+            filepath = directory / f'benchmark_{preset or "default"}{suffix}'.replace(' ', '_')
+            tic = time.perf_counter()
+            save_datatree(datatree, filepath, encoding=preset)
+            save_time = time.perf_counter() - tic
+            if filepath.is_dir():
+                size = sum(path.stat().st_size for path in filepath.rglob('*') if path.is_file())
+            else:
+                size = filepath.stat().st_size
+
+            tic = time.perf_counter()
+            dt = open_datatree(filepath)
+            for node in dt.subtree:
+                for name, var in node.to_dataset(inherit=False).data_vars.items():
+                    assert np.array_equal(var.values, datatree[node.path][name].values)
+            read_all_time = time.perf_counter() - tic
+            dt.close()
+
+            dt = open_datatree(filepath)
+            tic = time.perf_counter()
+            for series, sweep in sweeps:
+                dt[series]['current'].isel(sweep=sweep).values
+            read_sweep_time = (time.perf_counter() - tic) / n_sweep_reads
+            dt.close()
+            print(f'{suffix[1:]:<7} {preset or "default":<20} {size / 1e6:>10.1f} {save_time:>9.2f} {n_bytes / 1e6 / read_all_time:>16.0f} {read_sweep_time * 1e3:>16.2f}')
+
+
 if __name__ == '__main__':
     test()
\ No newline at end of file
@@ -2,21 +2,32 @@
 from pathlib import Path
 import numpy as np
 import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+from xarray_graph.utils.xarray_utils import ROI_KEY, NOTES_KEY
+
+
+# variables saved by golab_tev_adicht2mat.m
+MAT_VARIABLE_NAMES = ['current', 'current_units', 'voltage', 'voltage_units', 'time_interval_sec', 'events', 'notes']
 
 
 def read_adicht_mat(filepath: Path | str) -> xr.DataTree:
     """Read data from a LabChart .adicht file that has been converted to a MATLAB .mat file into an xarray.Dataset.
 
+    Only the variables in MAT_VARIABLE_NAMES are read from the file.
+    MATLAB v7.3 (HDF5) files are opened lazily, i.e., the current and voltage recordings are only read
+    from the file for the samples that are indexed.
+
     !! This loader is specific for TEVC recordings.
     """
-    # Import within function to avoid error due to circular dependency
-    # as XarrayGraph also imports this function.
-    # Putting the import within the function delays this import until use,
-    # which means XarrayGraph will already have been imported.
-    from xarray_graph.apps.XarrayGraph import ROI_KEY, NOTES_KEY
-    
     from scipy.io import loadmat
-    matdict = loadmat(str(filepath), simplify_cells=True)
+    from scipy.io.matlab import matfile_version
+    if matfile_version(str(filepath))[0] == 2:
+        # MATLAB v7.3 files are HDF5 files
+        matdict = _read_mat73(filepath, MAT_VARIABLE_NAMES)
+    else:
+        # only load the variables that are used below
+        matdict = loadmat(str(filepath), variable_names=MAT_VARIABLE_NAMES, simplify_cells=True)
     # print(matdict)
 
     current = matdict['current']
@@ -39,8 +50,12 @@ def read_adicht_mat(filepath: Path | str) -> xr.DataTree:
     )
 
     if 'events' in matdict and matdict['events']:
+        events = matdict['events']
+        if isinstance(events, dict):
+            # a single event is simplified to a dict
+            events = [events]
         ds.attrs[ROI_KEY] = []
-        for event in matdict['events']:
+        for event in events:
             time = event['time_sec']
             text = event['text']
             ds.attrs[ROI_KEY].append({
@@ -56,6 +71,90 @@ def read_adicht_mat(filepath: Path | str) -> xr.DataTree:
     return xr.DataTree(dataset=ds)
 
 
+class Mat73BackendArray(BackendArray):
+    """Lazily read MATLAB v7.3 (HDF5) vector.
+
+    Only the indexed samples are read from the file.
+    The file is opened on each access, so there are no open file handles to manage.
+    """
+
+    def __init__(self, filepath: Path | str, name: str, shape: tuple[int], dtype: np.dtype):
+        self.filepath = filepath
+        self.name = name
+        # MATLAB stores column vectors as (1, n) and row vectors as (n, 1) HDF5 datasets
+        self.is_row = shape[0] != 1
+        self.shape = (max(shape),)
+        self.dtype = np.dtype(dtype)
+
+    def __getitem__(self, key: indexing.ExplicitIndexer) -> np.ndarray:
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._raw_indexing_method)
+
+    def _raw_indexing_method(self, key: tuple) -> np.ndarray:
+        import h5py
+        with h5py.File(self.filepath, 'r') as file:
+            if self.is_row:
+                return file[self.name][key[0], 0]
+            return file[self.name][0, key[0]]
+
+
+def _read_mat73(filepath: Path | str, variable_names: list[str]) -> dict:
+    """Read variables from a MATLAB v7.3 (HDF5) file into a dict similar to loadmat(..., simplify_cells=True).
+
+    Numeric vectors are lazily indexed arrays backed by Mat73BackendArray, everything else is loaded.
+    """
+    import h5py
+    matdict = {}
+    with h5py.File(filepath, 'r') as file:
+        for name in variable_names:
+            if name not in file:
+                continue
+            obj = file[name]
+            if isinstance(obj, h5py.Dataset) and _mat73_class(obj) in ['double', 'single'] and len(obj.shape) == 2 and min(obj.shape) == 1 and max(obj.shape) > 1:
+                # in-place edits load the vector into memory first (copy-on-write)
+                matdict[name] = indexing.MemoryCachedArray(indexing.CopyOnWriteArray(indexing.LazilyIndexedArray(
+                    Mat73BackendArray(filepath, name, obj.shape, obj.dtype)
+                )))
+            else:
+                matdict[name] = _read_mat73_value(file, obj)
+    return matdict
+
+
+def _mat73_class(obj) -> str:
+    matlab_class = obj.attrs.get('MATLAB_class', b'')
+    if isinstance(matlab_class, bytes):
+        matlab_class = matlab_class.decode()
+    return matlab_class
+
+
+def _read_mat73_value(file, obj):
+    """Load a MATLAB v7.3 variable (char, numeric, cell or struct) with cells and structs simplified to lists and dicts.
+    """
+    import h5py
+    matlab_class = _mat73_class(obj)
+    if obj.attrs.get('MATLAB_empty', 0):
+        return '' if matlab_class == 'char' else []
+    if isinstance(obj, h5py.Group):
+        # struct (fields that are arrays of references without a class of their own are the elements of a struct array)
+        fields = {name: obj[name] for name in obj if not name.startswith('#')}
+        is_struct_array = fields and all(isinstance(field, h5py.Dataset) and field.dtype == h5py.ref_dtype and not _mat73_class(field) for field in fields.values())
+        if not is_struct_array:
+            return {name: _read_mat73_value(file, field) for name, field in fields.items()}
+        refs = {name: field[()].T.flatten() for name, field in fields.items()}
+        n_elements = len(next(iter(refs.values())))
+        elements = [{name: _read_mat73_value(file, file[refs[name][i]]) for name in fields} for i in range(n_elements)]
+        return elements[0] if n_elements == 1 else elements
+    data = obj[()]
+    if matlab_class == 'char':
+        return ''.join(chr(code) for code in data.T.flatten())
+    if matlab_class == 'cell':
+        return [_read_mat73_value(file, file[ref]) for ref in data.T.flatten()]
+    # HDF5 dims are reversed relative to MATLAB
+    data = np.squeeze(data.T)
+    if matlab_class == 'logical':
+        data = data.astype(bool)
+    return data.item() if data.ndim == 0 else data
+
+
 if __name__ == '__main__':
     filepath = 'examples/LabChartTEVC.mat'
     dt = read_adicht_mat(filepath)
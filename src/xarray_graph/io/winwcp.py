@@ -1,32 +1,31 @@
-
 import struct
 import os
 from pathlib import Path
 import numpy as np
 import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
 
-def read_winwcp(filepath: str | os.PathLike) -> xr.DataTree:
-    """Read data from a WinWCP file into an xarray.DataTree.
-    
-    Return a xarray.DataTree with a single dataset if all sweeps have the same sample interval.
-    Otherwise return a tree with multiple leaf datasets (one per sweep).
+
+def read_winwcp_header(filepath: str | os.PathLike) -> dict:
+    """Read the text header of a WinWCP file into a dict of strings.
     """
 
     if isinstance(filepath, str):
         filepath = Path(filepath)
 
-    # read file contents as binary byte array
     with filepath.open(mode='rb') as file:
-        file_bytes = file.read()
+        # the header is at least 1024 bytes and the number of channels is always within the first block
+        file_bytes = file.read(1024)
+        start = file_bytes.find(b'NC=') + 3
+        stop = start + file_bytes[start:].find(b'\r\n')
+        n_channels = int(file_bytes[start:stop])
 
-    # search for the number of channels in the header
-    start = file_bytes.find(b'NC=') + 3
-    stop = start + file_bytes[start:].find(b'\r\n')
-    n_channels = int(file_bytes[start:stop])
+        # header size depends on the number of channels
+        n_header_bytes = (int((n_channels - 1) / 8) + 1) * 1024
+        file.seek(0)
+        header_bytes = file.read(n_header_bytes)
 
-    # read header
-    n_header_bytes = (int((n_channels - 1) / 8) + 1) * 1024
-    header_bytes = file_bytes[:n_header_bytes]
     header_lines = header_bytes.decode('utf-8').split('\r\n')
     header = {}
     for line in header_lines:
@@ -35,7 +34,97 @@ def read_winwcp(filepath: str | os.PathLike) -> xr.DataTree:
             header[k] = v
         except:
             pass
-    
+    return header
+
+
+def winwcp_record_dtype(header: dict) -> np.dtype:
+    """Return a numpy structured dtype for a single WinWCP record (i.e., sweep).
+
+    Each record consists of an analysis block followed by a data block.
+    The analysis block holds the sweep status, type, group, start time, sample interval and per channel Vmax.
+    The data block holds the digitized samples as 16-bit signed integers interleaved by channel (sample, channel).
+    Both blocks are padded to a multiple of 512 bytes, which is reflected in the dtype's field offsets and itemsize.
+    """
+    n_channels = int(header['NC'])
+    try:
+        n_analysis_bytes = int(header['NBA']) * 512
+    except:
+        n_analysis_bytes = (int((n_channels - 1) / 8) + 1) * 1024
+    n_data_bytes = int(header['NBD']) * 512
+    try:
+        n_samples = int(header['NP'])
+    except:
+        n_samples = int(n_data_bytes / 2 / n_channels)
+
+    return np.dtype({
+        'names': ['status', 'type', 'group', 'start_time', 'sample_interval', 'vmax', 'adc'],
+        'formats': ['S8', 'S4', '<f4', '<f4', '<f4', ('<f4', (n_channels,)), ('<i2', (n_samples, n_channels))],
+        'offsets': [0, 8, 12, 16, 20, 24, n_analysis_bytes],
+        'itemsize': n_analysis_bytes + n_data_bytes,
+    })
+
+
+class WinWCPBackendArray(BackendArray):
+    """Lazily calibrated (sweep, sample) array for a single WinWCP channel.
+
+    Only the indexed sweeps and samples are read from the memory mapped record area.
+    The file is mapped on each access, so there are no open file handles to manage.
+    If calibrate is False, the digitized 16-bit samples are returned as is.
+    """
+
+    def __init__(self, filepath: Path, header: dict, channel: int, calibrate: bool = True):
+        self.filepath = filepath
+        self.channel = channel
+        self.calibrate = calibrate
+        self.n_header_bytes = (int((int(header['NC']) - 1) / 8) + 1) * 1024
+        self.record_dtype = winwcp_record_dtype(header)
+        self.gain = float(header[f'YG{channel}']) * int(header['ADCMAX'])
+        self.shape = (int(header['NR']), self.record_dtype['adc'].shape[0])
+        self.dtype = np.dtype(np.float64) if calibrate else self.record_dtype['adc'].base
+
+    def __getitem__(self, key: indexing.ExplicitIndexer) -> np.ndarray:
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._raw_indexing_method)
+
+    def _raw_indexing_method(self, key: tuple) -> np.ndarray:
+        sweep_key, sample_key = key
+        records = np.memmap(self.filepath, dtype=self.record_dtype, mode='r', offset=self.n_header_bytes, shape=(self.shape[0],))
+        adc = records['adc'][sweep_key, sample_key, self.channel]
+        if not self.calibrate:
+            return np.array(adc)
+        conversion_factor = records['vmax'][sweep_key, self.channel].astype(np.float64) / self.gain
+        if isinstance(sweep_key, slice) and isinstance(sample_key, slice):
+            conversion_factor = conversion_factor[:, np.newaxis]
+        return conversion_factor * adc
+
+
+def read_winwcp(filepath: str | os.PathLike, lazy: bool = False, packed: bool = False) -> xr.DataTree:
+    """Read data from a WinWCP file into an xarray.DataTree.
+
+    Return a xarray.DataTree with a single dataset if all sweeps have the same sample interval.
+    Otherwise return a tree with multiple leaf datasets (one per sweep).
+
+    The record area of the file is memory mapped as an array of structured records,
+    so all sweep headers are decoded and all channels are calibrated in one vectorized step
+    without ever holding a copy of the raw file contents in memory.
+
+    If lazy is True, channels are backed by WinWCPBackendArray and only the sweeps that are
+    indexed are read and calibrated. Sweep headers are always read up front.
+
+    If packed is True, channels whose conversion factor is the same for all sweeps keep their
+    digitized 16-bit samples with a CF scale_factor encoding and are decoded lazily on access
+    (see decode_packed_data_vars). They are also written back out as packed 16-bit integers.
+    """
+
+    if isinstance(filepath, str):
+        filepath = Path(filepath)
+
+    header = read_winwcp_header(filepath)
+    n_channels = int(header['NC'])
+    n_header_bytes = (int((n_channels - 1) / 8) + 1) * 1024
+    n_sweeps = int(header['NR'])
+    record_dtype = winwcp_record_dtype(header)
+    n_samples = record_dtype['adc'].shape[0]
+
     # datetime
     date = header['CTIME'].split(' ')[0].strip()
     month, day, year = date.split('-')
@@ -49,52 +138,75 @@ def read_winwcp(filepath: str | os.PathLike) -> xr.DataTree:
     timestamp = header['RTIME'].split(' ')[-1].strip()
     datetime = f'{date} {timestamp}'
 
-    # read records (i.e., sweeps)
-    # Each record consists of an analysis block followed by a data block.
-    n_sweeps = int(header['NR'])
-    try:
-        n_analysis_bytes = int(header['NBA']) * 512
-    except:
-        n_analysis_bytes = (int((n_channels - 1) / 8) + 1) * 1024
-    n_data_bytes = int(header['NBD']) * 512
-    try:
-        n_samples = int(header['NP'])
-    except:
-        n_samples = int(n_data_bytes / 2 / n_channels)
-    
+    # memory map records (i.e., sweeps)
+    records = np.memmap(filepath, dtype=record_dtype, mode='r', offset=n_header_bytes, shape=(n_sweeps,))
+
+    # for converting digitized signal to signal in physical units
+    ADCmax = int(header['ADCMAX'])
+    gain_per_channel = np.array([float(header[f'YG{i}']) for i in range(n_channels)]) * ADCmax
+    conversion_factor = records['vmax'].astype(np.float64) / gain_per_channel # (sweep, channel)
+
+    # channels that can be stored as packed 16-bit integers with a single scale factor
+    packed_channels = []
+    if packed:
+        packed_channels = [i for i in range(n_channels) if np.all(conversion_factor[:, i] == conversion_factor[0, i])]
+
+    if lazy:
+        # calibrated on access (sweep, sample) per channel
+        channel_data = [
+            indexing.MemoryCachedArray(indexing.CopyOnWriteArray(indexing.LazilyIndexedArray(
+                WinWCPBackendArray(filepath, header, i, calibrate=(i not in packed_channels))
+            )))
+            for i in range(n_channels)
+        ]
+    elif packed_channels:
+        # digitized signal for packed channels, calibrated signal in physical units for all others
+        adc = records['adc'].transpose(2, 0, 1) # (channel, sweep, sample)
+        channel_data = [
+            np.array(adc[i]) if i in packed_channels else adc[i] * conversion_factor[:, i, np.newaxis]
+            for i in range(n_channels)
+        ]
+    else:
+        # calibrated signal in physical units (channel, sweep, sample)
+        channel_data = np.empty((n_channels, n_sweeps, n_samples))
+        np.multiply(records['adc'].transpose(2, 0, 1), conversion_factor.T[:, :, np.newaxis], out=channel_data)
+
     # store everything in a xarray.Dataset
     channel_names = [header[f'YN{i}'] for i in range(n_channels)]
     channel_units = [header[f'YU{i}'] for i in range(n_channels)]
+    channel_attrs = [{'units': channel_units[i]} for i in range(n_channels)]
+    for i in packed_channels:
+        channel_attrs[i]['scale_factor'] = conversion_factor[0, i]
     data = xr.Dataset(
         data_vars={
-            channel_names[i]: xr.DataArray(
-                data=np.zeros((n_sweeps, n_samples)),
-                dims=['sweep', 'time'], 
-                attrs={'units': channel_units[i]})
+            channel_names[i]: xr.Variable(
+                dims=['sweep', 'time'],
+                data=channel_data[i],
+                attrs=channel_attrs[i])
             for i in range(n_channels)
         },
         coords={
             'sweep': np.arange(1, n_sweeps + 1), # 1-based sweep index
             'time': xr.DataArray(
-                data=np.arange(n_samples) * float(header['DT']), 
-                dims=['time'], 
+                data=np.arange(n_samples) * float(header['DT']),
+                dims=['time'],
                 attrs={'units': 's'}),
             'sweep_status': xr.DataArray(
-                data=np.array(['ACCEPTED'] * n_sweeps, dtype=object), 
+                data=np.array([status.decode('utf-8') for status in records['status']], dtype=object),
                 dims=['sweep']),
             'sweep_type': xr.DataArray(
-                data=np.array(['TEST'] * n_sweeps, dtype=object), 
+                data=np.array([sweep_type.decode('utf-8') for sweep_type in records['type']], dtype=object),
                 dims=['sweep']),
             'sweep_group': xr.DataArray(
-                data=np.zeros(n_sweeps), 
+                data=records['group'].astype(np.float64),
                 dims=['sweep']),
             'sweep_start_time': xr.DataArray(
-                data=np.zeros(n_sweeps), 
-                dims=['sweep'], 
+                data=records['start_time'].astype(np.float64),
+                dims=['sweep'],
                 attrs={'units': 's'}),
             'sweep_sample_interval': xr.DataArray(
-                data=np.zeros(n_sweeps), 
-                dims=['sweep'], 
+                data=records['sample_interval'].astype(np.float64),
+                dims=['sweep'],
                 attrs={'units': 's'}),
         },
         attrs={
@@ -104,33 +216,13 @@ def read_winwcp(filepath: str | os.PathLike) -> xr.DataTree:
         }
     )
 
-    # for converting digitized signal to signal in physical units
-    ADCmax = int(header['ADCMAX'])
-    gain_per_channel = np.array([float(header[f'YG{i}']) for i in range(n_channels)]).reshape(n_channels, 1) * ADCmax
-
-    for i in range(n_sweeps):
-        n_offset_bytes = n_header_bytes + i * (n_analysis_bytes + n_data_bytes)
-        analysis_bytes = file_bytes[n_offset_bytes:n_offset_bytes+n_analysis_bytes]
-        data_bytes = file_bytes[n_offset_bytes+n_analysis_bytes:n_offset_bytes+n_analysis_bytes+n_data_bytes]
-
-        data['sweep_status'][i] = analysis_bytes[:8].decode('utf-8')
-        data['sweep_type'][i] = analysis_bytes[8:12].decode('utf-8')
-        data['sweep_group'][i] = struct.unpack('f', analysis_bytes[12:16])[0]
-        data['sweep_start_time'][i] = struct.unpack('f', analysis_bytes[16:20])[0]
-        data['sweep_sample_interval'][i] = struct.unpack('f', analysis_bytes[20:24])[0]
-        Vmax_per_channel = np.array(struct.unpack('f'*n_channels, analysis_bytes[24:24+4*n_channels])).reshape(n_channels, 1)
+    # release the memory map (all data above has been copied out of it)
+    del records
 
-        # digitized sweep as 16-bit signed integers -> (channel, sample)
-        n_pts = int(n_samples * n_channels)
-        digitized_sweep = np.array(struct.unpack('h'*n_pts, data_bytes[:2*n_pts])).reshape(n_samples, n_channels).T
-        
-        # calibrated signal in physical units (channel, sample)
-        conversion_factor = Vmax_per_channel / gain_per_channel
-        calibrated_sweep = conversion_factor * digitized_sweep
+    if packed_channels:
+        from xarray_graph.utils.xarray_utils import decode_packed_data_vars
+        data = decode_packed_data_vars(data)
 
-        for j in range(n_channels):
-            data[channel_names[j]][i] = calibrated_sweep[j]
-    
     # all sweeps have the same sample interval (most likely case)
     if np.unique(data['sweep_sample_interval']).size == 1:
         return xr.DataTree(dataset=data)
@@ -142,14 +234,75 @@ def read_winwcp(filepath: str | os.PathLike) -> xr.DataTree:
         ds: xr.Dataset = data.sel(sweep=[sweep])
         ds = ds.assign_coords(
             time=xr.DataArray(
-                data=np.arange(n_samples) * ds['sweep_sample_interval'].values, 
-                dims=['time'], 
+                data=np.arange(n_samples) * ds['sweep_sample_interval'].values,
+                dims=['time'],
                 attrs=data['time'].attrs),
         )
         dt[f'Sweep{sweep}'] = ds
     return dt
 
 
+def _read_winwcp_per_sweep(filepath: str | os.PathLike) -> dict[str, np.ndarray]:
+    """Reference implementation that decodes one sweep at a time with struct.unpack.
+
+    Only used to check and benchmark read_winwcp. Returns calibrated data (sweep, sample) per channel name.
+    """
+
+    if isinstance(filepath, str):
+        filepath = Path(filepath)
+
+    with filepath.open(mode='rb') as file:
+        file_bytes = file.read()
+
+    header = read_winwcp_header(filepath)
+    n_channels = int(header['NC'])
+    n_header_bytes = (int((n_channels - 1) / 8) + 1) * 1024
+    n_sweeps = int(header['NR'])
+    record_dtype = winwcp_record_dtype(header)
+    n_analysis_bytes = record_dtype.fields['adc'][1]
+    n_data_bytes = record_dtype.itemsize - n_analysis_bytes
+    n_samples = record_dtype['adc'].shape[0]
+
+    ADCmax = int(header['ADCMAX'])
+    gain_per_channel = np.array([float(header[f'YG{i}']) for i in range(n_channels)]).reshape(n_channels, 1) * ADCmax
+
+    channel_names = [header[f'YN{i}'] for i in range(n_channels)]
+    data = {name: np.zeros((n_sweeps, n_samples)) for name in channel_names}
+    for i in range(n_sweeps):
+        n_offset_bytes = n_header_bytes + i * (n_analysis_bytes + n_data_bytes)
+        analysis_bytes = file_bytes[n_offset_bytes:n_offset_bytes+n_analysis_bytes]
+        data_bytes = file_bytes[n_offset_bytes+n_analysis_bytes:n_offset_bytes+n_analysis_bytes+n_data_bytes]
+        Vmax_per_channel = np.array(struct.unpack('f'*n_channels, analysis_bytes[24:24+4*n_channels])).reshape(n_channels, 1)
+        n_pts = int(n_samples * n_channels)
+        digitized_sweep = np.array(struct.unpack('h'*n_pts, data_bytes[:2*n_pts])).reshape(n_samples, n_channels).T
+        calibrated_sweep = (Vmax_per_channel / gain_per_channel) * digitized_sweep
+        for j in range(n_channels):
+            data[channel_names[j]][i] = calibrated_sweep[j]
+    return data
+
+
+def benchmark(filepath: str | os.PathLike = 'examples/WinWCP.wcp', repeats: int = 5) -> None:
+    """Compare the vectorized memory mapped reader against decoding one sweep at a time.
+    """
+    import time
+
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        reference = _read_winwcp_per_sweep(filepath)
+    t_per_sweep = (time.perf_counter() - t0) / repeats
+
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        dt = read_winwcp(filepath)
+    t_vectorized = (time.perf_counter() - t0) / repeats
+
+    for name, values in reference.items():
+        assert np.allclose(dt[name].values, values), f'Mismatch for channel {name}'
+
+    print(f'per sweep:  {t_per_sweep:.4f} sec')
+    print(f'vectorized: {t_vectorized:.4f} sec ({t_per_sweep / t_vectorized:.1f}x)')
+
+
 if __name__ == '__main__':
     # for testing only
 
@@ -157,6 +310,8 @@ if __name__ == '__main__':
     dt = read_winwcp(filepath)
     print(dt)
 
+    benchmark(filepath)
+
     # import matplotlib.pyplot as plt
     # for i, name in enumerate(dt.data_vars):
     #     plt.subplot(len(dt.data_vars), 1, i + 1)
@@ -0,0 +1,83 @@
+""" Record of changes to a datatree since it was loaded or last saved.
+
+Used to save only the changed data when updating an existing Zarr store (see io.save_datatree).
+
+Changes are recorded by absolute node paths:
+- nodes: The node and its entire subtree are rewritten (e.g., renamed, moved, or restructured nodes).
+- attrs: Node or variable attrs changed.
+- variables: Variable data changed within a region of integer slices per dimension (None for the entire variable).
+
+Structural changes (new or removed nodes and variables) and attrs changes are also detected at save time by comparison with the store,
+so only in-place changes to variable data must be recorded. In-place changes that are not recorded are not saved,
+so code that cannot record its changes must call markAllChanged (e.g., XarrayDataTreeViewer does so whenever code is run in the console).
+"""
+from __future__ import annotations
+
+
+class ChangeTracker:
+    """ Changed nodes, attrs, and variables (and regions within variables) of a datatree.
+    """
+
+    def __init__(self):
+        self.clear()
+        # nothing is known about a datatree until it has been loaded or saved
+        self._all_changed = True
+
+    def clear(self) -> None:
+        """ Forget all changes (e.g., after the datatree was loaded or saved).
+        """
+        self._all_changed: bool = False
+        self._nodes: set[str] = set()
+        self._attrs: set[str] = set()
+        self._variables: dict[str, dict[str, dict[str, slice] | None]] = {}
+
+    def isChanged(self) -> bool:
+        return self._all_changed or bool(self._nodes) or bool(self._attrs) or bool(self._variables)
+
+    def isAllChanged(self) -> bool:
+        return self._all_changed
+
+    def markAllChanged(self) -> None:
+        self._all_changed = True
+
+    def changedNodes(self) -> set[str]:
+        return self._nodes
+
+    def markNodeChanged(self, path: str) -> None:
+        """ Mark the node at path and its entire subtree as changed.
+        """
+        self._nodes.add(_normpath(path))
+
+    def changedAttrs(self) -> set[str]:
+        return self._attrs
+
+    def markAttrsChanged(self, path: str) -> None:
+        """ Mark the attrs of the node at path (or any of its variables) as changed.
+        """
+        self._attrs.add(_normpath(path))
+
+    def changedVariables(self, path: str) -> dict[str, dict[str, slice] | None]:
+        """ Return {variable name: changed region} for the node at path.
+        """
+        return self._variables.get(_normpath(path), {})
+
+    def markVariableChanged(self, path: str, name: str, region: dict[str, slice] | None = None) -> None:
+        """ Mark the variable name in the node at path as changed within region (None for the entire variable).
+
+        Regions are accumulated as their bounding box.
+        """
+        variables = self._variables.setdefault(_normpath(path), {})
+        if name in variables:
+            old_region = variables[name]
+            if (old_region is None) or (region is None) or (set(old_region) != set(region)):
+                region = None
+            else:
+                region = {
+                    dim: slice(min(old_region[dim].start, region[dim].start), max(old_region[dim].stop, region[dim].stop))
+                    for dim in region
+                }
+        variables[name] = region
+
+
+def _normpath(path: str) -> str:
+    return '/' + path.strip('/')
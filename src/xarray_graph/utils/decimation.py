@@ -0,0 +1,355 @@
+""" Peak preserving decimation of long (x,y) traces for display.
+
+A trace is decimated to a min/max envelope with two points (the min and max of y) per bin of consecutive samples,
+so that the envelope drawn at one bin per pixel looks the same as the full resolution trace.
+
+MinMaxPyramid precomputes the envelope at bins of 2**k samples so that any view can be decimated without touching every sample,
+and PyramidCache keeps the pyramids of recently plotted traces (optionally persisted to a Zarr store).
+"""
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+
+def minmax_envelope(x: np.ndarray, y: np.ndarray, n_bins: int, start: int = 0, stop: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """ Return the (x,y) min/max envelope of y[start:stop] in n_bins bins of consecutive samples.
+
+    Each bin contributes its min at the x of its first sample and its max at the x of its last sample.
+    NaN values are ignored (bins of all NaN are NaN, i.e., gaps are preserved).
+    If there are not more than 2 * n_bins samples, they are returned as is.
+    """
+    xenv, yenv = minmax_envelope_block(x, y[np.newaxis], n_bins, start, stop)
+    return xenv, yenv[0]
+
+
+def minmax_envelope_block(x: np.ndarray, y: np.ndarray, n_bins: int, start: int = 0, stop: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """ Same as minmax_envelope for each row of a (n_traces, n_x) array y sharing the same x.
+    """
+    if stop is None:
+        stop = y.shape[1]
+    n_samples = stop - start
+    n_bins = max(1, int(n_bins))
+    if n_samples <= 2 * n_bins:
+        return x[start:stop], y[:, start:stop]
+    n_traces = y.shape[0]
+    bin_size = -(-n_samples // n_bins)
+    n_full_bins = n_samples // bin_size
+    full_stop = start + n_full_bins * bin_size
+    ybins = y[:, start:full_stop].reshape((n_traces, n_full_bins, bin_size))
+    ymin = np.fmin.reduce(ybins, axis=2)
+    ymax = np.fmax.reduce(ybins, axis=2)
+    bin_starts = np.arange(start, full_stop, bin_size)
+    bin_ends = bin_starts + (bin_size - 1)
+    if full_stop < stop:
+        # partial last bin
+        ymin = np.append(ymin, np.fmin.reduce(y[:, full_stop:stop], axis=1)[:, np.newaxis], axis=1)
+        ymax = np.append(ymax, np.fmax.reduce(y[:, full_stop:stop], axis=1)[:, np.newaxis], axis=1)
+        bin_starts = np.append(bin_starts, full_stop)
+        bin_ends = np.append(bin_ends, stop - 1)
+    xenv = np.empty(2 * len(bin_starts), dtype=x.dtype)
+    xenv[0::2] = x[bin_starts]
+    xenv[1::2] = x[bin_ends]
+    yenv = np.empty((n_traces, 2 * len(bin_starts)), dtype=np.result_type(ymin.dtype, np.float32))
+    yenv[:, 0::2] = ymin
+    yenv[:, 1::2] = ymax
+    return xenv, yenv
+
+
+def decimate_for_view(x: np.ndarray, y: np.ndarray, xrange: tuple[float, float], n_pixels: int, pyramid: MinMaxPyramid = None) -> tuple[np.ndarray, np.ndarray]:
+    """ Return the min/max envelope of a trace (with sorted x) for a view of xrange that is n_pixels wide.
+
+    Samples within xrange are decimated to one bin per pixel.
+    Samples outside of xrange are decimated more coarsely, but still to their full min/max so that data bounds (e.g., for autoscaling) are unchanged.
+    If a pyramid of y is given, only the samples at the edges of each part are read.
+    """
+    n_samples = len(y)
+    n_pixels = max(1, int(n_pixels))
+    # include one sample on either side of xrange so the trace extends to the edges of the view
+    start = max(0, int(np.searchsorted(x, xrange[0], side='left')) - 1)
+    stop = min(n_samples, int(np.searchsorted(x, xrange[1], side='right')) + 1)
+    if stop <= start:
+        start, stop = 0, n_samples
+    xparts = []
+    yparts = []
+    for part_start, part_stop in [(0, start), (start, stop), (stop, n_samples)]:
+        if part_stop <= part_start:
+            continue
+        if (part_start, part_stop) == (start, stop):
+            n_bins = n_pixels
+        else:
+            # outside the view, at most one bin per pixel at the current zoom
+            n_bins = max(1, min(n_pixels, n_pixels * (part_stop - part_start) // max(1, stop - start)))
+        if pyramid is not None:
+            xpart, ypart = pyramid.envelope(x, y, n_bins, part_start, part_stop)
+        else:
+            xpart, ypart = minmax_envelope(x, y, n_bins, part_start, part_stop)
+        xparts.append(xpart)
+        yparts.append(ypart)
+    if len(xparts) == 1:
+        return xparts[0], yparts[0]
+    return np.concatenate(xparts), np.concatenate(yparts)
+
+
+class MinMaxPyramid:
+    """ Min and max of a 1D array in bins of 2**k consecutive samples for each level k >= min_level.
+
+    Takes about 1/2**(min_level-2) the memory of the array (i.e., 1/4 for the default min_level of 4).
+    """
+
+    def __init__(self, y: np.ndarray, min_level: int = 4):
+        self.size: int = len(y)
+        self.min_level: int = min_level
+        self.fingerprint: str = array_fingerprint(y)
+        # (min, max) per level, the last bin of each level may be partial
+        self.levels: list[tuple[np.ndarray, np.ndarray]] = []
+        bin_size = 2**min_level
+        if self.size <= bin_size:
+            return
+        n_full_bins = self.size // bin_size
+        # pairwise reduction is several times faster than reducing along the short last axis
+        ymin = ymax = y[:n_full_bins * bin_size].reshape((n_full_bins, bin_size))
+        while ymin.shape[1] > 1:
+            ymin = np.fmin(ymin[:, 0::2], ymin[:, 1::2])
+            ymax = np.fmax(ymax[:, 0::2], ymax[:, 1::2])
+        ymin = ymin[:, 0]
+        ymax = ymax[:, 0]
+        if n_full_bins * bin_size < self.size:
+            ymin = np.append(ymin, np.fmin.reduce(y[n_full_bins * bin_size:]))
+            ymax = np.append(ymax, np.fmax.reduce(y[n_full_bins * bin_size:]))
+        self.levels.append((ymin, ymax))
+        while len(ymin) > 1:
+            if len(ymin) % 2:
+                # partial last bin
+                ymin = np.append(ymin, ymin[-1])
+                ymax = np.append(ymax, ymax[-1])
+            ymin = np.fmin(ymin[0::2], ymin[1::2])
+            ymax = np.fmax(ymax[0::2], ymax[1::2])
+            self.levels.append((ymin, ymax))
+    
+    @property
+    def nbytes(self) -> int:
+        return sum(ymin.nbytes + ymax.nbytes for ymin, ymax in self.levels)
+    
+    def envelope(self, x: np.ndarray, y: np.ndarray, n_bins: int, start: int = 0, stop: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """ Same as minmax_envelope(x, y, n_bins, start, stop), but with between n_bins and 2 * n_bins bins of 2**k samples from the pyramid.
+
+        Only the samples of y in the partial bins at either edge are read.
+        """
+        if stop is None:
+            stop = self.size
+        n_samples = stop - start
+        n_bins = max(1, int(n_bins))
+        level = int(np.log2(n_samples / n_bins)) if n_samples > 2 * n_bins else 0
+        if level < self.min_level:
+            return minmax_envelope(x, y, n_bins, start, stop)
+        level = min(level, self.min_level + len(self.levels) - 1)
+        bin_size = 2**level
+        ymin, ymax = self.levels[level - self.min_level]
+        first_bin = -(-start // bin_size)
+        stop_bin = len(ymin) if stop == self.size else stop // bin_size
+        if stop_bin <= first_bin:
+            return minmax_envelope(x, y, n_bins, start, stop)
+        bin_starts = np.arange(first_bin, stop_bin) * bin_size
+        bin_ends = np.minimum(bin_starts + bin_size, self.size) - 1
+        xenv = np.empty(2 * len(bin_starts), dtype=x.dtype)
+        xenv[0::2] = x[bin_starts]
+        xenv[1::2] = x[bin_ends]
+        yenv = np.empty(2 * len(bin_starts), dtype=np.result_type(ymin.dtype, np.float32))
+        yenv[0::2] = ymin[first_bin:stop_bin]
+        yenv[1::2] = ymax[first_bin:stop_bin]
+        # partial bins at the edges
+        xparts = [xenv]
+        yparts = [yenv]
+        if start < bin_starts[0]:
+            xpart, ypart = minmax_envelope(x, y, 1, start, int(bin_starts[0]))
+            xparts.insert(0, xpart)
+            yparts.insert(0, ypart)
+        if bin_ends[-1] + 1 < stop:
+            xpart, ypart = minmax_envelope(x, y, 1, int(bin_ends[-1]) + 1, stop)
+            xparts.append(xpart)
+            yparts.append(ypart)
+        if len(xparts) == 1:
+            return xenv, yenv
+        return np.concatenate(xparts), np.concatenate(yparts)
+
+
+def array_fingerprint(y: np.ndarray, n_samples: int = 4096) -> str:
+    """ Cheap fingerprint of an array from its size, dtype and at most n_samples evenly spaced values.
+
+    Detects most, but not all, changes to the array (e.g., not changes to a few samples between those in the fingerprint).
+    """
+    import hashlib
+    stride = max(1, len(y) // n_samples)
+    h = hashlib.blake2b(digest_size=8)
+    h.update(f'{len(y)} {y.dtype.str}'.encode())
+    h.update(np.ascontiguousarray(y[::stride]).tobytes())
+    return h.hexdigest()
+
+
+class PyramidCache:
+    """ Least recently used cache of MinMaxPyramids with at most max_bytes in memory.
+
+    Keys are tuples whose first item is the path of the datatree node the pyramid was computed from (see invalidate).
+    If store_path is given, pyramids are also written to and read from a Zarr store at store_path.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2**20, store_path: str | os.PathLike = None):
+        self.max_bytes: int = max_bytes
+        self.store_path: Path | None = None if store_path is None else Path(store_path)
+        self._pyramids: OrderedDict[tuple, MinMaxPyramid] = OrderedDict()
+        self._nbytes: int = 0
+    
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+    
+    def __len__(self) -> int:
+        return len(self._pyramids)
+    
+    def get(self, key: tuple, y: np.ndarray) -> MinMaxPyramid | None:
+        """ Return the cached pyramid for key if it is a pyramid of y, otherwise None.
+        """
+        pyramid = self._pyramids.get(key, None)
+        if pyramid is None and self.store_path is not None:
+            pyramid = self._read(key)
+            if pyramid is not None:
+                self._insert(key, pyramid)
+        if pyramid is None:
+            return None
+        if (pyramid.size != len(y)) or (pyramid.fingerprint != array_fingerprint(y)):
+            self._discard(key)
+            return None
+        self._pyramids.move_to_end(key)
+        return pyramid
+    
+    def put(self, key: tuple, pyramid: MinMaxPyramid) -> None:
+        if self._pyramids.get(key, None) is pyramid:
+            self._pyramids.move_to_end(key)
+            return
+        self._discard(key)
+        self._insert(key, pyramid)
+        if self.store_path is not None:
+            self._write(key, pyramid)
+    
+    def invalidate(self, path: str = '/') -> None:
+        """ Remove pyramids for the datatree node at path and all of its descendants (i.e., after the node's data was edited).
+        """
+        path = '/' + path.strip('/')
+        def is_invalid(key: tuple) -> bool:
+            node_path = '/' + str(key[0]).strip('/')
+            return (path == '/') or (node_path == path) or node_path.startswith(path + '/')
+        for key in [key for key in self._pyramids if is_invalid(key)]:
+            self._discard(key)
+        if (self.store_path is not None) and self.store_path.is_dir():
+            for entry_path in self.store_path.iterdir():
+                key = self._read_key(entry_path)
+                if (key is not None) and is_invalid(key):
+                    self._remove_entry(entry_path)
+    
+    def clear(self) -> None:
+        """ Remove all pyramids from memory (but not from the store, whose entries are validated when read).
+        """
+        self._pyramids.clear()
+        self._nbytes = 0
+    
+    def _insert(self, key: tuple, pyramid: MinMaxPyramid) -> None:
+        self._pyramids[key] = pyramid
+        self._nbytes += pyramid.nbytes
+        # evict least recently used
+        while (self._nbytes > self.max_bytes) and (len(self._pyramids) > 1):
+            _, evicted = self._pyramids.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+    
+    def _discard(self, key: tuple) -> None:
+        pyramid = self._pyramids.pop(key, None)
+        if pyramid is not None:
+            self._nbytes -= pyramid.nbytes
+    
+    @staticmethod
+    def _entry_name(key: tuple) -> str:
+        import hashlib, json
+        return hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()
+    
+    def _write(self, key: tuple, pyramid: MinMaxPyramid) -> None:
+        import json
+        import zarr
+        try:
+            root = zarr.open_group(self.store_path, mode='a')
+            name = self._entry_name(key)
+            if name in root:
+                del root[name]
+            group = root.create_group(name)
+            group.attrs.update({
+                'key': json.dumps(key, default=str),
+                'size': pyramid.size,
+                'min_level': pyramid.min_level,
+                'fingerprint': pyramid.fingerprint,
+            })
+            for i, (ymin, ymax) in enumerate(pyramid.levels):
+                group.create_array(f'min{i}', data=ymin)
+                group.create_array(f'max{i}', data=ymax)
+        except Exception:
+            # persistence is optional
+            pass
+    
+    def _read(self, key: tuple) -> MinMaxPyramid | None:
+        import zarr
+        try:
+            group = zarr.open_group(self.store_path / self._entry_name(key), mode='r')
+            attrs = group.attrs
+            pyramid = MinMaxPyramid.__new__(MinMaxPyramid)
+            pyramid.size = attrs['size']
+            pyramid.min_level = attrs['min_level']
+            pyramid.fingerprint = attrs['fingerprint']
+            n_levels = len([name for name in group.array_keys() if name.startswith('min')])
+            pyramid.levels = [(group[f'min{i}'][...], group[f'max{i}'][...]) for i in range(n_levels)]
+            return pyramid
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _read_key(entry_path: Path) -> tuple | None:
+        import json
+        try:
+            with open(entry_path / 'zarr.json') as f:
+                return tuple(json.loads(json.load(f)['attributes']['key']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    
+    @staticmethod
+    def _remove_entry(entry_path: Path) -> None:
+        import shutil
+        shutil.rmtree(entry_path, ignore_errors=True)
+
+
+def pyramid_store_path(filepath: str | os.PathLike) -> Path:
+    """ Hidden Zarr store next to filepath (e.g., data.zarr -> .data.zarr.pyramids) for persisting its pyramids.
+    """
+    filepath = Path(filepath)
+    return filepath.parent / f'.{filepath.name}.pyramids'
+
+
+def benchmark(n_samples: int = 30_000_000, n_pixels: int = 2000, repeats: int = 3) -> None:
+    """ Time decimating a 10 min trace at 50 kHz.
+    """
+    import time
+    x = np.arange(n_samples) / 50e3
+    y = np.random.default_rng(0).standard_normal(n_samples).astype(np.float32)
+    t0 = time.perf_counter()
+    pyramid = MinMaxPyramid(y)
+    print(f'build pyramid ({pyramid.nbytes / 1e6:.0f} MB): {(time.perf_counter() - t0) * 1e3:.1f} ms')
+    for xrange in [(x[0], x[-1]), (x[n_samples // 2], x[n_samples // 2] + 1)]:
+        for label, pyramid_ in [('scan', None), ('pyramid', pyramid)]:
+            t = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                xenv, yenv = decimate_for_view(x, y, xrange, n_pixels, pyramid_)
+                t.append(time.perf_counter() - t0)
+            print(f'{n_samples} -> {len(yenv)} samples for view of {xrange[1] - xrange[0]:.0f} sec ({label}): {min(t) * 1e3:.2f} ms')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -112,6 +112,101 @@ def value_to_str(value, in_array: bool = False) -> str:
     return str(value)
 
 
+ATTR_CODEC_VERSION = 1
+ATTR_CODEC_PREFIX = 'xg-attr:'
+_ATTR_CODEC_TAG = '__xg__'
+_JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def encode_attr_value(value) -> str:
+    """ Encode a value as a versioned, tagged JSON string that decode_attr_value converts back to the same value.
+
+    Unlike value_to_str, types are kept exactly, including tuples, sets, dicts with non-str keys,
+    numpy scalars, and numpy arrays (dtype and shape, data stored as base64 encoded bytes).
+    """
+    import json
+    return f'{ATTR_CODEC_PREFIX}{ATTR_CODEC_VERSION}:' + json.dumps(_to_json(value), separators=(',', ':'))
+
+
+def decode_attr_value(text: str) -> bool | int | float | str | tuple | list | dict | set | np.ndarray:
+    """ Decode a string from encode_attr_value. Strings without the codec prefix are decoded with the legacy str_to_value.
+    """
+    if not text.startswith(ATTR_CODEC_PREFIX):
+        return str_to_value(text)
+    import json
+    version, _, payload = text[len(ATTR_CODEC_PREFIX):].partition(':')
+    if int(version) > ATTR_CODEC_VERSION:
+        raise ValueError(f'Unsupported attr codec version {version} (expected <= {ATTR_CODEC_VERSION}).')
+    return json.loads(payload, object_hook=_from_json)
+
+
+def _to_json(value):
+    """ Convert value to JSON compatible objects with tags for any types JSON does not keep.
+    """
+    # fast paths for the most common exact types
+    value_type = type(value)
+    if value_type in _JSON_SCALAR_TYPES:
+        return value
+    if value_type is list:
+        return [val if type(val) in _JSON_SCALAR_TYPES else _to_json(val) for val in value]
+    if value_type is dict and _ATTR_CODEC_TAG not in value and all(type(key) is str for key in value):
+        return {key: val if type(val) in _JSON_SCALAR_TYPES else _to_json(val) for key, val in value.items()}
+    if isinstance(value, (np.ndarray, np.generic)):
+        array = np.asarray(value)
+        tag = 'ndarray' if isinstance(value, np.ndarray) else 'scalar'
+        if array.dtype.hasobject:
+            return {_ATTR_CODEC_TAG: tag, 'dtype': 'object', 'shape': array.shape, 'items': [_to_json(val) for val in array.ravel().tolist()]}
+        import base64
+        return {_ATTR_CODEC_TAG: tag, 'dtype': array.dtype.str, 'shape': array.shape, 'data': base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_to_json(val) for val in value]
+    if isinstance(value, dict):
+        if all(type(key) is str for key in value) and _ATTR_CODEC_TAG not in value:
+            return {key: _to_json(val) for key, val in value.items()}
+        return {_ATTR_CODEC_TAG: 'dict', 'items': [[_to_json(key), _to_json(val)] for key, val in value.items()]}
+    if isinstance(value, tuple):
+        return {_ATTR_CODEC_TAG: 'tuple', 'items': [_to_json(val) for val in value]}
+    if isinstance(value, set):
+        return {_ATTR_CODEC_TAG: 'set', 'items': [_to_json(val) for val in value]}
+    if isinstance(value, frozenset):
+        return {_ATTR_CODEC_TAG: 'frozenset', 'items': [_to_json(val) for val in value]}
+    if isinstance(value, complex):
+        return {_ATTR_CODEC_TAG: 'complex', 'items': [value.real, value.imag]}
+    # anything else is stored as its string representation
+    return str(value)
+
+
+def _from_json(obj: dict):
+    """ Object hook for json.loads that converts tagged objects back to their original types.
+    """
+    tag = obj.get(_ATTR_CODEC_TAG, None)
+    if tag is None:
+        return obj
+    if tag == 'tuple':
+        return tuple(obj['items'])
+    if tag == 'set':
+        return set(obj['items'])
+    if tag == 'frozenset':
+        return frozenset(obj['items'])
+    if tag == 'dict':
+        return {key: val for key, val in obj['items']}
+    if tag == 'complex':
+        return complex(*obj['items'])
+    if tag in ('ndarray', 'scalar'):
+        shape = tuple(obj['shape'])
+        if obj['dtype'] == 'object':
+            array = np.empty(len(obj['items']), dtype=object)
+            array[:] = obj['items']
+            array = array.reshape(shape)
+        else:
+            import base64
+            array = np.frombuffer(base64.b64decode(obj['data']), dtype=np.dtype(obj['dtype'])).reshape(shape).copy()
+        return array[()] if tag == 'scalar' else array
+    raise ValueError(f'Unknown attr codec tag {tag}.')
+
+
 def split_text(text: str) -> list[str]:
     parts: list[str] = ['']
     grouping: str = ''
@@ -171,6 +266,57 @@ def test():
     # print(values_back[7]['c'].dtype)
     # print(type(values_back[7]['e']))
 
+    # attr codec keeps types exactly
+    print('-'*82)
+    for value in test_values:
+        text = encode_attr_value(value)
+        value_back = decode_attr_value(text)
+        print(f'{value} <{type(value).__name__}> -> "{text}" -> {value_back} <{type(value_back).__name__}>')
+        assert _values_equal(value, value_back)
+
+
+def _values_equal(value, other) -> bool:
+    """ Return True if two values (possibly nested containers of numpy arrays) have the same types and values.
+    """
+    if type(value) is not type(other):
+        return False
+    if isinstance(value, np.ndarray):
+        return (value.dtype == other.dtype) and np.array_equal(value, other)
+    if isinstance(value, (list, tuple)):
+        return (len(value) == len(other)) and all(_values_equal(val, oth) for val, oth in zip(value, other))
+    if isinstance(value, dict):
+        return (list(value) == list(other)) and all(_values_equal(val, other[key]) for key, val in value.items())
+    return value == other
+
+
+def benchmark(n_rois: int = 5000, n_header_entries: int = 200, array_size: int = 10000, repeats: int = 3):
+    """ Round-trip and throughput of the attr codec vs. the legacy value_to_str/str_to_value.
+
+    Values are a list of ROI dicts, a file header dict, and a curve fit with numpy array coefficients.
+    """
+    import time
+    rng = np.random.default_rng(0)
+    rois = [{'type': 'region', 'position': {'time': [float(t), float(t) + 0.5]}, 'movable': False, 'text': f'event {i}'} for i, t in enumerate(rng.random(n_rois) * 1000)]
+    header = {f'KEY{i}': str(i) if i % 2 else f'value {i}' for i in range(n_header_entries)}
+    fit = {'type': 'spline', 'coef': rng.random(array_size), 'knots': np.arange(array_size, dtype=np.float32), 'degree': 3}
+    values = {'rois': rois, 'header': header, 'fit': fit}
+
+    print(f'{"value":<8} {"codec":<7} {"size (kB)":>10} {"encode (MB/s)":>14} {"decode (MB/s)":>14}  round-trip')
+    for name, value in values.items():
+        for codec, encode, decode in [('legacy', value_to_str, str_to_value), ('tagged', encode_attr_value, decode_attr_value)]:
+            text = encode(value)
+            size_mb = len(text) / 1e6
+            encode_time = decode_time = float('inf')
+            for _ in range(repeats):
+                tic = time.perf_counter()
+                text = encode(value)
+                encode_time = min(encode_time, time.perf_counter() - tic)
+                tic = time.perf_counter()
+                value_back = decode(text)
+                decode_time = min(decode_time, time.perf_counter() - tic)
+            print(f'{name:<8} {codec:<7} {size_mb * 1e3:>10.1f} {size_mb / encode_time:>14.2f} {size_mb / decode_time:>14.2f}  {"exact" if _values_equal(value, value_back) else "lossy"}')
+
 
 if __name__ == '__main__':
     test()
+    benchmark()
@@ -2,12 +2,26 @@
 """
 
 from collections.abc import Iterator
-from xarray import DataArray, Dataset, DataTree
+from contextlib import contextmanager
+from xarray import DataArray, Dataset, DataTree, Variable
 from pint import UnitRegistry
 
 
 ORDERED_DATA_VARS_KEY = '_XG_ORDERED_DATA_VARS'
 INHERITED_DATA_VARS_KEY = '_XG_INHERITED_DATA_VARS'
+ATTRS_CODEC_KEY = '_XG_ATTRS_CODEC'
+
+# XarrayGraph annotations (regions of interest, masked samples and notes)
+ROI_KEY = '_XG_ROI'
+MASK_KEY = '_XG_MASK'
+NOTES_KEY = '_XG_NOTES'
+
+# attr types that are stored as strings for serialization to HDF5
+ATTRS_OBJECT_TYPES = (list, tuple, dict, set)
+
+# large array attrs are stored in hidden data_vars named with this prefix for serialization
+# and referenced in the attrs by {ARRAY_ATTR_KEY: data_var_name}
+ARRAY_ATTR_KEY = '_XG_ARRAY_ATTR'
 
 
 def ordered_dims_iter(objects: list[DataTree | Dataset | DataArray]) -> Iterator[str]:
@@ -135,6 +149,120 @@ def to_base_units(data: DataArray | Dataset | DataTree, ureg: UnitRegistry) -> D
         return dt
 
 
+def decode_packed_data_vars(ds: Dataset) -> Dataset:
+    """ Lazily decode packed integer data_vars that have CF scale_factor/add_offset attrs.
+
+    Only the packed integers are held in memory, decoded values are computed on access.
+    The packing is kept in each variable's encoding, so the data is written back out as packed integers (e.g., to Zarr or NetCDF),
+    which means edited values are rounded to the packed resolution on save.
+    In-place edits of a decoded variable load it into memory first (copy-on-write).
+    """
+    from xarray import decode_cf
+    from xarray.core import indexing
+    ds = decode_cf(ds, concat_characters=False, decode_times=False, decode_coords=False, decode_timedelta=False)
+    for var in ds.data_vars.values():
+        if 'scale_factor' in var.encoding or 'add_offset' in var.encoding:
+            var.variable._data = indexing.MemoryCachedArray(indexing.CopyOnWriteArray(var.variable._data))
+    return ds
+
+
+def lazily_scaled(data_array: DataArray, factor: float) -> DataArray:
+    """ Return a shallow copy of data_array whose values are multiplied by factor only when (and where) they are accessed.
+
+    e.g., only the plotted slices of a large array are scaled.
+    In-place edits of the copy load its entire scaled array into memory first (copy-on-write) and do not affect data_array.
+    """
+    import numpy as np
+    from xarray.core import indexing
+    from xarray.coding.variables import lazy_elemwise_func
+    if data_array.chunks is not None:
+        # dask arrays are already lazy
+        return data_array.copy(deep=False, data=data_array.data * factor)
+    scaled = data_array.copy(deep=False)
+    data = indexing.LazilyIndexedArray(scaled.variable._data)
+    data = lazy_elemwise_func(data, lambda values: values * factor, np.result_type(data_array.dtype, factor))
+    scaled.variable._data = indexing.MemoryCachedArray(indexing.CopyOnWriteArray(data))
+    return scaled
+
+def label_region(data_var: DataArray, coords: dict) -> dict[str, slice] | None:
+    """ Return the bounding box of integer slices per dimension for a .loc/.sel style selection of coords in data_var.
+
+    Dimensions that are not in coords span their full size.
+    Returns None if the selection cannot be resolved (i.e., the entire data_var should be considered selected).
+    """
+    import numpy as np
+    region = {}
+    try:
+        for dim, size in data_var.sizes.items():
+            if dim not in coords:
+                region[dim] = slice(0, size)
+                continue
+            labels = coords[dim]
+            index = data_var.indexes.get(dim, None)
+            if isinstance(labels, slice):
+                indexer = index.slice_indexer(labels.start, labels.stop) if index is not None else labels
+                start, stop, _ = indexer.indices(size)
+            else:
+                labels = np.atleast_1d(getattr(labels, 'values', labels))
+                positions = index.get_indexer(labels) if index is not None else labels.astype(int)
+                if len(positions) == 0:
+                    # nothing selected
+                    return {dim: slice(0, 0) for dim in data_var.dims}
+                if np.any(positions < 0):
+                    return None
+                start, stop = int(positions.min()), int(positions.max()) + 1
+            region[dim] = slice(start, stop)
+    except Exception:
+        return None
+    return region
+
+
+def trace_block(data_var: DataArray, xdim: str, coords: list[dict]):
+    """ Return the 1D traces along xdim of data_var at each of coords as a contiguous (n_traces, n_x) numpy array,
+    and the index into coords of each trace.
+
+    All traces are extracted in a single vectorized isel rather than one .sel per trace.
+    Coords for data_var dims are located by label (or position for dims without an index) and coords without a match have no trace.
+    Coords for scalar non-index coords of data_var select traces only where they are equal, and all other coords are ignored.
+    Dims of data_var other than xdim that are not in coords must have size 1.
+    """
+    import numpy as np
+    if not coords:
+        coords = [{}]
+    n_coords = len(coords)
+    found = np.full(n_coords, True)
+    for name, coord in data_var.coords.items():
+        if (name not in data_var.dims) and (coord.ndim == 0):
+            value = coord.values
+            for i, coord_ in enumerate(coords):
+                if (name in coord_) and not (coord_[name] == value):
+                    found[i] = False
+    positions = {}
+    for dim, size in data_var.sizes.items():
+        if dim == xdim:
+            continue
+        if any(dim not in coord_ for coord_ in coords):
+            if size != 1:
+                raise ValueError(f'Dimension "{dim}" of "{data_var.name}" is not in coords.')
+            positions[dim] = np.zeros(n_coords, dtype=int)
+            continue
+        labels = np.array([coord_[dim] for coord_ in coords])
+        index = data_var.indexes.get(dim, None)
+        if index is not None:
+            positions[dim] = index.get_indexer(labels)
+        else:
+            positions[dim] = labels.astype(int)
+            positions[dim][(positions[dim] < 0) | (positions[dim] >= size)] = -1
+        found &= positions[dim] >= 0
+    trace_indices = np.flatnonzero(found)
+    var: Variable = data_var.variable
+    if positions:
+        var = var.isel({dim: Variable(['__trace__'], pos[trace_indices]) for dim, pos in positions.items()})
+    else:
+        var = var.expand_dims('__trace__').isel(__trace__=[0] * len(trace_indices))
+    block = np.ascontiguousarray(var.transpose('__trace__', xdim).values)
+    return block, trace_indices
+
 def aligned_root(node: DataTree) -> DataTree:
     """ Return the most distant ancestor aligned with node.
 
@@ -189,12 +317,139 @@ def inherit_missing_data_vars(dt: DataTree) -> DataTree:
                 to_inherit[name] = var
         if to_inherit:
             node.dataset = node.to_dataset().assign(to_inherit)
+            _share_inherited_data(node, list(to_inherit))
     return dt
 
 
-def remove_inherited_data_vars(dt: DataTree) -> DataTree:
+def shares_data(var: Variable, other: Variable, compare_attrs: bool = True) -> bool:
+    """ Return True if two variables are references to the same data (and have the same dims and attrs unless compare_attrs is False).
+
+    Same data means the same numpy buffer (same memory, shape, strides, dtype), the same backend array
+    (lazily indexed in the same way), or the same dask graph. Array values are never compared or loaded.
+    """
+    if var is other:
+        return True
+    from xarray.core import indexing
+    from xarray.core.utils import dict_equiv
+    if (var.dims != other.dims) or (var.shape != other.shape) or (var.dtype != other.dtype) or (compare_attrs and not dict_equiv(var.attrs, other.attrs)):
+        return False
+    import numpy as np
+    data, other_data = _unwrapped_data(var), _unwrapped_data(other)
+    if data is other_data:
+        return True
+    if isinstance(data, np.ndarray) and isinstance(other_data, np.ndarray):
+        return (data.__array_interface__['data'][0] == other_data.__array_interface__['data'][0]) and (data.strides == other_data.strides)
+    if isinstance(data, indexing.LazilyIndexedArray) and isinstance(other_data, indexing.LazilyIndexedArray):
+        return (data.array is other_data.array) and _indexer_keys_equal(data.key.tuple, other_data.key.tuple)
+    name = getattr(data, 'name', None)
+    if (name is not None) and type(data).__module__.startswith('dask') and (type(data) is type(other_data)):
+        return name == other_data.name
+    return False
+
+
+def inherited_root(node: DataTree, name: str) -> DataTree:
+    """ Return the most distant ancestor whose data_var name shares its data with the node's data_var (see shares_data), or node if there is none.
+
+    i.e., the node the data_var is inherited from, so in-place edits of the node's data_var also change it in that ancestor's subtree.
+    Attrs are not compared, as they can be edited separately without copying the data.
+    """
+    root = node
+    while (root.parent is not None) and (name in root.parent.data_vars) and shares_data(root.parent.data_vars[name].variable, root.data_vars[name].variable, compare_attrs=False):
+        root = root.parent
+    return root
+
+
+def _unwrapped_data(var: Variable):
+    """ Return a variable's data without any of xarray's wrappers that are recreated on copy but do not change the underlying data.
+    """
+    from xarray.core import indexing
+    data = var._data
+    while isinstance(data, (indexing.MemoryCachedArray, indexing.CopyOnWriteArray, indexing.NumpyIndexingAdapter)):
+        data = data.array
+    return data
+
+
+def _indexer_keys_equal(key: tuple, other_key: tuple) -> bool:
+    """ Return True if two indexer key tuples (ints, slices or integer arrays) index the same elements.
+    """
+    import numpy as np
+    if len(key) != len(other_key):
+        return False
+    for k, other_k in zip(key, other_key):
+        if isinstance(k, np.ndarray) or isinstance(other_k, np.ndarray):
+            if not (isinstance(k, np.ndarray) and isinstance(other_k, np.ndarray) and np.array_equal(k, other_k)):
+                return False
+        elif k != other_k:
+            return False
+    return True
+
+
+def _share_inherited_data(node: DataTree, names: list[str]) -> None:
+    """ Point a node's inherited data_vars at the same data as the parent's data_vars.
+
+    Shallow copies of variables get their own in-memory cache of lazily loaded data,
+    so without this the parent and node would each load (and later save) their own copy.
+    """
+    variables = node.to_dataset(inherit=False).variables
+    parent_variables = node.parent.to_dataset(inherit=False).variables
+    for name in names:
+        variables[name]._data = parent_variables[name]._data
+
+
+@contextmanager
+def copy_on_write_snapshot(dt: DataTree) -> Iterator[DataTree]:
+    """ Context manager that yields a shallow copy of dt whose data and attrs are not affected by in-place edits to dt within the context.
+
+    e.g., for saving a datatree in the background while it may be edited.
+    In-memory data of dt is wrapped so that the first in-place edit of a variable copies its data (the snapshot keeps the original),
+    and attrs are copied. The data is unwrapped again on exit (keeping any copies made by edits).
+    """
+    import copy
+    import numpy as np
+    from xarray.core import indexing
+    snapshot = dt.copy(deep=False)
+    for node in snapshot.subtree:
+        node.attrs = copy.deepcopy(node.attrs)
+        for var in node.to_dataset(inherit=False).variables.values():
+            var.attrs = copy.deepcopy(var.attrs)
+    wrapped: list[tuple[Variable, object, indexing.CopyOnWriteArray]] = []
+    for node in dt.subtree:
+        # shares variables with the node
+        for var in node.to_dataset(inherit=False).variables.values():
+            data = var._data
+            if isinstance(data, np.ndarray) or (isinstance(data, indexing.ExplicitlyIndexed) and not isinstance(data, (indexing.PandasIndexingAdapter, indexing.CopyOnWriteArray))):
+                cow = indexing.CopyOnWriteArray(data)
+                var._data = cow
+                wrapped.append((var, data, cow))
+    try:
+        yield snapshot
+    finally:
+        for var, data, cow in wrapped:
+            if var._data is cow:
+                var._data = np.asarray(cow.array) if cow._copied else data
+
+
+def _inherited_data_var_names(ds: Dataset, parent_ds: Dataset, compare_values: bool = False) -> list[str]:
+    """ Return the names of data_vars in a node's dataset that are references to data_vars in the parent node's dataset.
+
+    By default inherited data_vars must share their data with the parent (see shares_data).
+    If compare_values is True, data_vars that are identical to the parent's are also considered inherited (slow for large arrays).
+    """
+    parent_variables = parent_ds.variables
+    inherited = []
+    for name in ds.data_vars:
+        if name not in parent_ds.data_vars:
+            continue
+        var, parent_var = ds.variables[name], parent_variables[name]
+        if shares_data(var, parent_var) or (compare_values and var.identical(parent_var)):
+            inherited.append(name)
+    return inherited
+
+
+def remove_inherited_data_vars(dt: DataTree, compare_values: bool = False) -> DataTree:
     """ Remove any data_vars in each tree node that are references to data_vars in the parent node.
 
+    If compare_values is True, data_vars identical to the parent's data_vars are also removed (see _inherited_data_var_names).
     Returns a new datatree without any inherited data_vars.
     """
     dt = dt.copy(deep=False)
@@ -204,19 +459,17 @@ def remove_inherited_data_vars(dt: DataTree) -> DataTree:
         parent: DataTree = node.parent
         if not parent:
             continue
-        to_remove = []
-        for name, var in node.data_vars.items():
-            if (name in parent.data_vars) and var.identical(parent.data_vars[name]):
-                to_remove.append(name)
+        to_remove = _inherited_data_var_names(node.to_dataset(inherit=False), parent.to_dataset(inherit=False), compare_values)
         if to_remove:
             node.dataset = node.to_dataset().drop_vars(to_remove)
     return dt
 
 
-def store_inherited_data_vars(dt: DataTree) -> DataTree:
+def store_inherited_data_vars(dt: DataTree, compare_values: bool = False) -> DataTree:
     """ For all tree nodes, store the names of data_vars inherited from the parent node in the node attrs.
 
     Inherited means the underlying data is a reference to the date in the parent node.
+    If compare_values is True, data_vars identical to the parent's data_vars are also stored as inherited (see _inherited_data_var_names).
     Returns a new datatree with inherited data_vars defined in the node attrs.
     """
     dt = dt.copy(deep=False)
@@ -225,10 +478,7 @@ def store_inherited_data_vars(dt: DataTree) -> DataTree:
         parent: DataTree = node.parent
         if not parent:
             continue
-        inherited = []
-        for name, var in node.data_vars.items():
-            if (name in parent.data_vars) and var.identical(parent.data_vars[name]):
-                inherited.append(name)
+        inherited = _inherited_data_var_names(node.to_dataset(inherit=False), parent.to_dataset(inherit=False), compare_values)
         if inherited:
             node.attrs[INHERITED_DATA_VARS_KEY] = ', '.join(inherited)
         elif INHERITED_DATA_VARS_KEY in node.attrs:
@@ -254,6 +504,7 @@ def restore_inherited_data_vars(dt: DataTree) -> DataTree:
         to_inherit = {name: parent.data_vars[name] for name in inherited if name in parent.data_vars and name not in node.data_vars}
         if to_inherit:
             node.dataset = node.to_dataset().assign(to_inherit)
+            _share_inherited_data(node, list(to_inherit))
     return dt
 
 
@@ -300,61 +551,266 @@ def restore_ordered_data_vars(dt: DataTree) -> DataTree:
 
 
 def store_attrs_objects_as_strings(dt: DataTree) -> DataTree:
-    """ Serialize any list, tuple, or dict attr objects into strings.
+    """ Serialize any list, tuple, dict, or set attr objects into strings (see utils.encode_attr_value).
 
     e.g., for serialization to HDF5.
+    The codec version is stored in the root node attrs.
     """
-    from xarray_graph.utils.utils import value_to_str
+    from xarray_graph.utils.utils import encode_attr_value, ATTR_CODEC_VERSION
     dt = dt.copy(deep=False)
     node: DataTree
     for node in dt.subtree:
         for key, value in node.attrs.items():
-            if isinstance(value, (list, tuple, dict)):
-                node.attrs[key] = value_to_str(value)
+            if isinstance(value, ATTRS_OBJECT_TYPES):
+                node.attrs[key] = encode_attr_value(value)
         for var in node.variables.values():
             for key, value in var.attrs.items():
-                if isinstance(value, (list, tuple, dict)):
-                    var.attrs[key] = value_to_str(value)
+                if isinstance(value, ATTRS_OBJECT_TYPES):
+                    var.attrs[key] = encode_attr_value(value)
+    dt.attrs[ATTRS_CODEC_KEY] = ATTR_CODEC_VERSION
     return dt
 
 
 def restore_attrs_objects_from_strings(dt: DataTree) -> DataTree:
-    """ Deserialize any list, tuple, or dict attr objects from strings.
+    """ Deserialize any list, tuple, dict, or set attr objects from strings.
 
     e.g., for deserialization from HDF5.
+    Trees without a codec version in the root node attrs are in the legacy format from utils.value_to_str,
+    for which all string attrs are converted with utils.str_to_value.
     """
-    from xarray_graph.utils.utils import str_to_value
     dt = dt.copy(deep=False)
+    decode = _attrs_decoder(dt.attrs.pop(ATTRS_CODEC_KEY, None))
     node: DataTree
     for node in dt.subtree:
         for key, value in node.attrs.items():
             if isinstance(value, str):
-                node.attrs[key] = str_to_value(value)
+                node.attrs[key] = decode(value)
         for var in node.variables.values():
             for key, value in var.attrs.items():
                 if isinstance(value, str):
-                    var.attrs[key] = str_to_value(value)
+                    var.attrs[key] = decode(value)
     return dt
 
 
-def prepare_for_serialization(dt: DataTree, flatten_attrs: bool = False) -> DataTree:
+def _attrs_decoder(codec_version: int | None):
+    """ Return a function that decodes string attrs stored with the given codec version (None for the legacy format).
+    """
+    from xarray_graph.utils.utils import decode_attr_value, str_to_value, ATTR_CODEC_PREFIX
+    if codec_version is None:
+        return str_to_value
+    # only strings written by the codec are decoded, any other strings are left as is
+    return lambda text: decode_attr_value(text) if text.startswith(ATTR_CODEC_PREFIX) else text
+
+
+def _store_array_attrs(ds: Dataset, min_size: int, name_prefix: str = ARRAY_ATTR_KEY) -> Dataset:
+    """ Move numeric array attrs (also those nested in attr containers) with at least min_size elements into hidden data_vars.
+
+    The arrays in the attrs are replaced by {ARRAY_ATTR_KEY: data_var_name}.
+    The hidden data_vars and their dims are named {name_prefix}_{i}, which must start with ARRAY_ATTR_KEY
+    and be unique within a tree (dims must align across nodes).
+    Returns a new dataset if any arrays were moved, otherwise ds (which is never modified).
+    """
+    import numpy as np
+    companions: dict[str, Variable] = {}
+
+    def store(value):
+        if isinstance(value, np.ndarray):
+            if (value.size >= min_size) and (value.dtype.kind in 'biuf'):
+                name = f'{name_prefix}_{len(companions)}'
+                companions[name] = Variable([f'{name}_dim_{i}' for i in range(value.ndim)], value)
+                return {ARRAY_ATTR_KEY: name}
+            return value
+        if isinstance(value, dict):
+            return {key: store(val) for key, val in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(store(val) for val in value)
+        return value
+
+    attrs = store(ds.attrs)
+    var_attrs = {}
+    for name, var in ds.variables.items():
+        n_companions = len(companions)
+        new_attrs = store(var.attrs)
+        if len(companions) > n_companions:
+            var_attrs[name] = new_attrs
+    if not companions:
+        return ds
+    # copy variables before changing their attrs as they are shared with the input tree
+    ds = ds.copy(deep=False)
+    ds.attrs = attrs
+    for name, new_attrs in var_attrs.items():
+        ds.variables[name].attrs = new_attrs
+    return ds.assign(companions)
+
+
+def _restore_array_attrs(ds: Dataset) -> Dataset:
+    """ Move arrays in hidden data_vars from _store_array_attrs back into the attrs.
+
+    Returns a new dataset if any arrays were restored, otherwise ds (which is never modified).
+    """
+    names = [name for name in ds.data_vars if name.startswith(ARRAY_ATTR_KEY)]
+    if not names:
+        return ds
+    arrays = {name: ds.variables[name].values for name in names}
+
+    def restore(value):
+        if isinstance(value, dict):
+            if (len(value) == 1) and (value.get(ARRAY_ATTR_KEY, None) in arrays):
+                return arrays[value[ARRAY_ATTR_KEY]]
+            return {key: restore(val) for key, val in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(restore(val) for val in value)
+        return value
+
+    # copy variables before changing their attrs as they are shared with the input tree
+    ds = ds.drop_vars(names).copy(deep=False)
+    ds.attrs = restore(ds.attrs)
+    for var in ds.variables.values():
+        if var.attrs:
+            var.attrs = restore(var.attrs)
+    return ds
+
+
+def _subtree_datasets(dt: DataTree) -> dict[str, Dataset]:
+    """ Return each node's own dataset (without inherited coords) keyed by its path relative to dt (parents before children).
+
+    The datasets have their own attrs, but share variables with the nodes.
+    """
+    root_path = dt.path
+    datasets = {}
+    node: DataTree
+    for node in dt.subtree:
+        path = node.path[len(root_path):].strip('/')
+        datasets[path or '/'] = node.to_dataset(inherit=False)
+    return datasets
+
+
+def _parent_path(path: str) -> str | None:
+    """ Return the parent of a path relative to the subtree root ('/'), or None for the root.
+    """
+    if path == '/':
+        return None
+    return path.rpartition('/')[0] or '/'
+
+
+def prepare_for_serialization(dt: DataTree, flatten_attrs: bool = False, compare_values: bool = False, array_attrs_min_size: int | None = None) -> DataTree:
     """ Returns a new datatree ready for serialization.
+
+    Equivalent to store_ordered_data_vars, store_inherited_data_vars, remove_inherited_data_vars
+    (and store_attrs_objects_as_strings if flatten_attrs), but computes ordering and inheritance
+    together in a single traversal and builds the new tree from the resulting datasets at once.
+    Inherited data_vars are detected by reference unless compare_values is True (see _inherited_data_var_names).
+    If array_attrs_min_size is not None, numeric array attrs with at least that many elements
+    are stored in hidden data_vars instead of the attrs (see _store_array_attrs).
     """
-    dt = store_ordered_data_vars(dt)
-    dt = store_inherited_data_vars(dt)
-    dt = remove_inherited_data_vars(dt)
     if flatten_attrs:
-        dt = store_attrs_objects_as_strings(dt)
-    return dt
+        from xarray_graph.utils.utils import encode_attr_value, ATTR_CODEC_VERSION
+    if array_attrs_min_size is not None:
+        import zlib
+    datasets = _subtree_datasets(dt)
+    prepared = {}
+    for path, ds in datasets.items():
+        attrs = ds.attrs
+        ordered_data_vars: tuple[str] = tuple(ds.data_vars)
+        if len(ordered_data_vars) > 1:
+            attrs[ORDERED_DATA_VARS_KEY] = ', '.join(ordered_data_vars)
+        elif ORDERED_DATA_VARS_KEY in attrs:
+            del attrs[ORDERED_DATA_VARS_KEY]
+        # compared to the parent's dataset before any of its inherited data_vars are removed
+        parent_path = _parent_path(path)
+        inherited = _inherited_data_var_names(ds, datasets[parent_path], compare_values) if parent_path else []
+        if inherited:
+            attrs[INHERITED_DATA_VARS_KEY] = ', '.join(inherited)
+            ds = ds.drop_vars(inherited)
+            # drop_vars returns a dataset with a copy of the attrs
+            attrs = ds.attrs
+        elif INHERITED_DATA_VARS_KEY in attrs:
+            del attrs[INHERITED_DATA_VARS_KEY]
+        if array_attrs_min_size is not None:
+            # names are unique to the node path, so they do not change with the tree structure (e.g., for updating existing stores)
+            ds = _store_array_attrs(ds, array_attrs_min_size, name_prefix=f'{ARRAY_ATTR_KEY}_{zlib.crc32(path.encode()):08x}')
+            attrs = ds.attrs
+        if flatten_attrs:
+            for key, value in attrs.items():
+                if isinstance(value, ATTRS_OBJECT_TYPES):
+                    attrs[key] = encode_attr_value(value)
+            if path == '/':
+                attrs[ATTRS_CODEC_KEY] = ATTR_CODEC_VERSION
+            # copy variables before changing their attrs as they are shared with the input tree
+            to_flatten = [name for name, var in ds.variables.items() if any(isinstance(value, ATTRS_OBJECT_TYPES) for value in var.attrs.values())]
+            if to_flatten:
+                ds = ds.copy(deep=False)
+                for name in to_flatten:
+                    var = ds.variables[name]
+                    for key, value in var.attrs.items():
+                        if isinstance(value, ATTRS_OBJECT_TYPES):
+                            var.attrs[key] = encode_attr_value(value)
+        prepared[path] = ds
+    return DataTree.from_dict(prepared, name=dt.name)
 
 
 def recover_post_deserialization(dt: DataTree, unflatten_attrs: bool = False) -> DataTree:
     """ Returns a new datatree ready for use post serialization.
+
+    Equivalent to restore_inherited_data_vars, restore_ordered_data_vars
+    (and restore_attrs_objects_from_strings if unflatten_attrs), but restores inheritance and ordering
+    together in a single traversal and builds the new tree from the resulting datasets at once.
+    Any array attrs stored in hidden data_vars are moved back into the attrs (see _restore_array_attrs).
     """
-    dt = restore_inherited_data_vars(dt)
-    dt = restore_ordered_data_vars(dt)
+    datasets = _subtree_datasets(dt)
     if unflatten_attrs:
-        dt = restore_attrs_objects_from_strings(dt)
+        decode = _attrs_decoder(datasets['/'].attrs.pop(ATTRS_CODEC_KEY, None))
+    recovered = {}
+    inherited_names: dict[str, list[str]] = {}
+    for path, ds in datasets.items():
+        attrs = ds.attrs
+        if unflatten_attrs:
+            for key, value in attrs.items():
+                if isinstance(value, str):
+                    attrs[key] = decode(value)
+            # copy variables before changing their attrs as they are shared with the input tree
+            to_unflatten = [name for name, var in ds.variables.items() if any(isinstance(value, str) for value in var.attrs.values())]
+            if to_unflatten:
+                ds = ds.copy(deep=False)
+                for name in to_unflatten:
+                    var = ds.variables[name]
+                    for key, value in var.attrs.items():
+                        if isinstance(value, str):
+                            var.attrs[key] = decode(value)
+        ds = _restore_array_attrs(ds)
+        attrs = ds.attrs
+        # parents are recovered before their children, so inherited data_vars are passed on down the tree
+        parent_path = _parent_path(path)
+        to_inherit = {}
+        inherited = attrs.get(INHERITED_DATA_VARS_KEY, None)
+        if parent_path and isinstance(inherited, str):
+            parent_ds = recovered[parent_path]
+            inherited = [name.strip() for name in inherited.split(',')]
+            to_inherit = {name: parent_ds.variables[name] for name in inherited if name in parent_ds.data_vars and name not in ds.data_vars}
+            if to_inherit:
+                inherited_names[path] = list(to_inherit)
+        ordered_data_vars = attrs.get(ORDERED_DATA_VARS_KEY, None)
+        if to_inherit or isinstance(ordered_data_vars, str):
+            data_vars = {name: ds.variables[name] for name in ds.data_vars}
+            data_vars.update(to_inherit)
+            if isinstance(ordered_data_vars, str):
+                ordered_data_vars = [name.strip() for name in ordered_data_vars.split(',')]
+                reordered_data_vars = {name: data_vars[name] for name in ordered_data_vars if name in data_vars}
+                for name in data_vars:
+                    if name not in reordered_data_vars:
+                        reordered_data_vars[name] = data_vars[name]
+                data_vars = reordered_data_vars
+            if to_inherit or tuple(ds.data_vars) != tuple(data_vars):
+                ds = Dataset(
+                    data_vars=data_vars,
+                    coords=ds.coords,
+                    attrs=attrs,
+                )
+        recovered[path] = ds
+    dt = DataTree.from_dict(recovered, name=dt.name)
+    # parents before children, so inherited data is shared down the tree
+    for path, names in inherited_names.items():
+        _share_inherited_data(dt[path], names)
     return dt
 
 
@@ -380,5 +836,53 @@ def test():
     # print(dt)
 
 
+def benchmark(n_groups: int = 50, n_children_per_group: int = 99, n_samples: int = 1000) -> None:
+    """ Time serialization prep and recovery on a tree of 1 + n_groups * (1 + n_children_per_group) nodes (5,000 by default).
+
+    Compares the single traversal in prepare_for_serialization and recover_post_deserialization
+    to running each of the individual steps in sequence.
+    """
+    import time
+    import numpy as np
+    time_coord = np.arange(n_samples) * 0.001
+    dt = DataTree(dataset=Dataset(
+        data_vars={'current': ('time', np.random.randn(n_samples)), 'voltage': ('time', np.random.randn(n_samples))},
+        coords={'time': time_coord},
+    ))
+    children = {}
+    for i in range(n_groups):
+        children[f'group{i}'] = DataTree(dataset=Dataset(data_vars={'baseline': ('time', np.random.randn(n_samples))}))
+        for j in range(n_children_per_group):
+            children[f'group{i}/sweep{j}'] = DataTree(dataset=Dataset(data_vars={'fit': ('time', np.random.randn(n_samples))}))
+    dt = DataTree.from_dict({'/': dt.to_dataset(), **{path: node.to_dataset() for path, node in children.items()}})
+    dt = inherit_missing_data_vars(dt)
+    n_nodes = len(list(dt.subtree))
+
+    t0 = time.perf_counter()
+    sequential = store_ordered_data_vars(dt)
+    sequential = store_inherited_data_vars(sequential)
+    sequential = remove_inherited_data_vars(sequential)
+    t_prepare_sequential = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    prepared = prepare_for_serialization(dt)
+    t_prepare = time.perf_counter() - t0
+    assert prepared.identical(sequential)
+
+    t0 = time.perf_counter()
+    sequential = restore_inherited_data_vars(prepared)
+    sequential = restore_ordered_data_vars(sequential)
+    t_recover_sequential = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    recovered = recover_post_deserialization(prepared)
+    t_recover = time.perf_counter() - t0
+    assert recovered.identical(sequential)
+
+    print(f'{n_nodes} nodes')
+    print(f'prepare_for_serialization:    {t_prepare:.3f} sec (sequential steps {t_prepare_sequential:.3f} sec)')
+    print(f'recover_post_deserialization: {t_recover:.3f} sec (sequential steps {t_recover_sequential:.3f} sec)')
+
+
 if __name__ == '__main__':
     test()
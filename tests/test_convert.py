@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+import pytest
+
+np = pytest.importorskip('numpy')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('pint')
+pytest.importorskip('scipy')
+
+EXAMPLES = Path(__file__).parent.parent / 'examples'
+
+
+def test_convert_labchart_without_qt(tmp_path, monkeypatch):
+    pytest.importorskip('zarr')
+    from xarray_graph.io.convert import convert_file
+    from xarray_graph.io.io import open_datatree
+    from xarray_graph.io.labchart import read_adicht_mat
+    from xarray_graph.utils.xarray_utils import ROI_KEY
+    # conversion is headless, so it must not need Qt
+    monkeypatch.setitem(sys.modules, 'qtpy', None)
+    input_path = EXAMPLES / 'LabChartTEVC.mat'
+    output_path = tmp_path / 'LabChartTEVC.zarr'
+    assert convert_file(input_path, output_path) == input_path.stat().st_size
+    converted = open_datatree(output_path)
+    expected = read_adicht_mat(input_path)
+    xr.testing.assert_identical(converted.to_dataset().drop_attrs(), expected.to_dataset().drop_attrs())
+    assert converted.attrs[ROI_KEY] == expected.attrs[ROI_KEY]
@@ -0,0 +1,88 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def trace():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 10)
+    y[500] = 5
+    y[700:720] = np.nan
+    return x, y
+
+
+@pytest.fixture
+def long_trace():
+    x = np.arange(100_003, dtype=float)
+    y = np.random.default_rng(0).standard_normal(len(x))
+    y[40_000:40_100] = np.nan
+    return x, y
+
+
+def test_minmax_envelope(trace):
+    from xarray_graph.utils.decimation import minmax_envelope, minmax_envelope_block
+    x, y = trace
+    xenv, yenv = minmax_envelope(x, y, 100)
+    assert len(xenv) == len(yenv) == 200
+    assert np.nanmax(yenv) == 5
+    # two all NaN bins
+    assert np.isnan(yenv).sum() == 2 * 2
+    assert np.all(np.diff(xenv) >= 0)
+    xenv2, yenv2 = minmax_envelope_block(x, np.stack([y, -y]), 100)
+    assert np.array_equal(xenv2, xenv) and np.array_equal(yenv2[0], yenv, equal_nan=True)
+    assert np.nanmin(yenv2[1]) == -5
+
+
+def test_short_traces_are_not_decimated(trace):
+    from xarray_graph.utils.decimation import minmax_envelope
+    x, y = trace
+    xenv, yenv = minmax_envelope(x, y, 1000)
+    assert np.array_equal(xenv, x) and np.array_equal(yenv, y, equal_nan=True)
+
+
+def test_decimate_for_view_preserves_data_bounds(trace):
+    from xarray_graph.utils.decimation import decimate_for_view
+    x, y = trace
+    xenv, yenv = decimate_for_view(x, y, (100, 200), 50)
+    assert xenv[0] == x[0] and xenv[-1] == x[-1]
+    assert np.nanmax(yenv) == np.nanmax(y) and np.nanmin(yenv) == np.nanmin(y)
+
+
+@pytest.mark.parametrize('start, stop, n_bins', [(0, 100_003, 100), (12_345, 67_891, 50), (39_990, 40_200, 3), (100, 120, 10)])
+def test_pyramid_envelope_preserves_part_bounds(long_trace, start, stop, n_bins):
+    from xarray_graph.utils.decimation import MinMaxPyramid
+    x, y = long_trace
+    xenv, yenv = MinMaxPyramid(y).envelope(x, y, n_bins, start, stop)
+    assert xenv[0] == x[start] and xenv[-1] == x[stop - 1]
+    assert np.all(np.diff(xenv) >= 0)
+    assert np.nanmax(yenv) == np.nanmax(y[start:stop]) and np.nanmin(yenv) == np.nanmin(y[start:stop])
+    assert len(yenv) <= 4 * n_bins + 4 or stop - start <= 2 * n_bins
+
+
+def test_decimate_for_view_with_pyramid(long_trace):
+    from xarray_graph.utils.decimation import MinMaxPyramid, decimate_for_view
+    x, y = long_trace
+    xenv, yenv = decimate_for_view(x, y, (500, 600), 100, MinMaxPyramid(y))
+    assert np.nanmax(yenv) == np.nanmax(y) and np.nanmin(yenv) == np.nanmin(y)
+
+
+def test_pyramid_cache(long_trace, tmp_path):
+    pytest.importorskip('zarr')
+    from xarray_graph.utils.decimation import MinMaxPyramid, PyramidCache, pyramid_store_path
+    _, y = long_trace
+    pyramid = MinMaxPyramid(y)
+    cache = PyramidCache(max_bytes=2 * pyramid.nbytes, store_path=pyramid_store_path(tmp_path / 'data.zarr'))
+    cache.put(('/a', 'y'), pyramid)
+    cache.put(('/a/b', 'y'), MinMaxPyramid(y))
+    cache.put(('/c', 'y'), MinMaxPyramid(y))
+    assert len(cache) == 2 and cache.nbytes <= cache.max_bytes
+    # evicted from memory, but read back from the store
+    assert cache.get(('/a', 'y'), y) is not None
+    assert cache.get(('/a', 'y'), y[::-1]) is None
+    cache.put(('/a', 'y'), pyramid)
+    cache.invalidate('/a')
+    cache.clear()
+    assert cache.get(('/a', 'y'), y) is None
+    assert cache.get(('/a/b', 'y'), y) is None
+    assert cache.get(('/c', 'y'), y) is not None
@@ -0,0 +1,188 @@
+from pathlib import Path
+import pytest
+
+np = pytest.importorskip('numpy')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('pint')
+
+
+def inherited_datatree():
+    from xarray_graph.utils.xarray_utils import inherit_missing_data_vars
+    n = 100
+    dt = xr.DataTree.from_dict({
+        '/': xr.Dataset({'I': ('time', np.random.randn(n)), 'V': ('time', np.random.randn(n))}, coords={'time': np.arange(n) * 0.001}),
+        'g1': xr.Dataset({'fit': ('time', np.random.randn(n))}),
+    })
+    return inherit_missing_data_vars(dt)
+
+
+def stored_data_vars(filepath, path):
+    engine = 'zarr' if filepath.suffix == '.zarr' else None
+    with xr.open_datatree(filepath, engine=engine) as dt:
+        return list(dt[path].to_dataset(inherit=False).data_vars)
+
+
+@pytest.mark.parametrize('suffix', ['.zarr', '.h5'])
+@pytest.mark.parametrize('read', ['values', 'load'])
+def test_inherited_data_vars_survive_open_read_save(tmp_path, suffix, read):
+    if suffix == '.zarr':
+        pytest.importorskip('zarr')
+    else:
+        pytest.importorskip('h5netcdf')
+    from xarray_graph.io.io import open_datatree, save_datatree
+    save_datatree(inherited_datatree(), tmp_path / f'a{suffix}')
+    dt = open_datatree(tmp_path / f'a{suffix}')
+    if read == 'values':
+        dt['g1/I'].values
+    else:
+        dt.load()
+    assert list(dt['g1'].data_vars) == ['fit', 'I', 'V']
+    save_datatree(dt, tmp_path / f'b{suffix}')
+    assert stored_data_vars(tmp_path / f'b{suffix}', 'g1') == ['fit']
+
+
+@pytest.mark.parametrize('array_attrs_min_size', [None, 1000])
+def test_save_h5_with_inherited_data_vars_and_nested_attrs(tmp_path, array_attrs_min_size):
+    pytest.importorskip('h5netcdf')
+    from xarray_graph.io.io import open_datatree, save_datatree
+    dt = inherited_datatree()
+    dt['g1'].attrs['info'] = {'a': 1, 'b': [1, 2]}
+    save_datatree(dt, tmp_path / 'a.h5', array_attrs_min_size=array_attrs_min_size)
+    dt = open_datatree(tmp_path / 'a.h5')
+    assert dt['g1'].attrs['info'] == {'a': 1, 'b': [1, 2]}
+    assert list(dt['g1'].data_vars) == ['fit', 'I', 'V']
+
+
+def test_canceled_zarr_update_leaves_store_unchanged(tmp_path):
+    pytest.importorskip('zarr')
+    from xarray_graph.io.io import open_datatree, save_datatree, SaveCanceled
+    from xarray_graph.utils.ChangeTracker import ChangeTracker
+    filepath = tmp_path / 'a.zarr'
+    save_datatree(inherited_datatree(), filepath)
+    files = {path: path.read_bytes() for path in filepath.rglob('*') if path.is_file()}
+    dt = open_datatree(filepath)
+    dt.load()
+    dt['I'].values[:] = 0
+    dt['g1/fit'].values[:] = 0
+    changes = ChangeTracker()
+    changes.clear()
+    changes.markVariableChanged('/', 'I')
+    changes.markVariableChanged('/g1', 'fit')
+    calls = []
+
+    def progress(n_written, n_total, path):
+        calls.append((n_written, n_total, path))
+        return n_written < 1
+
+    with pytest.raises(SaveCanceled):
+        save_datatree(dt, filepath, changes=changes, progress=progress)
+    assert calls == [(0, 2, '/I'), (1, 2, '/g1/fit')]
+    assert {path: path.read_bytes() for path in filepath.rglob('*') if path.is_file()} == files
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['a.zarr']
+
+
+def test_zarr_update_keeps_node_attrs(tmp_path):
+    pytest.importorskip('zarr')
+    from xarray_graph.io.io import open_datatree, save_datatree
+    from xarray_graph.utils.ChangeTracker import ChangeTracker
+    filepath = tmp_path / 'a.zarr'
+    save_datatree(inherited_datatree(), filepath)
+    dt = open_datatree(filepath)
+    dt.load()
+    dt['g1/fit'].values[:] = 0
+    changes = ChangeTracker()
+    changes.clear()
+    changes.markVariableChanged('/g1', 'fit')
+    save_datatree(dt, filepath, changes=changes)
+    assert open_datatree(filepath).identical(dt)
+
+
+def test_change_tracker_accumulates_regions():
+    from xarray_graph.utils.ChangeTracker import ChangeTracker
+    changes = ChangeTracker()
+    assert changes.isAllChanged()
+    changes.clear()
+    assert not changes.isChanged()
+    changes.markVariableChanged('g1', 'I', {'sweep': slice(1, 2), 'time': slice(10, 20)})
+    changes.markVariableChanged('/g1/', 'I', {'sweep': slice(3, 4), 'time': slice(0, 5)})
+    assert changes.changedVariables('/g1') == {'I': {'sweep': slice(1, 4), 'time': slice(0, 20)}}
+    # regions over different dims are merged into the entire variable
+    changes.markVariableChanged('/g1', 'I', {'time': slice(0, 1)})
+    assert changes.changedVariables('/g1') == {'I': None}
+    changes.markNodeChanged('g2/')
+    assert changes.changedNodes() == {'/g2'} and changes.isChanged()
+
+
+def sweeps_datatree(n_sweeps=4, n_samples=100):
+    from xarray_graph.utils.xarray_utils import inherit_missing_data_vars
+    rng = np.random.default_rng(0)
+    dt = xr.DataTree.from_dict({
+        '/': xr.Dataset({'I': (('sweep', 'time'), rng.standard_normal((n_sweeps, n_samples)))}, coords={'time': np.arange(n_samples) * 0.001}),
+        'g1': xr.Dataset({'fit': (('sweep', 'time'), rng.standard_normal((n_sweeps, n_samples)))}),
+        'g2': xr.Dataset({'x': ('time', rng.standard_normal(n_samples))}),
+    })
+    return inherit_missing_data_vars(dt)
+
+
+def file_inodes(filepath):
+    return {path.relative_to(filepath): path.stat().st_ino for path in filepath.rglob('*') if path.is_file()}
+
+
+def without_bookkeeping_attrs(dt):
+    def drop(ds):
+        return ds.drop_attrs(deep=False).assign_attrs({key: value for key, value in ds.attrs.items() if not key.startswith('_XG_')})
+    return dt.map_over_datasets(drop)
+
+
+def test_zarr_update_writes_only_changes(tmp_path):
+    pytest.importorskip('zarr')
+    from xarray_graph.io.io import open_datatree, save_datatree
+    from xarray_graph.utils.ChangeTracker import ChangeTracker
+    filepath = tmp_path / 'a.zarr'
+    # one chunk per sweep
+    save_datatree(sweeps_datatree(), filepath, encoding={'/': {'I': {'chunks': (1, 100)}}})
+    inodes = file_inodes(filepath)
+    dt = open_datatree(filepath)
+    dt.load()
+    changes = ChangeTracker()
+    changes.clear()
+    # edit of an inherited data_var within a region is written to the node it is inherited from
+    dt['g1/I'].values[1] = 0
+    changes.markVariableChanged('/g1', 'I', {'sweep': slice(1, 2), 'time': slice(0, 100)})
+    # changed node is rewritten with its subtree
+    dt['g2/x'].values[:] = 1
+    changes.markNodeChanged('/g2')
+    # new and removed data_vars and attrs changes are synced without being recorded
+    dt['g1'].dataset = dt['g1'].to_dataset().drop_vars('fit').assign(new=('time', np.ones(100)))
+    dt['time'].attrs['units'] = 's'
+    dt['g1'].attrs['note'] = 'fit removed'
+    save_datatree(dt, filepath, changes=changes)
+
+    saved = open_datatree(filepath)
+    assert without_bookkeeping_attrs(saved).identical(without_bookkeeping_attrs(dt))
+    assert np.all(saved['I'].values[1] == 0)
+    with xr.open_datatree(filepath, engine='zarr') as stored:
+        assert list(stored['g1'].to_dataset(inherit=False).data_vars) == ['new']
+    # chunks of unchanged sweeps are the same files (hard links) as before the update
+    new_inodes = file_inodes(filepath)
+    assert sorted(path for path in inodes if path in new_inodes and new_inodes[path] == inodes[path] and 'c' in path.parts) == [Path(path) for path in ['I/c/0/0', 'I/c/2/0', 'I/c/3/0', 'time/c/0']]
+
+
+def test_zarr_update_writes_edits_to_all_nodes_sharing_data(tmp_path):
+    pytest.importorskip('zarr')
+    from xarray_graph.io.io import open_datatree, save_datatree
+    from xarray_graph.utils.ChangeTracker import ChangeTracker
+    filepath = tmp_path / 'a.zarr'
+    save_datatree(sweeps_datatree(), filepath)
+    dt = open_datatree(filepath)
+    dt.load()
+    # inherited data_var with changed attrs is stored separately but still shares its data with the root
+    dt['I'].attrs['units'] = 'pA'
+    dt['g1/I'].values[1] = 0
+    changes = ChangeTracker()
+    changes.clear()
+    changes.markVariableChanged('/g1', 'I', {'sweep': slice(1, 2), 'time': slice(0, 100)})
+    save_datatree(dt, filepath, changes=changes)
+    saved = open_datatree(filepath)
+    assert without_bookkeeping_attrs(saved).identical(without_bookkeeping_attrs(dt))
+    assert np.all(saved['I'].values[1] == 0) and np.all(saved['g2/I'].values[1] == 0)
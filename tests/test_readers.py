@@ -0,0 +1,70 @@
+from pathlib import Path
+import pytest
+
+np = pytest.importorskip('numpy')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('pint')
+
+EXAMPLES = Path(__file__).parent.parent / 'examples'
+
+
+def assert_saved_data_equal(datatree, tmp_path):
+    """ Data of datatree is unchanged after saving to and reopening from Zarr and HDF5.
+    """
+    pytest.importorskip('zarr')
+    pytest.importorskip('h5netcdf')
+    from xarray_graph.io.io import open_datatree, save_datatree
+    for filename in ['saved.zarr', 'saved.h5']:
+        save_datatree(datatree, tmp_path / filename)
+        saved = open_datatree(tmp_path / filename)
+        for node in datatree.subtree:
+            xr.testing.assert_equal(saved[node.path].to_dataset(), node.to_dataset())
+
+
+def test_heka(tmp_path):
+    from xarray_graph.io.heka import read_heka, _write_synthetic_bundle
+    filepath = tmp_path / 'synthetic.dat'
+    _write_synthetic_bundle(filepath, n_groups=2, n_series=2, n_sweeps=3, n_samples=50)
+    datatree = read_heka(filepath)
+    assert [node.path for node in datatree.children.values()] == ['/Group1', '/Group2']
+    current = datatree['Group2/Imon']
+    assert current.dims == ('series', 'sweep', 'time') and current.shape == (2, 3, 50)
+    # int16 ramps scaled by 1e-3
+    assert np.allclose(current.values, np.arange(50) * 1e-3)
+    assert np.allclose(np.diff(datatree['Group1/time'].values), 1e-4)
+    assert read_heka(filepath, lazy=True).load().identical(datatree)
+    packed = read_heka(filepath, packed=True)
+    assert packed.identical(datatree)
+    assert packed['Group1/Imon'].encoding['dtype'] == np.int16
+    assert_saved_data_equal(packed, tmp_path)
+
+
+@pytest.mark.parametrize('n_sweeps', [1, 3])
+def test_abf(tmp_path, n_sweeps):
+    from xarray_graph.io.abf import read_abf, _write_synthetic_abf
+    filepath = tmp_path / 'synthetic.abf'
+    _write_synthetic_abf(filepath, n_channels=2, n_sweeps=n_sweeps, n_samples=500)
+    datatree = read_abf(filepath)
+    assert list(datatree.data_vars) == ['IN 0', 'IN 1']
+    assert datatree['IN 0'].shape == (n_sweeps, 500)
+    assert np.array_equal(datatree['sweep'].values, np.arange(1, n_sweeps + 1))
+    # int16 ramps scaled by ADC range / resolution / instrument scale factor
+    ramp = np.arange(500) * 10 / 32768
+    assert np.allclose(datatree['IN 0'].values, ramp / 0.5)
+    assert np.allclose(datatree['IN 1'].values, ramp / 0.01)
+    packed = read_abf(filepath, packed=True)
+    assert packed['IN 0'].encoding['dtype'] == np.int16
+    xr.testing.assert_allclose(packed.to_dataset(), datatree.to_dataset())
+    assert_saved_data_equal(datatree, tmp_path)
+
+
+def test_winwcp(tmp_path):
+    from xarray_graph.io.winwcp import read_winwcp
+    filepath = EXAMPLES / 'WinWCP.wcp'
+    datatree = read_winwcp(filepath)
+    assert datatree.data_vars
+    assert read_winwcp(filepath, lazy=True).load().identical(datatree)
+    packed = read_winwcp(filepath, packed=True)
+    for name, data_var in datatree.data_vars.items():
+        xr.testing.assert_allclose(packed[name], data_var)
+    assert_saved_data_equal(datatree, tmp_path)
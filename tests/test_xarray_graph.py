@@ -0,0 +1,36 @@
+import os
+import pytest
+
+np = pytest.importorskip('numpy')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('pint')
+pytest.importorskip('qtpy')
+pytest.importorskip('pyqtgraph')
+
+
+@pytest.fixture
+def app():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qtpy.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+def test_display_coords_are_converted_once(app):
+    from xarray_graph.apps.XarrayGraph import XarrayGraph
+    dt = xr.DataTree.from_dict({
+        '/': xr.Dataset({'I': (('sweep', 'time'), np.random.randn(3, 1000), {'units': 'mA'})}, coords={'time': ('time', np.arange(1000.), {'units': 'ms'})}),
+    })
+    window = XarrayGraph()
+    try:
+        window.setDatatree(dt)
+        window._datatree_view.selectAll()
+        app.processEvents()
+        cache = window._display_coords_cache
+        # only the time coord needs converting (to seconds)
+        assert [units for _, _, units in cache.values()] == ['s']
+        converted = {key: data for key, (_, data, _) in cache.items()}
+        window.onDataTreeSelectionChanged()
+        assert {key: data for key, (_, data, _) in cache.items()}.keys() == converted.keys()
+        assert all(cache[key][1] is data for key, data in converted.items())
+    finally:
+        window.close()
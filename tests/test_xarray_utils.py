@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('pint')
+
+
+def test_shares_data_with_array_indexers():
+    from xarray.core import indexing
+    from xarray_graph.utils.xarray_utils import shares_data
+    array = indexing.NumpyIndexingAdapter(np.arange(20).reshape(4, 5))
+
+    def indexed(rows):
+        return xr.Variable(('x', 'y'), indexing.LazilyIndexedArray(array, indexing.OuterIndexer((np.array(rows), slice(None)))))
+
+    assert shares_data(indexed([0, 2]), indexed([0, 2]))
+    assert not shares_data(indexed([0, 2]), indexed([0, 3]))
+
+
+def test_inherited_root():
+    from xarray_graph.utils.xarray_utils import inherit_missing_data_vars, inherited_root
+    dt = xr.DataTree.from_dict({
+        '/': xr.Dataset({'I': ('time', np.zeros(10))}),
+        'g1': xr.Dataset({'fit': ('time', np.zeros(10))}),
+        'g1/g2': xr.Dataset({'I': ('time', np.zeros(10))}),
+    })
+    dt = inherit_missing_data_vars(dt)
+    assert inherited_root(dt['g1'], 'I') is dt
+    assert inherited_root(dt['g1'], 'fit') is dt['g1']
+    assert inherited_root(dt['g1/g2'], 'fit') is dt['g1']
+    assert inherited_root(dt['g1/g2'], 'I') is dt['g1/g2']
+
+
+def test_equal_but_not_shared_data_vars_are_not_inherited():
+    from xarray_graph.utils.xarray_utils import prepare_for_serialization, INHERITED_DATA_VARS_KEY
+    dt = xr.DataTree.from_dict({
+        '/': xr.Dataset({'I': ('time', np.zeros(10))}),
+        'g1': xr.Dataset({'I': ('time', np.zeros(10))}),
+    })
+    assert list(prepare_for_serialization(dt)['g1'].data_vars) == ['I']
+    prepared = prepare_for_serialization(dt, compare_values=True)
+    assert list(prepared['g1'].data_vars) == []
+    assert prepared['g1'].attrs[INHERITED_DATA_VARS_KEY] == 'I'
+
+
+def test_inherited_root_ignores_attrs():
+    from xarray_graph.utils.xarray_utils import inherit_missing_data_vars, inherited_root
+    dt = xr.DataTree.from_dict({
+        '/': xr.Dataset({'I': ('time', np.zeros(10))}),
+        'g1': xr.Dataset({'fit': ('time', np.zeros(10))}),
+    })
+    dt = inherit_missing_data_vars(dt)
+    dt['I'].attrs['units'] = 'pA'
+    assert inherited_root(dt['g1'], 'I') is dt